@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+
+Times the hot paths of the lookups and the server:
+
+parse_pacificeast           PacificEast._parse of each lookup fixture of test_pacificeast
+parse_pacificeast_lookdown  PacificEast._parse_lookdown of the lookdown fixtures of test_pacificeast
+parse_whitepages            WhitePages._parse of each fixture of test_whitepages
+lookups_<N>                 do_lookups of N numbers through MockVendor, end to end
+geocoding_<N>               do_geocoding of N looked-up numbers with MockGeocoder, end to end
+server_api                  server.api requests for distinct addresses with MockVendor
+
+Each benchmark reports its throughput (ops/sec), the percentiles of the time
+of each call and the peak memory of a call (measured in a separate call with
+tracemalloc, so as not to slow down the timed calls).
+
+python bench/run.py                      # run the default benchmarks
+python bench/run.py --sizes 10k,100k,1m  # end-to-end runs of 10k, 100k and 1M numbers
+python bench/run.py --only parse         # benchmarks whose names start with "parse"
+python bench/run.py --save               # save the results as the baseline
+python bench/run.py --compare            # fail if ops/sec dropped more than --threshold below the baseline
+
+The baseline is kept in bench/baseline.json. Timings depend on the machine,
+so save a baseline on the machine that you compare on.
+"""
+# Python
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "test"))
+
+# 3rd Party
+from pyramid.testing import DummyRequest
+import simplejson as json
+# * * *
+from checkpoint import Checkpointer
+from geocode_mock import MockGeocoder
+from vendor import Vendor
+from vendor_mock import MockVendor
+from vendor_pacificeast import PacificEast
+from vendor_whitepages import WhitePages
+import main
+import server
+import test_pacificeast
+import test_whitepages
+
+log = logging.getLogger(__name__)
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_SIZES = "10k"
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_THRESHOLD = 0.2
+SIZES = {"k": 1000, "m": 1000000}
+
+class Benchmark(object):
+
+  def __init__(self, name, run, prepare=None, ops=1, min_calls=5):
+    """
+    Args:
+      name (str): name of the benchmark
+      run (callable): run(arg) performs one call of the benchmark
+      prepare (callable): returns the arg of each call, untimed (None to pass None)
+      ops (int): number of operations performed by each call
+      min_calls (int): least number of calls to time
+    """
+    self.name = name
+    self.run = run
+    self.prepare = prepare or (lambda: None)
+    self.ops = ops
+    self.min_calls = min_calls
+
+  def measure(self, min_time=DEFAULT_MIN_TIME):
+    """
+    Time calls of the benchmark for at least min_time seconds, then measure the peak memory of one more
+
+    Returns:
+      dict: ops_per_sec, calls, p50, p95 and p99 (seconds per call) and peak_kb
+    """
+
+    times = []
+    total = 0.0
+    while len(times) < self.min_calls or total < min_time:
+      arg = self.prepare()
+      start = time.perf_counter()
+      self.run(arg)
+      elapsed = time.perf_counter() - start
+      times.append(elapsed)
+      total += elapsed
+
+    arg = self.prepare()
+    tracemalloc.start()
+    try:
+      self.run(arg)
+      _, peak = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+
+    times.sort()
+    return {
+      "ops_per_sec": self.ops * len(times) / total,
+      "calls": len(times),
+      "p50": _percentile(times, 0.50),
+      "p95": _percentile(times, 0.95),
+      "p99": _percentile(times, 0.99),
+      "peak_kb": peak / 1024,
+    }
+
+def get_benchmarks(sizes, tmpdir):
+  """
+  Return the benchmarks
+
+  Args:
+    sizes (list of int): numbers of numbers of the end-to-end benchmarks
+    tmpdir (str): directory for the files written by the benchmarks
+
+  Returns:
+    list of Benchmarks
+  """
+
+  benchmarks = []
+
+  # Parsing
+  pe = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
+  lookups = [test_pacificeast.XML_MULTIPLE_CONTACTS, test_pacificeast.XML_NO_RESULT]
+  lookdowns = [test_pacificeast.XML_RAD_RESULT, test_pacificeast.XML_RAD_NO_RESULTS]
+  benchmarks.append(Benchmark("parse_pacificeast", lambda _: [pe._parse(xml) for xml in lookups], ops=len(lookups), min_calls=100))
+  benchmarks.append(Benchmark("parse_pacificeast_lookdown", lambda _: [pe._parse_lookdown(xml) for xml in lookdowns], ops=len(lookdowns), min_calls=100))
+
+  wp = Vendor.get("WhitePages", config={"api_key": "1234"})
+  bodies = [s.encode("utf-8") for s in (test_whitepages.JSON_GOOD, test_whitepages.JSON_NO_NAME, test_whitepages.JSON_BEST_LOCATION)]
+  benchmarks.append(Benchmark("parse_whitepages", lambda _: [wp._parse(body) for body in bodies], ops=len(bodies), min_calls=100))
+
+  # End to end, checkpointing by time only so that the run isn't dominated by rewriting the whole file
+  path = os.path.join(tmpdir, "numbers.json")
+  waterfall = [MockVendor({})]
+  geocoder = MockGeocoder({})
+
+  def lookups_of(count):
+    return [{"number": "{:010d}".format(3100000000 + i)} for i in range(count)]
+
+  def looked_up(count):
+    numbers = lookups_of(count)
+    for number in numbers:
+      number["vendor"] = "mock"
+      number["vendors_checked"] = ["mock"]
+      number["contacts"] = waterfall[0].lookup(number["number"]).contacts
+    return numbers
+
+  checkpointer = lambda: Checkpointer(path, every_records=None, generations=0)
+  for size in sizes:
+    benchmarks.append(Benchmark(
+      "lookups_{}".format(_size_name(size)),
+      lambda numbers: main.do_lookups(numbers, waterfall, path, runall=True, checkpointer=checkpointer()),
+      prepare=lambda size=size: lookups_of(size),
+      ops=size,
+      min_calls=1))
+    benchmarks.append(Benchmark(
+      "geocoding_{}".format(_size_name(size)),
+      lambda numbers: main.do_geocoding(numbers, geocoder, path, runall=True, checkpointer=checkpointer()),
+      prepare=lambda size=size: looked_up(size),
+      ops=size,
+      min_calls=1))
+
+  # Server
+  requests = []
+  for i in range(100):
+    request = DummyRequest()
+    request.params = {
+      "sid": server.SID, "token": server.TOKEN,
+      "address": "{} Main St".format(i), "city": "Anytown", "state": "CA", "postalCode": "01234", "country": "US"}
+    requests.append(request)
+
+  def api(_):
+    for request in requests:
+      server.api(request)
+
+  server.VENDORS = waterfall
+  benchmarks.append(Benchmark("server_api", api, ops=len(requests), min_calls=10))
+
+  return benchmarks
+
+def compare(results, baseline, threshold):
+  """
+  Compare the results with the baseline
+
+  Args:
+    results (dict): results of each benchmark
+    baseline (dict): baseline results of each benchmark
+    threshold (float): fraction of the baseline ops/sec that may be lost before it is a regression
+
+  Returns:
+    list of str: the benchmarks that regressed
+  """
+
+  regressions = []
+  for name, result in sorted(results.items()):
+    if name not in baseline:
+      continue
+    change = result["ops_per_sec"] / baseline[name]["ops_per_sec"] - 1
+    print("{:<28} {:>+8.1%} ops/sec vs baseline".format(name, change))
+    if change < -threshold:
+      regressions.append(name)
+  return regressions
+
+def run_benchmarks():
+  """
+  Run the benchmarks
+  """
+
+  parser = argparse.ArgumentParser(description="Phone Lookup Benchmarks")
+  parser.add_argument("--only",      type=str,                                help="Only run the benchmarks whose names start with this")
+  parser.add_argument("--sizes",     type=str,   default=DEFAULT_SIZES,     help="Comma-separated numbers of numbers of the end-to-end runs (e.g. '10k,100k,1m')")
+  parser.add_argument("--min_time",  type=float, default=DEFAULT_MIN_TIME,  help="Seconds to time each benchmark for, at least")
+  parser.add_argument("--save",      action="store_true",                   help="Save the results as the baseline")
+  parser.add_argument("--compare",   action="store_true",                   help="Fail if ops/sec dropped below the baseline by more than --threshold")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Fraction of the baseline ops/sec that may be lost (default 0.2)")
+  parser.add_argument("--baseline",  type=str,   default=BASELINE_PATH,     help="Path of the baseline")
+  args = parser.parse_args()
+
+  # Keep the runs quiet
+  logging.basicConfig(level=logging.WARNING)
+
+  sizes = [_parse_size(size) for size in args.sizes.split(",") if size]
+  results = {}
+  with tempfile.TemporaryDirectory() as tmpdir:
+    print("{:<28} {:>12} {:>7} {:>10} {:>10} {:>10} {:>10}".format("benchmark", "ops/sec", "calls", "p50", "p95", "p99", "peak KB"))
+    for benchmark in get_benchmarks(sizes, tmpdir):
+      if args.only and not benchmark.name.startswith(args.only):
+        continue
+      result = benchmark.measure(min_time=args.min_time)
+      results[benchmark.name] = result
+      print("{:<28} {:>12,.0f} {:>7} {:>10} {:>10} {:>10} {:>10,.0f}".format(
+        benchmark.name, result["ops_per_sec"], result["calls"],
+        _duration(result["p50"]), _duration(result["p95"]), _duration(result["p99"]), result["peak_kb"]))
+
+  if args.save:
+    baseline = {}
+    if os.path.exists(args.baseline):
+      with open(args.baseline) as f:
+        baseline = json.load(f)
+    baseline.update(results)
+    with open(args.baseline, "w") as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+    print("Saved the baseline to {}".format(args.baseline))
+
+  if args.compare:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+      print("Regressed: {}".format(", ".join(regressions)))
+      sys.exit(1)
+
+def _percentile(times, fraction):
+  """ Return the fraction percentile of the sorted times """
+  return times[min(len(times) - 1, int(fraction * len(times)))]
+
+def _duration(seconds):
+  """ Format seconds for the report """
+  if seconds < 1e-3:
+    return "{:.1f}us".format(seconds * 1e6)
+  if seconds < 1:
+    return "{:.2f}ms".format(seconds * 1e3)
+  return "{:.2f}s".format(seconds)
+
+def _parse_size(size):
+  """ Return the number of a size such as "10k" or "1m" """
+  size = size.strip().lower()
+  if size[-1] in SIZES:
+    return int(size[:-1]) * SIZES[size[-1]]
+  return int(size)
+
+def _size_name(size):
+  """ Return the name of a size, e.g. "10k" for 10000 """
+  for suffix, multiple in sorted(SIZES.items(), key=lambda item: -item[1]):
+    if size >= multiple and size % multiple == 0:
+      return "{}{}".format(size // multiple, suffix)
+  return str(size)
+
+if __name__ == "__main__":
+  run_benchmarks()
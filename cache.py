@@ -0,0 +1,414 @@
+"""
+Cache
+
+Size-bounded key/value caches with a time-to-live, for the results of vendor
+lookups and other API calls:
+
+LRUCache:    in memory, evicting the least recently used entries
+DiskCache:   in an SQLite file shared across runs, evicting the least recently
+             used entries
+TieredCache: an LRUCache in front of an optional DiskCache
+
+Keys are strings and values are anything that can be serialized as JSON.
+Values are stored serialized, so every get() returns a fresh copy that the
+caller is free to modify. Each entry has its own TTL, so that e.g. misses can
+be kept for less time than hits. All of the caches are thread-safe and count
+their hits, misses and evictions.
+
+SingleFlight coalesces concurrent calls for the same key, so that a value
+missing from a cache is only computed once however many threads ask for it.
+"""
+# Python
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+class LRUCache(object):
+
+  def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+    """
+    Args:
+      max_size (int): maximum number of entries
+      ttl (float): default number of seconds to keep an entry (None to keep it until evicted)
+    """
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    """
+    Return the value cached for key
+
+    Args:
+      key (str): key of the entry
+
+    Returns:
+      the value, or None if key is not cached or has expired
+    """
+
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[1] is not None and entry[1] <= time.time():
+        del self._entries[key]
+        entry = None
+
+      if entry is None:
+        self.misses += 1
+        return None
+
+      self._entries.move_to_end(key)
+      self.hits += 1
+      data = entry[0]
+
+    return json.loads(data)
+
+  def put(self, key, value, ttl=None):
+    """
+    Cache value for key, evicting the least recently used entries as needed
+
+    Args:
+      key (str): key of the entry
+      value: value to cache (JSON-serializable)
+      ttl (float): number of seconds to keep the entry (default is the cache's ttl)
+
+    Returns:
+      None
+    """
+
+    data = json.dumps(value, separators=(",", ":"))
+    expires = _expires(self.ttl if ttl is None else ttl)
+
+    with self._lock:
+      self._entries[key] = (data, expires)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def stats(self):
+    """
+    Return the cache's counters
+
+    Returns:
+      dict: size, hits, misses and evictions
+    """
+    return {"size": len(self), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+  def close(self):
+    pass
+
+class DiskCache(object):
+
+  def __init__(self, path, max_size=DEFAULT_MAX_SIZE * 10, ttl=DEFAULT_TTL):
+    """
+    Args:
+      path (str): path of the SQLite cache file
+      max_size (int): maximum number of entries
+      ttl (float): default number of seconds to keep an entry (None to keep it until evicted)
+    """
+    self.path = path
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self._lock = threading.Lock()
+    # Last use of the entries read since the last write, saved with the next put() so that reads don't write
+    self._used = {}
+    self._db = sqlite3.connect(path, check_same_thread=False)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.executescript("""
+      CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires REAL,
+        used REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS cache_used ON cache (used);
+      """)
+
+    # Drop the entries that expired since the last run
+    self._db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+    self._db.commit()
+    self._size = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+  def __len__(self):
+    return self._size
+
+  def get(self, key):
+    """
+    Return the value cached for key
+
+    Args:
+      key (str): key of the entry
+
+    Returns:
+      the value, or None if key is not cached or has expired
+    """
+    return self.get_with_ttl(key)[0]
+
+  def get_with_ttl(self, key):
+    """
+    Return the value cached for key and the number of seconds it has left
+
+    Args:
+      key (str): key of the entry
+
+    Returns:
+      tuple: (value, ttl) where ttl is None if the entry doesn't expire, or (None, None) if
+             key is not cached or has expired
+    """
+
+    now = time.time()
+    with self._lock:
+      row = self._db.execute("SELECT value, expires FROM cache WHERE key=?", (key,)).fetchone()
+      if row is not None and row[1] is not None and row[1] <= now:
+        self._db.execute("DELETE FROM cache WHERE key=?", (key,))
+        self._db.commit()
+        self._size -= 1
+        row = None
+
+      if row is None:
+        self.misses += 1
+        return None, None
+
+      self._used[key] = now
+      self.hits += 1
+
+    return json.loads(row[0]), (None if row[1] is None else row[1] - now)
+
+  def put(self, key, value, ttl=None):
+    """
+    Cache value for key, evicting the least recently used entries as needed
+
+    Args:
+      key (str): key of the entry
+      value: value to cache (JSON-serializable)
+      ttl (float): number of seconds to keep the entry (default is the cache's ttl)
+
+    Returns:
+      None
+    """
+
+    data = json.dumps(value, separators=(",", ":"))
+    expires = _expires(self.ttl if ttl is None else ttl)
+
+    with self._lock:
+      exists = self._db.execute("SELECT 1 FROM cache WHERE key=?", (key,)).fetchone() is not None
+      self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, data, expires, time.time()))
+      if not exists:
+        self._size += 1
+      self._save_used()
+
+      excess = self._size - self.max_size
+      if excess > 0:
+        self._db.execute(
+          "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (excess,))
+        self._size -= excess
+        self.evictions += excess
+
+      self._db.commit()
+
+  def stats(self):
+    """
+    Return the cache's counters
+
+    Returns:
+      dict: size, hits, misses and evictions
+    """
+    return {"size": len(self), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+  def close(self):
+    """
+    Close the cache file
+    """
+    with self._lock:
+      self._save_used()
+      self._db.commit()
+      self._db.close()
+
+  def _save_used(self):
+    """ Write the last use of the entries read since the last write, within the current transaction """
+    if self._used:
+      self._db.executemany("UPDATE cache SET used=? WHERE key=?", [(used, key) for key, used in self._used.items()])
+      self._used.clear()
+
+class TieredCache(object):
+
+  def __init__(self, memory, disk=None):
+    """
+    Args:
+      memory (LRUCache): cache checked first
+      disk (DiskCache): cache checked on a memory miss (None for memory only)
+    """
+    self.memory = memory
+    self.disk = disk
+
+  def get(self, key):
+    """
+    Return the value cached for key in either tier, promoting disk hits to memory
+
+    Args:
+      key (str): key of the entry
+
+    Returns:
+      the value, or None if key is not cached or has expired
+    """
+
+    value = self.memory.get(key)
+    if value is None and self.disk is not None:
+      value, ttl = self.disk.get_with_ttl(key)
+      if value is not None:
+        # Keep the entry in memory for only as long as it has left on disk
+        self.memory.put(key, value, ttl=ttl)
+    return value
+
+  def put(self, key, value, ttl=None):
+    """
+    Cache value for key in both tiers
+
+    Args:
+      key (str): key of the entry
+      value: value to cache (JSON-serializable)
+      ttl (float): number of seconds to keep the entry (default is each tier's ttl)
+
+    Returns:
+      None
+    """
+
+    self.memory.put(key, value, ttl=ttl)
+    if self.disk is not None:
+      self.disk.put(key, value, ttl=ttl)
+
+  @property
+  def hits(self):
+    """ Return the number of gets answered by either tier """
+    return self.memory.hits + (self.disk.hits if self.disk is not None else 0)
+
+  @property
+  def misses(self):
+    """ Return the number of gets answered by neither tier """
+    return self.disk.misses if self.disk is not None else self.memory.misses
+
+  def stats(self):
+    """
+    Return the counters of the cache and of each tier
+
+    Returns:
+      dict: hits, misses, memory (dict) and disk (dict or None)
+    """
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "memory": self.memory.stats(),
+      "disk": self.disk.stats() if self.disk is not None else None,
+    }
+
+  def close(self):
+    """
+    Close the tiers
+    """
+    self.memory.close()
+    if self.disk is not None:
+      self.disk.close()
+
+class SingleFlight(object):
+  """
+  Run at most one call per key at a time, sharing its result with the callers that arrive meanwhile
+  """
+
+  def __init__(self):
+    self.calls = 0
+    self.shared = 0
+
+    self._flights = {}
+    self._lock = threading.Lock()
+
+  def do(self, key, func):
+    """
+    Return func(), or the result of the call of func already in flight for key
+
+    Args:
+      key (str): key of the call
+      func (callable): function to call if no call for key is in flight
+
+    Returns:
+      the result of func; if it raised, every caller waiting on it raises the same exception
+    """
+
+    with self._lock:
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = _Flight()
+        self._flights[key] = flight
+        self.calls += 1
+      else:
+        self.shared += 1
+
+    if not leader:
+      flight.done.wait()
+      if flight.error is not None:
+        raise flight.error
+      return flight.result
+
+    try:
+      flight.result = func()
+    except BaseException as exc:
+      flight.error = exc
+      raise
+    finally:
+      with self._lock:
+        del self._flights[key]
+      flight.done.set()
+
+    return flight.result
+
+class _Flight(object):
+  """ A call in flight """
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+def get_cache(config):
+  """
+  Create a cache
+
+  Args:
+    config (dict): max_size (int) of the memory tier, path (str) of the disk
+                   tier (None for memory only), disk_size (int) and ttl (float)
+
+  Returns:
+    TieredCache
+  """
+
+  ttl = config.get("ttl", DEFAULT_TTL)
+  memory = LRUCache(max_size=config.get("max_size", DEFAULT_MAX_SIZE), ttl=ttl)
+  disk = None
+  if config.get("path") is not None:
+    disk = DiskCache(config["path"], max_size=config.get("disk_size", DEFAULT_MAX_SIZE * 10), ttl=ttl)
+  return TieredCache(memory, disk)
+
+def _expires(ttl):
+  """ Return the expiry time of an entry kept for ttl seconds """
+  return None if ttl is None else time.time() + ttl
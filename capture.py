@@ -0,0 +1,159 @@
+"""
+Payload Capture
+
+Opt-in, sampled capture of the payloads exchanged with the vendors and
+geocoders, for debugging their responses without printing or logging every
+one of them:
+
+capture.configure({"rate": 0.01, "size": 100, "path": "payloads.jsonl"})
+...
+capture.record("PacificEast-public", "lookup", 200, text, request=number)
+
+rate:  fraction of the payloads to capture (0, the default, captures nothing)
+size:  number of captured payloads kept in memory (see entries())
+path:  file that captured payloads are also appended to, one JSON object per
+       line; the file is written by a background thread so that captures
+       never wait on the disk
+
+While capture is off, record() returns right away without touching the
+payload.
+"""
+# Python
+from collections import deque
+import logging
+import queue
+import random
+import threading
+import time
+# 3rd Party
+import simplejson as json
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 100
+
+class Capture(object):
+
+  def __init__(self, rate=0.0, size=DEFAULT_SIZE, path=None):
+    """
+    Args:
+      rate (float): fraction of the payloads to capture, from 0 to 1
+      size (int): number of captured payloads to keep in memory
+      path (str): file to append the captured payloads to (None to only keep them in memory)
+    """
+    self.rate = rate
+    self.path = path
+    self.captured = 0
+
+    self._entries = deque(maxlen=size)
+    self._lock = threading.Lock()
+    self._queue = None
+    self._writer = None
+    if path is not None and rate > 0:
+      self._queue = queue.Queue()
+      self._writer = threading.Thread(target=self._write, name="capture-writer", daemon=True)
+      self._writer.start()
+
+  def record(self, source, operation, status, payload, request=None):
+    """
+    Capture the payload, if it is sampled
+
+    Args:
+      source (str): name of the vendor or geocoder
+      operation (str): operation (e.g. "lookup")
+      status: HTTP or API status of the response
+      payload: body of the response (bytes are decoded as UTF-8)
+      request: what was asked for (e.g. the number), if useful
+
+    Returns:
+      bool: True if the payload was captured
+    """
+
+    if self.rate <= 0 or (self.rate < 1 and random.random() >= self.rate):
+      return False
+
+    if isinstance(payload, bytes):
+      payload = payload.decode("utf-8", "replace")
+
+    entry = {
+      "time": time.time(),
+      "source": source,
+      "operation": operation,
+      "status": status,
+      "request": request,
+      "payload": payload,
+    }
+    with self._lock:
+      self._entries.append(entry)
+      self.captured += 1
+    if self._queue is not None:
+      self._queue.put(entry)
+
+    return True
+
+  def entries(self):
+    """
+    Return the captured payloads kept in memory, oldest first
+
+    Returns:
+      list of dict: time, source, operation, status, request and payload of each
+    """
+    with self._lock:
+      return list(self._entries)
+
+  def close(self):
+    """
+    Finish writing the captured payloads to the file
+    """
+    if self._writer is not None:
+      self._queue.put(None)
+      self._writer.join()
+      self._writer = None
+
+  def _write(self):
+    """ Append the queued payloads to the file until close() """
+    with open(self.path, "a") as f:
+      while True:
+        entry = self._queue.get()
+        if entry is None:
+          break
+        try:
+          f.write(json.dumps(entry, default=str))
+          f.write("\n")
+        except (TypeError, ValueError):
+          log.warning("Failed to write a captured {} payload".format(entry["source"]), exc_info=True)
+        if self._queue.empty():
+          f.flush()
+
+# Capture in use by the vendors and geocoders; off until configured
+CAPTURE = Capture()
+
+def configure(config):
+  """
+  Replace the capture in use, closing the previous one
+
+  Args:
+    config (dict): rate, size and path (see Capture); None to turn capture off
+
+  Returns:
+    Capture
+  """
+  global CAPTURE
+  previous = CAPTURE
+  CAPTURE = Capture(**(config or {}))
+  previous.close()
+  if CAPTURE.rate > 0:
+    log.info("Capturing {:.1%} of payloads".format(CAPTURE.rate))
+  return CAPTURE
+
+def record(source, operation, status, payload, request=None):
+  """
+  Capture the payload with the capture in use, if it is sampled (see Capture.record)
+  """
+  return CAPTURE.record(source, operation, status, payload, request=request)
+
+def close():
+  """
+  Finish writing the payloads of the capture in use
+  """
+  CAPTURE.close()
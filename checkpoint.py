@@ -0,0 +1,201 @@
+"""
+Checkpoint
+
+Crash-safe saving of the numbers file. Each checkpoint is written to a
+temporary file in the same directory, fsync'd and then renamed over the
+numbers file, so the file on disk is always either the previous or the new
+checkpoint, never a truncated one. Previous checkpoints can be kept as
+numbers.json.1 (newest) through numbers.json.N (oldest).
+
+A Checkpointer decides when to save: after a number of updated records or
+a number of seconds, whichever comes first. With a Journal, every update is
+also appended to the journal so that nothing is lost between checkpoints, and
+saves, which rewrite every number, are needed far less often (see
+DEFAULT_JOURNAL_EVERY_RECORDS).
+With a Storage backend, updates and checkpoints go to the backend instead of
+the numbers file.
+"""
+# Python
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_EVERY_RECORDS = 100
+# With a journal, a save only compacts it, so mostly save by time
+DEFAULT_JOURNAL_EVERY_RECORDS = 10000
+DEFAULT_EVERY_SECONDS = 60
+DEFAULT_GENERATIONS = 3
+
+def write_atomic(path, numbers, generations=0):
+  """
+  Write the numbers as JSON to path, atomically
+
+  Args:
+    path (str): path of the file to write
+    numbers (list): numbers to write
+    generations (int): number of previous versions of path to keep
+
+  Returns:
+    None
+  """
+
+  dirname = os.path.dirname(os.path.abspath(path))
+  fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=dirname)
+  try:
+    with os.fdopen(fd, "w") as f:
+      json.dump(numbers, f, indent=2)
+      f.flush()
+      os.fsync(f.fileno())
+  except:
+    os.unlink(tmp_path)
+    raise
+
+  replace(tmp_path, path, generations)
+
+def replace(tmp_path, path, generations=0):
+  """
+  Atomically replace path with the fully written and fsync'd file at tmp_path
+
+  Args:
+    tmp_path (str): path of the new file, in the same directory as path
+    path (str): path of the file to replace
+    generations (int): number of previous versions of path to keep
+
+  Returns:
+    None
+  """
+
+  rotate(path, generations)
+  os.replace(tmp_path, path)
+  _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+def rotate(path, generations):
+  """
+  Shift path.1 ... path.N-1 to path.2 ... path.N and copy path to path.1
+
+  path itself is left in place (hard-linked where possible) so that it
+  exists at every moment.
+
+  Args:
+    path (str): path of the file to rotate
+    generations (int): number of previous versions to keep
+
+  Returns:
+    None
+  """
+
+  if generations <= 0 or not os.path.exists(path):
+    return
+
+  for i in range(generations - 1, 0, -1):
+    older = "{}.{}".format(path, i)
+    if os.path.exists(older):
+      os.replace(older, "{}.{}".format(path, i + 1))
+
+  newest = "{}.1".format(path)
+  if os.path.exists(newest):
+    os.unlink(newest)
+  try:
+    os.link(path, newest)
+  except OSError:
+    shutil.copy2(path, newest)
+
+def _fsync_dir(dirname):
+  """ Flush a rename in dirname to disk, where the platform supports it """
+  try:
+    fd = os.open(dirname, os.O_RDONLY)
+  except (OSError, AttributeError):
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
+
+class Checkpointer(object):
+
+  def __init__(self, path, every_records=DEFAULT_EVERY_RECORDS, every_seconds=DEFAULT_EVERY_SECONDS,
+               generations=DEFAULT_GENERATIONS, journal=None, storage=None):
+    """
+    Args:
+      path (str): path of the numbers file
+      every_records (int): save after this many updated records (None to disable)
+      every_seconds (float): save when this many seconds have passed since the last save (None to disable)
+      generations (int): number of previous checkpoints to keep
+      journal (Journal): journal to append each update to, truncated at each checkpoint
+      storage (Storage): backend to save to instead of the numbers file
+    """
+    self.path = path
+    self.every_records = every_records
+    self.every_seconds = every_seconds
+    self.generations = generations
+    self.journal = journal
+    self.storage = storage
+
+    self.pending = 0
+    self.last_save = time.time()
+
+  def update(self, numbers, index):
+    """
+    Note that numbers[index] was updated, saving if a checkpoint is due
+
+    Args:
+      numbers (list): all of the numbers
+      index (int): position of the updated number in numbers
+
+    Returns:
+      bool: True if a checkpoint was saved
+    """
+
+    if self.journal is not None:
+      self.journal.append(index, numbers[index])
+    if self.storage is not None:
+      self.storage.update(numbers, index)
+    self.pending += 1
+
+    if self.due():
+      self.save(numbers)
+      return True
+
+    return False
+
+  def due(self):
+    """
+    Return True if enough records or time have passed since the last save
+    """
+
+    if self.pending == 0:
+      return False
+    if self.every_records is not None and self.pending >= self.every_records:
+      return True
+    if self.every_seconds is not None and time.time() - self.last_save >= self.every_seconds:
+      return True
+    return False
+
+  def save(self, numbers):
+    """
+    Save a checkpoint of the numbers and truncate the journal
+
+    Args:
+      numbers (list): all of the numbers
+
+    Returns:
+      None
+    """
+
+    log.debug("Saving {}".format(self.path))
+    if self.storage is not None:
+      self.storage.save(numbers)
+    else:
+      write_atomic(self.path, numbers, generations=self.generations)
+    if self.journal is not None:
+      self.journal.truncate()
+
+    self.pending = 0
+    self.last_save = time.time()
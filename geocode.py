@@ -23,8 +23,10 @@ class Geocoder(ProviderBase, metaclass=ABCMeta):
     "accuracy_str",     # str: plugin-specific level of geocoding accuracy
     "latitude",         # float: latitude of the geocoded point
     "longitude",        # float: longitude of the geocoding point
-  ])
+    "error",            # bool: True if the geocoding failed on an error (e.g. over the query limit) rather than finding nothing
+  ], defaults=(False,))
   GEOCODE_FAILED = GeocodeResult(success=False, formatted=None, accuracy_str=None, latitude=None, longitude=None)
+  GEOCODE_ERROR  = GeocodeResult(success=False, formatted=None, accuracy_str=None, latitude=None, longitude=None, error=True)
 
   @abstractmethod
   def geocode(self, *, line1, line2=None, city, region, country, postalCode):
@@ -0,0 +1,125 @@
+"""
+Cached Geocoder
+
+Wraps any Geocoder so that addresses it has already geocoded are answered
+from a cache instead of the geocoder's API:
+
+geocoder = cached(Geocoder.get("google", config={}), cache.get_cache({"path": "geocode_cache.sqlite"}))
+
+Entries are keyed by the geocoder's name and the normalized address, so the
+same household or business returned for several numbers (or by several
+vendors) is only geocoded once, and with a disk tier, once across runs.
+Addresses that the geocoder couldn't find are cached for negative_ttl seconds;
+errors (e.g. running out of retries over the query limit) are not cached, so
+that they are retried.
+"""
+# Python
+import json
+import logging
+import re
+# * * *
+from geocode import Geocoder
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PATH = "geocode_cache.sqlite"
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+
+PUNCTUATION = re.compile(r"[.,#]")
+WHITESPACE = re.compile(r"\s+")
+POSTAL_SEPARATORS = re.compile(r"[\s-]")
+
+def normalize_address(line1, line2, city, region, country, postalCode):
+  """
+  Return the address with case, punctuation and spacing normalized
+
+  Args:
+    line1 (str): primary address line (e.g. "123 Main St.")
+    line2 (str): optional second address line (e.g. "Apt #13")
+    city (str): city (e.g. "Beverly Hills")
+    region (str): region or US state (e.g. "California")
+    country (str): ISO-3 country code (e.g. "USA")
+    postalCode (str or int): postal code (e.g. "90210" or "SW1A 1AA")
+
+  Returns:
+    tuple: the normalized (line1, line2, city, region, country, postalCode)
+  """
+
+  def text(value):
+    if value is None:
+      return ""
+    return WHITESPACE.sub(" ", PUNCTUATION.sub(" ", str(value))).strip().upper()
+
+  if postalCode is None:
+    postal = ""
+  elif isinstance(postalCode, int):
+    # Leading zeros are lost when a zip is stored as a number
+    postal = "{:05d}".format(postalCode)
+  else:
+    postal = POSTAL_SEPARATORS.sub("", postalCode).upper()
+  return (text(line1), text(line2), text(city), text(region), text(country), postal)
+
+def cached(geocoder, geocode_cache, negative_ttl=DEFAULT_NEGATIVE_TTL):
+  """
+  Wrap the geocoder with the cache
+
+  Args:
+    geocoder (Geocoder): geocoder to wrap
+    geocode_cache (cache): LRUCache, DiskCache or TieredCache for the results
+    negative_ttl (float): number of seconds to keep misses (0 to not cache them)
+
+  Returns:
+    CachedGeocoder
+  """
+  return CachedGeocoder(geocoder, geocode_cache, negative_ttl=negative_ttl)
+
+class CachedGeocoder(Geocoder):
+
+  def __init__(self, geocoder, geocode_cache, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """
+    Args:
+      geocoder (Geocoder): geocoder to wrap
+      geocode_cache (cache): LRUCache, DiskCache or TieredCache for the results
+      negative_ttl (float): number of seconds to keep misses (0 to not cache them)
+    """
+    self.geocoder = geocoder
+    self.cache = geocode_cache
+    self.negative_ttl = negative_ttl
+
+  @property
+  def name(self):
+    """ Return the wrapped geocoder's name """
+    return self.geocoder.name
+
+  def geocode(self, *, line1, line2=None, city, region, country, postalCode):
+    """
+    Geocode the address, from the cache if possible
+
+    Args:
+      line1 (str): primary address line (e.g. "123 Main St")
+      line2 (str): optional second address line (e.g. "Apt #13")
+      city (str): city (e.g. "Beverly Hills")
+      region (str): region or US state (e.g. "California")
+      country (str): ISO-3 country code (e.g. "USA")
+      postalCode (str): five- or nine-digit postal code (e.g. "90210")
+
+    Returns:
+      GeocodeResult
+    """
+
+    key = "{}:{}".format(self.name, json.dumps(normalize_address(line1, line2, city, region, country, postalCode)))
+    value = self.cache.get(key)
+    if value is not None:
+      log.debug("Cache hit for {}".format(key))
+      return Geocoder.GeocodeResult(*value)
+
+    result = self.geocoder.geocode(
+      line1=line1, line2=line2, city=city, region=region, country=country, postalCode=postalCode)
+    if result.error:
+      return result
+    if result.success:
+      self.cache.put(key, list(result))
+    elif self.negative_ttl > 0:
+      self.cache.put(key, list(result), ttl=self.negative_ttl)
+
+    return result
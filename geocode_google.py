@@ -8,14 +8,21 @@ from pygeocoder import Geocoder as PyGeocoder
 from pygeocoder import GeocoderError
 # * * *
 from geocode import Geocoder
+import capture
+import ratelimit
 
 log = logging.getLogger(__name__)
 
+# Start at 2 requests per second and speed up to the API's limit of 50
+DEFAULT_RATE_LIMIT = {"rate": 2.0, "max_rate": 50.0}
+DEFAULT_RETRIES = 3
+
 @Geocoder.register(name="google")
 class GoogleGeocoder(Geocoder):
   
   def __init__(self, config):
-    pass
+    self.limiter = ratelimit.get_limiter(self._name, config.get("rate_limit", DEFAULT_RATE_LIMIT))
+    self.retries = config.get("retries", DEFAULT_RETRIES)
 
   def geocode(self, *, line1, line2=None, city, region, country, postalCode):
     """
@@ -33,33 +40,54 @@ class GoogleGeocoder(Geocoder):
       GeocodeResult
     """
 
-    try:
-      if line1 is None:
-        address = ""
-      elif line2 is None:
-        address = line1
-      else:
-        address = "{} {}".format(line1, line2)
-      
-      g = PyGeocoder.geocode("{address} {city} {region} {country} {postalCode}".format(
-        address    = address,
-        city       = city,
-        region     = region,
-        country    = country,
-        postalCode = postalCode,
-      ))
+    if line1 is None:
+      address = ""
+    elif line2 is None:
+      address = line1
+    else:
+      address = "{} {}".format(line1, line2)
+    query = "{address} {city} {region} {country} {postalCode}".format(
+      address    = address,
+      city       = city,
+      region     = region,
+      country    = country,
+      postalCode = postalCode,
+    )
+
+    for attempt in range(self.retries + 1):
+      if self.limiter is not None:
+        self.limiter.acquire()
+
+      try:
+        g = PyGeocoder.geocode(query)
+
+        capture.record(self.name, "geocode", "OK", g.data, request=query)
+
+        result = Geocoder.GeocodeResult(
+          success=True,
+          formatted=g.formatted_address,
+          accuracy_str=g.location_type,
+          latitude=g.latitude,
+          longitude=g.longitude)
+
+      except GeocoderError as e:
+        capture.record(self.name, "geocode", e.status, None, request=query)
+        if e.status == GeocoderError.G_GEO_OVER_QUERY_LIMIT and self.limiter is not None:
+          # Slow down and try again
+          self.limiter.throttled()
+          continue
+        if e.status == GeocoderError.G_GEO_ZERO_RESULTS:
+          result = Geocoder.GEOCODE_FAILED
+        else:
+          log.error("Failed to geocode", exc_info=True)
+          result = Geocoder.GEOCODE_ERROR
 
-      log.info(g.data)
+      if self.limiter is not None:
+        self.limiter.success()
+      break
 
-      result = Geocoder.GeocodeResult(
-        success=True,
-        formatted=g.formatted_address,
-        accuracy_str=g.location_type,
-        latitude=g.latitude,
-        longitude=g.longitude)
+    else:
+      log.error("Failed to geocode: over the query limit")
+      result = Geocoder.GEOCODE_ERROR
 
-    except GeocoderError:
-      log.error("Failed to geocode", exc_info=True)
-      result = Geocoder.GEOCODE_FAILED
-   
     return result
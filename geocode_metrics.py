@@ -0,0 +1,75 @@
+"""
+Metered Geocoder
+
+Wraps any Geocoder so that each geocode is counted by outcome (hit, miss or
+error) and timed in the metrics registry, labelled with the geocoder's name:
+
+geocoder = metered(Geocoder.get("google", config={...}))
+
+Wrap the geocoder before caching it, so that only the requests that reach the
+geocoder are measured.
+"""
+# Python
+import logging
+# * * *
+from geocode import Geocoder
+import metrics
+
+log = logging.getLogger(__name__)
+
+def metered(geocoder):
+  """
+  Wrap the geocoder with the metrics
+
+  Args:
+    geocoder (Geocoder): geocoder to wrap
+
+  Returns:
+    MeteredGeocoder
+  """
+  return MeteredGeocoder(geocoder)
+
+class MeteredGeocoder(Geocoder):
+
+  def __init__(self, geocoder):
+    """
+    Args:
+      geocoder (Geocoder): geocoder to wrap
+    """
+    self.geocoder = geocoder
+
+  @property
+  def name(self):
+    """ Return the wrapped geocoder's name """
+    return self.geocoder.name
+
+  def geocode(self, *, line1, line2=None, city, region, country, postalCode):
+    """
+    Geocode the address, counting and timing it
+
+    Args:
+      line1 (str): primary address line (e.g. "123 Main St")
+      line2 (str): optional second address line (e.g. "Apt #13")
+      city (str): city (e.g. "Beverly Hills")
+      region (str): region or US state (e.g. "California")
+      country (str): ISO-3 country code (e.g. "USA")
+      postalCode (str): five- or nine-digit postal code (e.g. "90210")
+
+    Returns:
+      GeocodeResult
+    """
+
+    try:
+      with metrics.LATENCY.time(self.name, "geocode"):
+        result = self.geocoder.geocode(
+          line1=line1, line2=line2, city=city, region=region, country=country, postalCode=postalCode)
+    except Exception:
+      metrics.REQUESTS.inc(self.name, "geocode", metrics.ERROR)
+      raise
+
+    if result.success:
+      outcome = metrics.HIT
+    else:
+      outcome = metrics.ERROR if result.error else metrics.MISS
+    metrics.REQUESTS.inc(self.name, "geocode", outcome)
+    return result
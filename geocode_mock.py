@@ -1,10 +1,17 @@
 """
 Mock Geocoder
+
+Geocodes every address instantly to the same point. With a simulation config
+(see simulation.py), it answers after a simulated latency instead, and fails,
+times out and is throttled at the configured rates, and is rate limited by its
+rate_limit config like the real geocoders.
 """
 # Python
 import logging
 # * * *
 from geocode import Geocoder
+import ratelimit
+import simulation
 
 log = logging.getLogger(__name__)
 
@@ -12,7 +19,11 @@ log = logging.getLogger(__name__)
 class MockGeocoder(Geocoder):
   
   def __init__(self, config):
-    pass
+    self.simulation = simulation.get(config)
+    # Only simulated requests are rate limited
+    self.limiter = None
+    if self.simulation is not None:
+      self.limiter = ratelimit.get_limiter(self._name, config.get("rate_limit"))
   
   def geocode(self, *, line1, line2=None, city, region, country, postalCode):
     """
@@ -29,6 +40,13 @@ class MockGeocoder(Geocoder):
     Returns:
       GeocodeResult
     """
+    if self.simulation is not None:
+      outcome = self.simulation.respond(limiter=self.limiter)
+      if outcome == simulation.MISS:
+        return Geocoder.GEOCODE_FAILED
+      if outcome != simulation.HIT:
+        return Geocoder.GEOCODE_ERROR
+
     formatted = "{address} {city} {region} {country} {postalCode}".format(
         address = line1 if line2 is None else "{} {}".format(line1, line2),
         city       = city,
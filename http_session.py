@@ -0,0 +1,250 @@
+"""
+HTTP sessions for vendors
+
+Each vendor instance owns a keep-alive Session so that lookups reuse pooled
+connections instead of paying for a new TCP connection and TLS handshake on
+every request. The pool size, timeout and retry policy are read from the
+vendor's config (see get_config).
+
+Vendors that talk to an HTTP API natively from the async interface (see
+Vendor.alookup) get their aiohttp session here as well. aiohttp is optional:
+when it is not installed, HAVE_AIOHTTP is False and those vendors fall back to
+running their synchronous methods in a thread.
+
+A vendor's requests can also be rate limited (see ratelimit.py): each request
+waits for a token from the limiter, and a 429 response slows the limiter down
+and is retried. Both interfaces retry connection errors and 5xx responses with
+the same policy: Session through urllib3's Retry, and fetch by hand.
+"""
+# Python
+import asyncio
+from collections import namedtuple
+import logging
+# 3rd Party
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+log = logging.getLogger(__name__)
+
+HAVE_AIOHTTP = aiohttp is not None
+
+HTTPConfig = namedtuple("HTTPConfig", [
+  "pool_size",          # int: maximum number of connections kept open per host
+  "timeout",            # float: seconds to wait to connect and for each read
+  "retries",            # int: retries on connection errors and 5xx responses
+  "backoff",            # float: backoff factor between retries (0, 2x, 4x, ... seconds)
+])
+DEFAULT_CONFIG = HTTPConfig(pool_size=10, timeout=30.0, retries=3, backoff=0.5)
+
+# Responses worth retrying. The vendor APIs only read data, so POSTs are retried too.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Responses that mean we are over the vendor's rate limit
+THROTTLE_STATUS = 429
+
+def get_config(config):
+  """
+  Read the HTTP settings from a vendor config
+
+  Args:
+    config (dict): vendor config with optional keys pool_size, timeout, retries and backoff
+
+  Returns:
+    HTTPConfig
+  """
+
+  return HTTPConfig(**{
+    field: config.get(field, getattr(DEFAULT_CONFIG, field)) for field in HTTPConfig._fields
+  })
+
+class Session(requests.Session):
+  """
+  Keep-alive requests session with a connection pool, retries, a default timeout and an optional rate limit
+  """
+
+  def __init__(self, http_config=DEFAULT_CONFIG, limiter=None):
+    """
+    Args:
+      http_config (HTTPConfig): pool, timeout and retry settings
+      limiter (RateLimiter): rate limiter for the requests (None for no limit)
+    """
+    super().__init__()
+    self.timeout = http_config.timeout
+    self.retries = http_config.retries
+    self.limiter = limiter
+
+    try:
+      retry = Retry(
+        total=http_config.retries,
+        backoff_factor=http_config.backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False)
+    except TypeError:
+      # urllib3 < 1.26
+      retry = Retry(
+        total=http_config.retries,
+        backoff_factor=http_config.backoff,
+        status_forcelist=RETRY_STATUSES,
+        method_whitelist=False)
+
+    adapter = HTTPAdapter(
+      pool_connections=http_config.pool_size,
+      pool_maxsize=http_config.pool_size,
+      max_retries=retry)
+    self.mount("http://", adapter)
+    self.mount("https://", adapter)
+
+  def request(self, method, url, **kwargs):
+    """ Perform the request, applying the default timeout and the rate limit """
+    kwargs.setdefault("timeout", self.timeout)
+    if self.limiter is None:
+      return super().request(method, url, **kwargs)
+
+    for attempt in range(self.retries + 1):
+      self.limiter.acquire()
+      response = super().request(method, url, **kwargs)
+      if response.status_code != THROTTLE_STATUS:
+        self.limiter.success()
+        break
+      self.limiter.throttled(retry_after(response.headers))
+
+    return response
+
+def retry_after(headers):
+  """
+  Return the seconds to wait given by a response's Retry-After header
+
+  Args:
+    headers (dict): response headers
+
+  Returns:
+    float, or None if the header is missing or is not a number of seconds
+  """
+
+  try:
+    return float(headers.get("Retry-After"))
+  except (TypeError, ValueError):
+    return None
+
+async def fetch(owner, method, url, binary=False, **kwargs):
+  """
+  Perform a request with the aiohttp session of owner, applying owner.limiter if set
+
+  Like Session, connection errors, timeouts and 5xx responses are retried up
+  to owner.http_config.retries times with exponential backoff, as are 429
+  responses when there is a limiter. Once the retries are used up, the last
+  response is returned or the last error is raised.
+
+  Args:
+    owner (object): object (typically a Vendor) that owns the session
+    method (str): "get" or "post"
+    url (str): URL to request
+    binary (bool): return the body as bytes instead of text
+    kwargs: arguments of the aiohttp request
+
+  Returns:
+    tuple: (status, text) of the response, or (status, bytes) if binary
+  """
+
+  limiter = getattr(owner, "limiter", None)
+  http_config = getattr(owner, "http_config", DEFAULT_CONFIG)
+  errors = 0
+
+  for attempt in range(http_config.retries + 1):
+    last = attempt == http_config.retries
+    if errors:
+      await asyncio.sleep(backoff(http_config, errors))
+    if limiter is not None:
+      await limiter.aacquire()
+
+    try:
+      async with getattr(get_async_session(owner), method)(url, **kwargs) as response:
+        status = response.status
+        text = await (response.read() if binary else response.text())
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+      if last:
+        raise
+      log.debug("Retrying {} {} after {!r}".format(method, url, e))
+      errors += 1
+      continue
+
+    if limiter is not None:
+      if status == THROTTLE_STATUS:
+        limiter.throttled(retry_after(response.headers))
+        continue
+      limiter.success()
+    if status in RETRY_STATUSES and not last:
+      log.debug("Retrying {} {} after HTTP {}".format(method, url, status))
+      errors += 1
+      continue
+    break
+
+  return status, text
+
+def backoff(http_config, errors):
+  """
+  Return the seconds to wait before retrying, as urllib3's Retry does
+
+  Args:
+    http_config (HTTPConfig): retry settings
+    errors (int): number of consecutive errors so far
+
+  Returns:
+    float: 0 after the first error, then backoff * 2, 4, ...
+  """
+
+  if errors <= 1:
+    return 0
+  return http_config.backoff * (2 ** (errors - 1))
+
+def get_async_session(owner):
+  """
+  Return the aiohttp session of owner for the running event loop
+
+  The session is created on first use and stored on owner. An aiohttp session
+  is bound to the loop it was created in, so a new one is created if owner is
+  used from another loop. The pool size and timeout are taken from
+  owner.http_config, if set.
+
+  Args:
+    owner (object): object (typically a Vendor) that owns the session
+
+  Returns:
+    aiohttp.ClientSession
+  """
+
+  loop = asyncio.get_event_loop()
+  session = getattr(owner, "_async_session", None)
+  if session is None or session.closed or owner._async_session_loop is not loop:
+    log.debug("Creating aiohttp session for {}".format(owner))
+    http_config = getattr(owner, "http_config", DEFAULT_CONFIG)
+    session = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit_per_host=http_config.pool_size),
+      timeout=aiohttp.ClientTimeout(sock_connect=http_config.timeout, sock_read=http_config.timeout))
+    owner._async_session = session
+    owner._async_session_loop = loop
+
+  return session
+
+async def close_async_session(owner):
+  """
+  Close the aiohttp session of owner, if any
+
+  Args:
+    owner (object): object passed to get_async_session
+
+  Returns:
+    None
+  """
+
+  session = getattr(owner, "_async_session", None)
+  if session is not None:
+    owner._async_session = None
+    owner._async_session_loop = None
+    await session.close()
@@ -0,0 +1,197 @@
+"""
+Jobs
+
+Work queue for lookups and geocoding on top of the SQLite storage, so that
+a run only ever reads the numbers that still need work instead of loading
+and re-scanning all of them.
+
+Status is kept in the same database as the numbers:
+
+lookup_jobs:       numbers that have no vendor and have not been checked by
+                   every vendor of the waterfall; each per-number/per-vendor
+                   check is recorded in the checks table
+contacts_pending:  index of the contacts that still need geocoding (see
+                   storage_sqlite.py), kept up to date with the contacts
+
+lookup_jobs is built once for a waterfall and dataset and then only shrinks
+as numbers finish, so restarting a run starts working right away. Finished
+numbers are written immediately and committed every so many records or
+seconds.
+"""
+# Python
+import json
+import logging
+import time
+# * * *
+import checkpoint
+from storage_sqlite import CONTACTS_PENDING
+
+log = logging.getLogger(__name__)
+
+# Number of pending ids to read at a time
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookup_jobs (
+  number_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS job_state (
+  name TEXT PRIMARY KEY,
+  value TEXT
+);
+"""
+
+class JobStore(object):
+
+  def __init__(self, storage, every_records=checkpoint.DEFAULT_EVERY_RECORDS,
+               every_seconds=checkpoint.DEFAULT_EVERY_SECONDS):
+    """
+    Args:
+      storage (SQLiteStorage): storage holding the numbers
+      every_records (int): commit after this many finished numbers (None to disable)
+      every_seconds (float): commit when this many seconds have passed since the last commit (None to disable)
+    """
+    self.storage = storage
+    self.db = storage.db
+    self.db.executescript(SCHEMA)
+
+    self.every_records = every_records
+    self.every_seconds = every_seconds
+    self.pending = 0
+    self.last_commit = time.time()
+
+    self.waterfall_ids = None
+
+  def prepare_lookups(self, waterfall):
+    """
+    Queue the numbers that need lookups with the waterfall
+
+    The queue is only rebuilt if the waterfall or the dataset changed since it
+    was last built.
+
+    Args:
+      waterfall (list of Vendors): vendors to use for lookups
+
+    Returns:
+      int: number of numbers queued
+    """
+
+    names = [vendor.name for vendor in waterfall]
+    self.waterfall_ids = set(self.storage.vendor_id(name) for name in names)
+    signature = json.dumps({"waterfall": names, "generation": self.storage.generation})
+
+    row = self.db.execute("SELECT value FROM job_state WHERE name='lookup_jobs'").fetchone()
+    if row is None or row[0] != signature:
+      log.info("Queueing lookups for {}".format(", ".join(names)))
+      self.db.execute("DELETE FROM lookup_jobs")
+      self.db.execute("""
+        INSERT INTO lookup_jobs
+        SELECT id FROM numbers n
+        WHERE n.vendor_id IS NULL
+          AND (SELECT COUNT(DISTINCT vendor_id) FROM checks c
+               WHERE c.number_id = n.id AND c.vendor_id IN ({})) < ?
+        """.format(", ".join("?" * len(self.waterfall_ids))),
+        tuple(self.waterfall_ids) + (len(self.waterfall_ids),))
+      self.db.execute("INSERT OR REPLACE INTO job_state VALUES ('lookup_jobs', ?)", (signature,))
+      self.db.commit()
+
+    return self.db.execute("SELECT COUNT(*) FROM lookup_jobs").fetchone()[0]
+
+  def pending_lookups(self):
+    """
+    Load the numbers queued for lookups
+
+    Returns:
+      generator of (index, number) tuples
+    """
+    return self._iter_pending("SELECT number_id FROM lookup_jobs WHERE number_id > ? ORDER BY number_id LIMIT ?")
+
+  def count_geocodes(self):
+    """
+    Return the number of contacts that need geocoding
+    """
+    return self.db.execute("SELECT COUNT(*) FROM contacts WHERE {}".format(CONTACTS_PENDING)).fetchone()[0]
+
+  def pending_geocodes(self):
+    """
+    Load the numbers with contacts that need geocoding
+
+    Returns:
+      generator of (index, number) tuples
+    """
+    return self._iter_pending(
+      "SELECT DISTINCT number_id FROM contacts WHERE {} AND number_id > ? ORDER BY number_id LIMIT ?".format(
+        CONTACTS_PENDING))
+
+  def finish_lookup(self, index, number):
+    """
+    Write a looked-up number and dequeue it if it is done
+
+    Args:
+      index (int): position of the number
+      number (dict): the number
+
+    Returns:
+      None
+    """
+
+    self.storage.put(index, number)
+
+    checked = set(self.storage.vendor_id(name) for name in number.get("vendors_checked", []))
+    if number.get("vendor", None) is not None or self.waterfall_ids <= checked:
+      self.db.execute("DELETE FROM lookup_jobs WHERE number_id=?", (index,))
+
+    self._finished()
+
+  def finish_geocode(self, index, number):
+    """
+    Write a geocoded number
+
+    Args:
+      index (int): position of the number
+      number (dict): the number
+
+    Returns:
+      None
+    """
+
+    self.storage.put(index, number)
+    self._finished()
+
+  def commit(self):
+    """
+    Commit the finished numbers
+    """
+
+    log.debug("Committing {} finished numbers".format(self.pending))
+    self.db.commit()
+    self.pending = 0
+    self.last_commit = time.time()
+
+  def _finished(self):
+    """
+    Count a finished number, committing if enough records or time have passed
+    """
+
+    self.pending += 1
+    if ((self.every_records is not None and self.pending >= self.every_records) or
+        (self.every_seconds is not None and time.time() - self.last_commit >= self.every_seconds)):
+      self.commit()
+
+  def _iter_pending(self, query):
+    """
+    Yield (index, number) for the ids selected by query, BATCH_SIZE ids at a time
+
+    Each batch of ids is read in full before any number is yielded so that
+    numbers can be written while iterating.
+    """
+
+    last = -1
+    while True:
+      ids = [row[0] for row in self.db.execute(query, (last, BATCH_SIZE))]
+      if not ids:
+        return
+
+      for index in ids:
+        yield index, self.storage.get(index)
+      last = ids[-1]
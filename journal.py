@@ -0,0 +1,110 @@
+"""
+Journal
+
+Append-only log of updated numbers, one JSON object per line:
+
+{"index": 12, "number": {"number": "3105550123", "vendor": "VendorName", ...}}
+
+where index is the position of the number in the numbers list and number is
+its full record after the update. Appending a line per completed lookup or
+geocode is O(1), unlike rewriting numbers.json. The journal is compacted by
+writing numbers.json and truncating the journal; on startup, any records left
+by an interrupted run are replayed onto the freshly loaded numbers.
+"""
+# Python
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+class Journal(object):
+
+  def __init__(self, path):
+    """
+    Args:
+      path (str): path of the journal file
+    """
+    self.path = path
+    self.count = 0
+    self._file = None
+
+  def __len__(self):
+    """ Return the number of records appended since the last truncation """
+    return self.count
+
+  def replay(self, numbers):
+    """
+    Apply the records in the journal to numbers
+
+    A partial last line (from a run that was killed mid-write) is ignored.
+
+    NOTE: numbers is modified in-place!
+
+    Args:
+      numbers (list): numbers loaded from the file the journal belongs to
+
+    Returns:
+      int: number of records applied
+    """
+
+    if not os.path.exists(self.path):
+      return 0
+
+    applied = 0
+    with open(self.path) as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          log.warning("Ignoring partial journal record in {}".format(self.path))
+          break
+
+        index = record["index"]
+        if index >= len(numbers) or numbers[index]["number"] != record["number"]["number"]:
+          log.warning("Ignoring journal record for {} that does not match the numbers".format(record["number"]["number"]))
+          continue
+
+        numbers[index] = record["number"]
+        applied += 1
+
+    log.info("Replayed {} journal records from {}".format(applied, self.path))
+    return applied
+
+  def append(self, index, number):
+    """
+    Append the record of an updated number
+
+    The record is flushed to the OS before returning.
+
+    Args:
+      index (int): position of number in the numbers list
+      number (dict): full record of the number
+
+    Returns:
+      None
+    """
+
+    if self._file is None:
+      self._file = open(self.path, "a")
+
+    self._file.write(json.dumps({"index": index, "number": number}, separators=(",", ":")))
+    self._file.write("\n")
+    self._file.flush()
+    self.count += 1
+
+  def truncate(self):
+    """
+    Discard all records, e.g. once they have been written to numbers.json
+    """
+    self.close()
+    open(self.path, "w").close()
+    self.count = 0
+
+  def close(self):
+    """
+    Close the journal file
+    """
+    if self._file is not None:
+      self._file.close()
+      self._file = None
@@ -38,10 +38,14 @@ JSON format:
 
 # Python
 import argparse
+import atexit
+from collections import namedtuple
 import json
 import logging
+import os
 import signal
-from time import sleep
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 # * * *
 from vendor import Vendor
 from vendor_mock import MockVendor
@@ -50,12 +54,40 @@ from vendor_whitepages import WhitePages
 from geocode import Geocoder
 from geocode_mock import MockGeocoder
 from geocode_google import GoogleGeocoder
+from storage import Storage
+from storage_json import JSONStorage
+from storage_sqlite import SQLiteStorage
+from checkpoint import Checkpointer
+from journal import Journal
+from jobs import JobStore
+import cache
+import capture
+import checkpoint
+import geocode_cache
+import geocode_google
+import geocode_metrics
+import http_session
+import metrics
 import server
+import stream
+import ratelimit
+import vendor_cache
+import vendor_metrics
+import vendor_ratelimit
+import vendor_whitepages
+import wsgi_server
 
 log = logging.getLogger(__name__)
 
 SIGINT_caught = False
 
+# A stage of the waterfall in breadth-first mode (see iter_stage_lookups)
+Stage = namedtuple("Stage", [
+  "vendor",             # Vendor: vendor of the stage
+  "workers",            # int: number of lookups (or batches) to run concurrently
+  "batch_size",         # int: number of numbers to pass to the vendor at once
+])
+
 def main():
   """
   Do it
@@ -71,6 +103,14 @@ def main():
   # Server params
   parser.add_argument("--server_sid",   type=str, help="sid for server")
   parser.add_argument("--server_token", type=str, help="token for server")
+  parser.add_argument("--server_host",    type=str,   default=wsgi_server.DEFAULT_HOST,    help="Address for server to listen on")
+  parser.add_argument("--server_port",    type=int,   default=wsgi_server.DEFAULT_PORT,    help="Port for server to listen on")
+  parser.add_argument("--server_workers", type=int,   default=wsgi_server.DEFAULT_WORKERS, help="Number of requests for server to handle at once")
+  parser.add_argument("--server_timeout", type=float, default=wsgi_server.DEFAULT_TIMEOUT, help="Seconds for server to wait on an idle connection")
+  parser.add_argument("--server_cache_size",   type=int,   default=cache.DEFAULT_MAX_SIZE,   help="Number of lookdowns for server to cache (0 to disable the cache)")
+  parser.add_argument("--server_cache_ttl",    type=float, default=server.DEFAULT_CACHE_TTL, help="Seconds for server to cache lookdown hits")
+  parser.add_argument("--server_negative_ttl", type=float, default=0,                        help="Seconds for server to cache lookdown misses")
+  parser.add_argument("--hedge_delay",  type=float, help="Seconds to wait for a vendor before also asking the next one (0 to ask all at once)")
 
   # Which geocoder to use
   parser.add_argument("--geocoder", type=str, default="mock", help="Which geocoder ('mock' or 'google')")
@@ -78,99 +118,281 @@ def main():
   # Vendor params
   parser.add_argument("--pce_id",    type=str,            help="PacificEast Account ID/Key")
   parser.add_argument("--pce_env",   type=str,            help="PacificEast environment ('dev' or 'prod')")
+  parser.add_argument("--pce_endpoint", type=str,         help="PacificEast API endpoint (e.g. a stub_server; default the environment's)")
   parser.add_argument("--wp_key",    type=str,            help="WhitePages API Key")
+  parser.add_argument("--wp_endpoint", type=str, default=vendor_whitepages.DEFAULT_ENDPOINT, help="WhitePages API endpoint (e.g. a stub_server)")
+  parser.add_argument("--mock_config", type=str, help="Simulation config of the mock vendor and geocoder as JSON (see simulation.py)")
+
+  # HTTP params
+  parser.add_argument("--http_timeout", type=float, default=http_session.DEFAULT_CONFIG.timeout, help="Vendor request timeout in seconds")
+  parser.add_argument("--http_retries", type=int,   default=http_session.DEFAULT_CONFIG.retries, help="Vendor request retries on errors")
+
+  # Payload capture params
+  parser.add_argument("--capture_rate", type=float, default=0,                    help="Fraction of vendor and geocoder responses to capture (0 to capture none)")
+  parser.add_argument("--capture_size", type=int,   default=capture.DEFAULT_SIZE, help="Number of captured responses to keep in memory")
+  parser.add_argument("--capture_path", type=str,                                 help="Path of a JSON Lines file to append captured responses to")
+
+  # Rate limit params
+  parser.add_argument("--vendor_rate",      type=float, default=100.0, help="Initial requests per second to each vendor (0 for no limit)")
+  parser.add_argument("--vendor_max_rate",  type=float,                help="Highest requests per second to each vendor (default --vendor_rate)")
+  parser.add_argument("--geocode_rate",     type=float, default=geocode_google.DEFAULT_RATE_LIMIT["rate"],     help="Initial geocodes per second (0 for no limit)")
+  parser.add_argument("--geocode_max_rate", type=float, default=geocode_google.DEFAULT_RATE_LIMIT["max_rate"], help="Highest geocodes per second")
+
+  # Lookup cache params
+  parser.add_argument("--cache_size",         type=int,   default=cache.DEFAULT_MAX_SIZE,            help="Number of lookups to cache in memory (0 to disable the cache)")
+  parser.add_argument("--cache_path",         type=str,                                              help="Path of a lookup cache file shared across runs")
+  parser.add_argument("--cache_ttl",          type=float, default=cache.DEFAULT_TTL,                 help="Seconds to cache lookup hits")
+  parser.add_argument("--cache_negative_ttl", type=float, default=vendor_cache.DEFAULT_NEGATIVE_TTL, help="Seconds to cache lookup misses")
+
+  # Geocode cache params
+  parser.add_argument("--geocode_cache_size", type=int,   default=cache.DEFAULT_MAX_SIZE,            help="Number of geocodes to cache in memory (0 to disable the cache)")
+  parser.add_argument("--geocode_cache_path", type=str,   default=geocode_cache.DEFAULT_PATH,        help="Path of the geocode cache file shared across runs ('' for memory only)")
+  parser.add_argument("--geocode_cache_ttl",  type=float, default=cache.DEFAULT_TTL,                 help="Seconds to cache geocodes")
 
   parser.add_argument("--runall",   action="store_true", help="Run all numbers without prompting")
+  parser.add_argument("--workers",  type=int, default=1,   help="Number of concurrent lookups (requires --runall)")
+  parser.add_argument("--batch_size", type=int, default=1, help="Number of numbers to pass to each vendor at once")
+
+  # Breadth-first waterfall params
+  parser.add_argument("--stages",           action="store_true", help="Run each vendor for all numbers before the next vendor (requires --runall)")
+  parser.add_argument("--stage_workers",    type=str, help="Comma-separated --workers of each stage (e.g. '8,8,2')")
+  parser.add_argument("--stage_batch_size", type=str, help="Comma-separated --batch_size of each stage")
+  parser.add_argument("--stage_rate",       type=str, help="Comma-separated requests per second of each stage (0 for no limit)")
+
+  # Saving params
+  parser.add_argument("--storage",      type=str, default="json", help="Storage backend ('json' or 'sqlite')")
+  parser.add_argument("--storage_path", type=str,                 help="Path of the storage (default 'numbers.json' or 'numbers.<storage>')")
+  parser.add_argument("--stream",   action="store_true", help="Read and write numbers.json one number at a time")
+  parser.add_argument("--journal",  action="store_true", help="Append each result to numbers.json.journal between checkpoints")
+  parser.add_argument("--checkpoint_records",     type=int,   default=None, help="Save numbers.json after this many updates (default {}, or {} with --journal)".format(checkpoint.DEFAULT_EVERY_RECORDS, checkpoint.DEFAULT_JOURNAL_EVERY_RECORDS))
+  parser.add_argument("--checkpoint_seconds",     type=float, default=checkpoint.DEFAULT_EVERY_SECONDS, help="Save numbers.json after this many seconds")
+  parser.add_argument("--checkpoint_generations", type=int,   default=checkpoint.DEFAULT_GENERATIONS,   help="Number of previous numbers.json files to keep")
   args = parser.parse_args()
 
+  # Simulate latency, misses and errors with the mocks
+  mock_config = json.loads(args.mock_config) if args.mock_config else {}
+
+  # Capture a sample of the responses
+  if args.capture_rate > 0:
+    capture.configure({"rate": args.capture_rate, "size": args.capture_size, "path": args.capture_path})
+    atexit.register(capture.close)
+
   # Perform actions
   if not (args.lookup or args.geocode or args.server):
     log.warn("No actions specified. Use '--lookup' and/or '--geocode' or '--server' to do something.")
   elif args.server and (args.lookup or args.geocode):
     log.warn("Cannot use '--server' with '--lookup' or '--geocode'.")
+  elif args.workers > 1 and not args.runall:
+    log.warn("Cannot use '--workers' without '--runall'.")
+  elif args.stages and not args.runall:
+    log.warn("Cannot use '--stages' without '--runall'.")
+  elif args.stages and args.stream:
+    log.warn("Cannot use '--stages' with '--stream'.")
+  elif args.stream and args.journal:
+    log.warn("Cannot use '--journal' with '--stream'.")
+  elif args.stream and args.storage != "json":
+    log.warn("Cannot use '--storage' with '--stream'.")
+  elif args.journal and args.storage != "json":
+    log.warn("Cannot use '--journal' with '--storage {}'.".format(args.storage))
   elif args.server:
-    # Use normal SIGINT handling
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
-
     # Run the server
     if args.pce_id:
       vendors = [
-        Vendor.get("PacificEast", config={"public": False, "account_id": args.pce_id, "env": args.pce_env}),
+        Vendor.get("PacificEast", config={"public": False, "account_id": args.pce_id, "env": args.pce_env,
+          "endpoint": args.pce_endpoint,
+          # Keep a connection open for each request handled at once
+          "pool_size": args.server_workers, "timeout": args.http_timeout, "retries": args.http_retries}),
       ]
     else:
       vendors = [
-        Vendor.get("mock", config={}),
+        Vendor.get("mock", config=mock_config),
       ]
+    vendors = [vendor_metrics.metered(vendor) for vendor in vendors]
 
-    # Configure and run the Pyramid app
-    server.serve(vendors, sid=args.server_sid, token=args.server_token)
+    # Configure and run the Pyramid app. The server handles SIGINT and SIGTERM itself, finishing the requests in progress
+    server.serve(vendors, sid=args.server_sid, token=args.server_token, hedge_delay=args.hedge_delay,
+      host=args.server_host, port=args.server_port, workers=args.server_workers, timeout=args.server_timeout,
+      cache_size=args.server_cache_size, cache_ttl=args.server_cache_ttl, negative_ttl=args.server_negative_ttl)
     
   else:
+    # Get the waterfall
+    waterfall = None
+    if args.lookup:
+      waterfall = get_waterfall(
+        pce_id=args.pce_id,
+        pce_env=args.pce_env,
+        pce_endpoint=args.pce_endpoint,
+        whitepages_key=args.wp_key,
+        whitepages_endpoint=args.wp_endpoint,
+        http={
+          # Keep a connection open for each worker
+          "pool_size": max(args.workers, http_session.DEFAULT_CONFIG.pool_size),
+          "timeout": args.http_timeout,
+          "retries": args.http_retries,
+        },
+        rate_limit={"rate": args.vendor_rate, "max_rate": args.vendor_max_rate})
+      waterfall = [vendor_metrics.metered(vendor) for vendor in waterfall]
+
+      # Answer repeated lookups from the cache
+      lookup_cache = None
+      if args.cache_size > 0:
+        lookup_cache = cache.get_cache({"max_size": args.cache_size, "path": args.cache_path, "ttl": args.cache_ttl})
+        waterfall = [vendor_cache.cached(vendor, lookup_cache, negative_ttl=args.cache_negative_ttl) for vendor in waterfall]
+        atexit.register(log_cache_stats, lookup_cache, "Lookup")
+        metrics.register_cache("lookup", lookup_cache)
+
+    # Split the waterfall into stages for breadth-first lookups
+    stages = None
+    if args.lookup and args.stages:
+      stages = get_stages(
+        waterfall,
+        workers=_stage_settings(args.stage_workers, len(waterfall), args.workers, int),
+        batch_size=_stage_settings(args.stage_batch_size, len(waterfall), args.batch_size, int),
+        rate=_stage_settings(args.stage_rate, len(waterfall), 0, float))
+
+    # Get the geocoder
+    geocoder = None
+    if args.geocode:
+      geocoder = Geocoder.get(args.geocoder, config=dict(mock_config if args.geocoder == "mock" else {},
+        rate_limit={"rate": args.geocode_rate, "max_rate": args.geocode_max_rate}))
+      geocoder = geocode_metrics.metered(geocoder)
+
+      # Answer repeated addresses from the cache
+      if args.geocode_cache_size > 0:
+        address_cache = cache.get_cache({
+          "max_size": args.geocode_cache_size,
+          "path": args.geocode_cache_path or None,
+          "ttl": args.geocode_cache_ttl,
+        })
+        geocoder = geocode_cache.cached(geocoder, address_cache)
+        atexit.register(log_cache_stats, address_cache, "Geocode")
+        metrics.register_cache("geocode", address_cache)
+
+    if args.stream:
+      # Perform the lookups and geocoding one number at a time
+      log.info("Streaming numbers.json")
+      do_stream(args.storage_path or "numbers.json", waterfall=waterfall, geocoder=geocoder, runall=args.runall,
+        workers=args.workers, batch_size=args.batch_size, generations=args.checkpoint_generations)
+      return
+
     # Load the number data and perform the lookups
-    log.debug("Loading numbers.json")
-    numbers = load_numbers("numbers.json")
+    path = args.storage_path
+    if path is None:
+      path = "numbers.json" if args.storage == "json" else "numbers.{}".format(args.storage)
+    log.debug("Loading {}".format(path))
+    is_new = not os.path.exists(path)
+    storage = Storage.get(args.storage, config={"path": path, "generations": args.checkpoint_generations})
+    if is_new and args.storage != "json":
+      # Import numbers.json into the new storage
+      log.info("Importing numbers.json into {}".format(path))
+      storage.save(load_numbers("numbers.json"))
+
+    if args.storage == "sqlite":
+      # Work through the queued numbers without loading all of them
+      jobs = JobStore(storage, every_records=_checkpoint_records(args.checkpoint_records, journal=False),
+        every_seconds=args.checkpoint_seconds)
+      if waterfall is not None:
+        log.info("Performing lookups")
+        do_queued_lookups(jobs, waterfall, runall=args.runall, workers=args.workers, batch_size=args.batch_size,
+          stages=stages)
+      if geocoder is not None:
+        log.info("Performing geocoding")
+        do_queued_geocoding(jobs, geocoder, runall=args.runall)
+      storage.close()
+      return
+
+    numbers = storage.load()
+
+    # Resume from the journal of an interrupted run
+    journal = None
+    if args.journal:
+      journal = Journal("{}.journal".format(path))
+    checkpointer = Checkpointer(
+      path,
+      every_records=_checkpoint_records(args.checkpoint_records, journal=journal is not None),
+      every_seconds=args.checkpoint_seconds,
+      journal=journal,
+      storage=storage)
+    if journal is not None and journal.replay(numbers) > 0:
+      checkpointer.save(numbers)
 
     ############
     # Lookups
-    if args.lookup:
+    if waterfall is not None:
       log.info("Performing lookups")
-
-      # Get the waterfall
-      waterfall = get_waterfall(
-        pce_id=args.pce_id,
-        pce_env=args.pce_env,
-        whitepages_key=args.wp_key)
-  
-      do_lookups(numbers, waterfall, "numbers.json", runall=args.runall)
+      do_lookups(numbers, waterfall, path, runall=args.runall, workers=args.workers, batch_size=args.batch_size,
+        stages=stages, checkpointer=checkpointer)
 
     ############
     # Geocoding
-    if args.geocode:
+    if geocoder is not None:
       log.info("Performing geocoding")
-      geocoder = Geocoder.get(args.geocoder, config={})
-      do_geocoding(numbers, geocoder, "numbers.json", runall=args.runall)
+      do_geocoding(numbers, geocoder, path, runall=args.runall, checkpointer=checkpointer)
+
+    storage.close()
 
-def get_waterfall(pce_id=None, pce_env=None, whitepages_key=None):
+def get_waterfall(pce_id=None, pce_env=None, pce_endpoint=None, whitepages_key=None, whitepages_endpoint=None, http=None, rate_limit=None):
   """
   Create the lookup waterfall
 
   Args:
-    None
+    pce_id (str): PacificEast Account ID/Key
+    pce_env (str): PacificEast environment ('dev' or 'prod')
+    pce_endpoint (str): PacificEast API endpoint (None for the environment's)
+    whitepages_key (str): WhitePages API Key
+    whitepages_endpoint (str): WhitePages API endpoint (None for the real API)
+    http (dict): HTTP settings added to each vendor's config (see http_session.get_config)
+    rate_limit (dict): rate limit of each vendor (see ratelimit.get_limiter)
 
   Returns:
     [{}]: list of dicts with keys name (str), config (dict) where
           name is the name of a Vendor provider and config is the associated configuration
   """
+  http = dict(http or {}, rate_limit=rate_limit)
   waterfall = [
     #Vendor.get("mock", config={}),
-    Vendor.get("PacificEast", config={"public": False, "account_id": pce_id, "env": pce_env}),
-    Vendor.get("PacificEast", config={"public": True,  "account_id": pce_id, "env": pce_env}),
-    Vendor.get("WhitePages",  config={"api_key": whitepages_key}),
+    Vendor.get("PacificEast", config=dict(http, public=False, account_id=pce_id, env=pce_env, endpoint=pce_endpoint)),
+    Vendor.get("PacificEast", config=dict(http, public=True,  account_id=pce_id, env=pce_env, endpoint=pce_endpoint)),
+    Vendor.get("WhitePages",  config=dict(http, api_key=whitepages_key,
+      endpoint=whitepages_endpoint or vendor_whitepages.DEFAULT_ENDPOINT)),
   ]
 
   return waterfall
 
-def load_numbers(path):
+def load_numbers(path, storage="json"):
   """
   Load the phone numbers from the file
 
   Args:
-    path (str): path of the JSON file to read and parse
+    path (str): path of the file to read and parse
+    storage (str): name of the Storage backend of the file
 
   Returns:
     [str]: list of strings of phone numbers
   """
 
   # Load the data
-  with open(path) as f:
-    result = json.load(f)
+  backend = Storage.get(storage, config={"path": path})
+  try:
+    result = backend.load()
+  finally:
+    backend.close()
 
   return result
 
-def do_lookups(numbers, waterfall, save_file, runall=False):
+def do_lookups(numbers, waterfall, save_file, runall=False, workers=1, batch_size=1, stages=None, checkpointer=None):
   """
   Perform lookups on those numbers that have no lookup data
 
+  Each number is run through the waterfall in order, stopping at the first
+  vendor that hits. With more than one worker, up to `workers` numbers are
+  looked up concurrently; the results are applied to `numbers` (and saved)
+  from the calling thread only. With stages, the waterfall is run breadth-first
+  instead (see iter_stage_lookups).
+
+  Each looked-up number is passed to the checkpointer, which decides when to
+  save the numbers.
+
   NOTE: numbers is modified in-place!
 
   Args:
@@ -178,58 +400,393 @@ def do_lookups(numbers, waterfall, save_file, runall=False):
     waterfall (list of Vendors): vendors to use for lookups
     save_file (str): path to the file to be used for storing intermediate results
     runall (bool): run without prompting (default is to prompt for each number)
+    workers (int): number of numbers to look up concurrently (requires runall)
+    batch_size (int): number of numbers to pass to each vendor at once (see iter_lookups)
+    stages (list of Stages): stages to run breadth-first instead of waterfall, workers and batch_size
+    checkpointer (Checkpointer): saves the numbers (default is Checkpointer(save_file))
 
   Returns:
     None
   """
 
+  if workers > 1 and not runall:
+    raise ValueError("Concurrent lookups (workers > 1) require runall")
+  if stages is not None and not runall:
+    raise ValueError("Breadth-first lookups (stages) require runall")
+  if checkpointer is None:
+    checkpointer = Checkpointer(save_file)
+
   count = 0
-  new_found = 0
   found = 0
   total = len(numbers)
 
-  for number in numbers:
-    log.debug("Lookup number {} of {} ({} hits; {} misses)".format(count+1, total, found, count - found))
+  if stages is None:
+    lookups = iter_lookups(numbers, waterfall, runall=runall, workers=workers, batch_size=batch_size)
+  else:
+    lookups = iter_stage_lookups(lambda: enumerate(numbers), stages)
+
+  for index, number, looked_up in lookups:
     count += 1
+    if number.get("vendor", None) is not None:
+      found += 1
+
+    if looked_up:
+      if stages is None:
+        log.debug("Looked up number {} of {} ({} hits; {} misses)".format(count, total, found, count - found))
+
+      # Save the numbers
+      save_checkpoint(numbers, index, checkpointer)
+
+  # Be sure to write before finishing
+  checkpointer.save(numbers)
+  metrics.log_summary("lookup")
+  exit_if_interrupted()
+
+def get_stages(waterfall, workers=None, batch_size=None, rate=None):
+  """
+  Split the waterfall into stages for breadth-first lookups
+
+  Args:
+    waterfall (list of Vendors): vendors to use for lookups
+    workers (list of int): workers of each stage (default 1)
+    batch_size (list of int): batch size of each stage (default 1)
+    rate (list of float): requests per second of each stage, 0 for no limit of the stage's own (default 0)
+
+  Returns:
+    list of Stages
+  """
 
+  stages = []
+  for i, vendor in enumerate(waterfall):
+    if rate is not None and rate[i] > 0:
+      vendor = vendor_ratelimit.limited(vendor, ratelimit.RateLimiter(rate=rate[i]))
+    stages.append(Stage(
+      vendor=vendor,
+      workers=workers[i] if workers is not None else 1,
+      batch_size=batch_size[i] if batch_size is not None else 1))
+
+  return stages
+
+def _stage_settings(value, count, default, kind):
+  """
+  Parse a comma-separated setting of each stage, e.g. "8,8,2"
+
+  Args:
+    value (str): the setting, or None to use default for every stage
+    count (int): number of stages
+    default: value of the stages not given
+    kind (type): type of the setting
+
+  Returns:
+    list of count settings
+  """
+
+  settings = [kind(setting) for setting in value.split(",")] if value else []
+  if len(settings) > count:
+    raise ValueError("Got {} stage settings for {} stages: {}".format(len(settings), count, value))
+  return settings + [default] * (count - len(settings))
+
+def _checkpoint_records(value, journal):
+  """
+  Return the number of updates between checkpoints
+
+  Every checkpoint rewrites all of the numbers. With a journal, the updates
+  are already safe on disk, so the default is much larger.
+
+  Args:
+    value (int): the --checkpoint_records setting, or None for the default
+    journal (bool): whether updates are journaled
+
+  Returns:
+    int
+  """
+
+  if value is not None:
+    return value
+  return checkpoint.DEFAULT_JOURNAL_EVERY_RECORDS if journal else checkpoint.DEFAULT_EVERY_RECORDS
+
+def iter_lookups(numbers, waterfall, runall=False, workers=1, batch_size=1):
+  """
+  Perform lookups on those numbers that have no lookup data, yielding every number
+
+  Numbers that already have data are yielded as they are. With more than one
+  worker, the numbers are yielded as their lookups complete rather than in
+  order. With a batch_size above 1, the numbers are looked up batch_size at a
+  time, each vendor of the waterfall getting the whole batch at once (see
+  Vendor.lookup_batch). Once SIGINT is caught, the remaining numbers are
+  yielded without being looked up.
+
+  NOTE: the numbers are modified in-place!
+
+  Args:
+    numbers (iterable of dicts): numbers to check
+    waterfall (list of Vendors): vendors to use for lookups
+    runall (bool): run without prompting (default is to prompt for each number)
+    workers (int): number of numbers (or batches) to look up concurrently (requires runall)
+    batch_size (int): number of numbers to pass to each vendor at once
+
+  Returns:
+    generator of (index, number, looked_up) tuples where index is the position
+    of number in numbers and looked_up (bool) is True if it was looked up
+  """
+
+  return _iter_lookups(enumerate(numbers), waterfall, runall=runall, workers=workers, batch_size=batch_size)
+
+def _iter_lookups(items, waterfall, runall=False, workers=1, batch_size=1):
+  """
+  Perform lookups on the (index, number) items, as iter_lookups
+  """
+
+  if batch_size > 1:
+    for item in _iter_batch_lookups(items, waterfall, runall=runall, workers=workers, batch_size=batch_size):
+      yield item
+    return
+
+  def lookup(item):
+    return _lookup_number(item[1], waterfall, runall=runall)
+
+  def skip(item):
     # Only lookup numbers that don't have data
-    if number.get("vendor", None) is None:
-      for vendor in waterfall:
-        if vendor.name not in number.setdefault("vendors_checked", []):
-          if not runall:
-            check_keep_going("Lookup", number["number"], vendor.name)
-          else:
-            log.debug("Lookup of {} at {}".format(number["number"], vendor.name))
-
-          # Perform the lookup
-          number.get("vendors_checked", []).append(vendor.name)
-          lookup = vendor.lookup(number["number"])
-
-          # Store the results on the number
-          if lookup.success:
-            # Success
-            found += 1
-            new_found += 1
-            number["vendor"]   = vendor.name
-            number["contacts"] = lookup.contacts
-
-          # Save the numbers after every N new finds
-          if new_found % 10 == 0:
-            write_results(numbers, save_file)
-
-          # Stop searching for this number if we got a result
-          if lookup.success: break
+    return item[1].get("vendor", None) is not None or SIGINT_caught
+
+  for (index, number), result in _map_concurrent(lookup, items, workers, skip=skip):
+    if result is None:
+      yield index, number, False
     else:
-      # Already found
-      found += 1
+      _apply_lookup(number, result)
+      yield index, number, True
 
-  # Be sure to write before finishing
-  write_results(numbers, save_file)
+def _iter_batch_lookups(items, waterfall, runall=False, workers=1, batch_size=1):
+  """
+  Perform lookups on the (index, number) items batch_size at a time, as iter_lookups
+  """
+
+  def batches():
+    # Yield (items, needs_lookup) with the numbers without data in batches
+    batch = []
+    for item in items:
+      if item[1].get("vendor", None) is not None:
+        yield [item], False
+        continue
+
+      batch.append(item)
+      if len(batch) >= batch_size:
+        yield batch, True
+        batch = []
+
+    if batch:
+      yield batch, True
+
+  def lookup(batch):
+    return _lookup_batch([number for _, number in batch[0]], waterfall, runall=runall)
+
+  def skip(batch):
+    return not batch[1] or SIGINT_caught
+
+  for (batch, _), results in _map_concurrent(lookup, batches(), workers, skip=skip):
+    for i, (index, number) in enumerate(batch):
+      if results is None:
+        yield index, number, False
+      else:
+        _apply_lookup(number, results[i])
+        yield index, number, True
+
+def _apply_lookup(number, result):
+  """
+  Store the results of _lookup_number on the number
+  """
+
+  checked, vendor_name, contacts = result
+  number.setdefault("vendors_checked", []).extend(checked)
+  if vendor_name is not None:
+    # Success
+    number["vendor"]   = vendor_name
+    number["contacts"] = contacts
+
+def iter_stage_lookups(get_items, stages):
+  """
+  Perform lookups breadth-first: each stage for all pending numbers, then the next stage for the misses
+
+  Each stage runs with its own workers and batch size, keeping its vendor's
+  connections busy, and its hits and lookup rate are logged as it finishes.
+  Once SIGINT is caught, the remaining stages are not run.
+
+  NOTE: the numbers are modified in-place!
+
+  Args:
+    get_items (callable): returns the (index, number) pairs to look up; called once per stage
+    stages (list of Stages): stages of the waterfall, in order
+
+  Returns:
+    generator of (index, number, True) tuples for each lookup, as iter_lookups
+  """
+
+  for i, stage in enumerate(stages, 1):
+    name = stage.vendor.name
+
+    def pending(items, name=name):
+      for index, number in items:
+        if number.get("vendor", None) is None and name not in number.get("vendors_checked", []):
+          yield index, number
+
+    count = 0
+    hits = 0
+    start = time.time()
+    log.info("Stage {} ({}): starting".format(i, name))
+
+    lookups = _iter_lookups(pending(get_items()), [stage.vendor], runall=True, workers=stage.workers,
+      batch_size=stage.batch_size)
+    for index, number, looked_up in lookups:
+      if not looked_up:
+        continue
+
+      count += 1
+      if number.get("vendor", None) == name:
+        hits += 1
+      log.debug("Stage {} ({}): looked up {} numbers ({} hits)".format(i, name, count, hits))
+      yield index, number, True
+
+    elapsed = time.time() - start
+    log.info("Stage {} ({}): {} lookups, {} hits ({:.0%}), {:.1f}s, {:.1f} lookups/s".format(
+      i, name, count, hits, hits / count if count else 0, elapsed, count / elapsed if elapsed > 0 else 0))
+
+    if SIGINT_caught:
+      return
+
+def _lookup_number(number, waterfall, runall=False):
+  """
+  Run a single number through the waterfall, stopping at the first hit
+
+  NOTE: number is not modified; the caller stores the returned results on it.
+  This keeps a number's data from being changed while another thread is
+  saving the results.
+
+  Args:
+    number (dict): number to check
+    waterfall (list of Vendors): vendors to use for lookups
+    runall (bool): run without prompting (default is to prompt for each vendor)
+
+  Returns:
+    tuple: (checked, vendor_name, contacts) where checked is the list of the
+           names of the vendors queried and vendor_name (str) and contacts (list)
+           are those of the hit or None if every vendor missed
+  """
+
+  checked = []
+  for vendor in waterfall:
+    if vendor.name not in number.get("vendors_checked", []):
+      if not runall:
+        check_keep_going("Lookup", number["number"], vendor.name)
+      else:
+        log.debug("Lookup of {} at {}".format(number["number"], vendor.name))
+
+      # Perform the lookup
+      checked.append(vendor.name)
+      lookup = vendor.lookup(number["number"])
+
+      # Stop searching for this number if we got a result
+      if lookup.success:
+        return checked, vendor.name, lookup.contacts
+
+  return checked, None, None
 
-def do_geocoding(numbers, geocoder, save_file, runall=False):
+def _lookup_batch(numbers, waterfall, runall=False):
+  """
+  Run the numbers through the waterfall, one vendor at a time
+
+  Each vendor gets all of the numbers that it has not checked and that no
+  earlier vendor hit, in a single lookup_batch call.
+
+  NOTE: the numbers are not modified (see _lookup_number).
+
+  Args:
+    numbers (list of dicts): numbers to check
+    waterfall (list of Vendors): vendors to use for lookups
+    runall (bool): run without prompting (default is to prompt for each vendor)
+
+  Returns:
+    list of (checked, vendor_name, contacts) tuples, as _lookup_number, in the order of numbers
+  """
+
+  checked = [[] for _ in numbers]
+  results = [None] * len(numbers)
+  for vendor in waterfall:
+    pending = [
+      i for i, number in enumerate(numbers)
+      if results[i] is None and vendor.name not in number.get("vendors_checked", [])
+    ]
+    if not pending:
+      continue
+
+    if not runall:
+      check_keep_going("Lookup", "{} numbers".format(len(pending)), vendor.name)
+    else:
+      log.debug("Lookup of {} numbers at {}".format(len(pending), vendor.name))
+
+    # Perform the lookups
+    lookups = vendor.lookup_batch([numbers[i]["number"] for i in pending])
+    for i, lookup in zip(pending, lookups):
+      checked[i].append(vendor.name)
+      if lookup.success:
+        results[i] = (checked[i], vendor.name, lookup.contacts)
+
+  return [
+    result if result is not None else (checked[i], None, None)
+    for i, result in enumerate(results)
+  ]
+
+def _map_concurrent(func, items, workers, skip=None):
+  """
+  Call func on each of the items using up to `workers` threads
+
+  Results are yielded as they complete, not in the order of items. At most
+  2 * workers calls are queued at a time so that items may be a generator.
+  With a single worker, func is called in the current thread.
+
+  Args:
+    func (callable): function to call with each item
+    items (iterable): items to pass to func
+    workers (int): maximum number of concurrent calls
+    skip (callable): if skip(item) is True, item is yielded at once with a result of None
+
+  Returns:
+    generator of (item, result) tuples
+  """
+
+  if workers <= 1:
+    for item in items:
+      if skip is not None and skip(item):
+        yield item, None
+      else:
+        yield item, func(item)
+    return
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    running = {}
+    for item in items:
+      if skip is not None and skip(item):
+        yield item, None
+        continue
+
+      running[executor.submit(func, item)] = item
+
+      # Wait for a slot before queuing more
+      if len(running) >= 2 * workers:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield running.pop(future), future.result()
+
+    # Drain the remaining calls
+    for future in as_completed(list(running)):
+      yield running.pop(future), future.result()
+
+def do_geocoding(numbers, geocoder, save_file, runall=False, checkpointer=None):
   """
   Perform geocoding on those numbers that have an address but no lat/lng
 
+  Each geocoded number is passed to the checkpointer, which decides when to
+  save the numbers.
+
   NOTE: numbers is modified in-place!
 
   Args:
@@ -237,22 +794,67 @@ def do_geocoding(numbers, geocoder, save_file, runall=False):
     geocoder (Geocoder): geocoder to be used for lookups
     save_file (str): path to the file to be used for storing intermediate results
     runall (bool): run without prompting (default is to prompt for each number)
+    checkpointer (Checkpointer): saves the numbers (default is Checkpointer(save_file))
 
   Returns:
     None
   """
 
+  if checkpointer is None:
+    checkpointer = Checkpointer(save_file)
+
   count = 0
-  found = 0
-  new_found = 0
   total = len(numbers)
 
-  for number in numbers:
-    log.debug("Geocode number {} of {} ({} hits; {} misses)".format(count+1, total, found, count - found))
+  for index, number, geocoded in iter_geocoding(numbers, geocoder, runall=runall):
     count += 1
 
+    if geocoded:
+      log.debug("Geocoded number {} of {}".format(count, total))
+
+      # Save the numbers
+      save_checkpoint(numbers, index, checkpointer)
+
+  # Be sure to write before finishing
+  checkpointer.save(numbers)
+  metrics.log_summary("geocode")
+  exit_if_interrupted()
+
+def iter_geocoding(numbers, geocoder, runall=False):
+  """
+  Perform geocoding on those numbers that have an address but no lat/lng, yielding every number
+
+  Once SIGINT is caught, the remaining numbers are yielded without being
+  geocoded.
+
+  NOTE: the numbers are modified in-place!
+
+  Args:
+    numbers (iterable of dicts): numbers to check
+    geocoder (Geocoder): geocoder to be used for lookups
+    runall (bool): run without prompting (default is to prompt for each number)
+
+  Returns:
+    generator of (index, number, geocoded) tuples where index is the position
+    of number in numbers and geocoded (bool) is True if any of its contacts
+    were geocoded
+  """
+
+  return _iter_geocoding(enumerate(numbers), geocoder, runall=runall)
+
+def _iter_geocoding(items, geocoder, runall=False):
+  """
+  Perform geocoding on the (index, number) items, as iter_geocoding
+  """
+
+  for index, number in items:
+    geocoded = False
+
     # Only geocode numbers with an address that has not been geocoded
     for contact in number.get("contacts", []):
+      if SIGINT_caught:
+        break
+
       if contact.get("state", None) is not None and contact.get("geocoded", False) is False:
         if not runall:
           check_keep_going("Geocode", number["number"], geocoder.name)
@@ -261,6 +863,7 @@ def do_geocoding(numbers, geocoder, save_file, runall=False):
 
         # Perform the lookup
         contact["geocoded"] = True
+        geocoded = True
         lookup = geocoder.geocode(
           line1 = contact["address"],
           city = contact["city"],
@@ -271,47 +874,220 @@ def do_geocoding(numbers, geocoder, save_file, runall=False):
         # Store the results on the contact
         if lookup.success:
           # Success
-          found += 1
-          new_found += 1
           contact["formatted_addr"] = lookup.formatted
           contact["geo_accuracy"] = lookup.accuracy_str
           contact["latitude"]  = lookup.latitude
           contact["longitude"] = lookup.longitude
 
-        # Save the numbers
-        write_results(numbers, save_file)
-        sleep(0.5)
+    yield index, number, geocoded
 
-      else:
-        # Already found
-        found += 1
+def do_queued_lookups(jobs, waterfall, runall=False, workers=1, batch_size=1, stages=None):
+  """
+  Perform lookups on the numbers queued in the job store
+
+  Only the numbers that still need lookups are read, and each one is written
+  back as soon as it is looked up, so an interrupted run resumes where it
+  left off.
+
+  Args:
+    jobs (JobStore): job store of the numbers
+    waterfall (list of Vendors): vendors to use for lookups
+    runall (bool): run without prompting (default is to prompt for each number)
+    workers (int): number of numbers to look up concurrently (requires runall)
+    batch_size (int): number of numbers to pass to each vendor at once (see iter_lookups)
+    stages (list of Stages): stages to run breadth-first instead of waterfall, workers and batch_size
+
+  Returns:
+    None
+  """
+
+  if workers > 1 and not runall:
+    raise ValueError("Concurrent lookups (workers > 1) require runall")
+  if stages is not None and not runall:
+    raise ValueError("Breadth-first lookups (stages) require runall")
+
+  count = 0
+  found = 0
+  if stages is None:
+    total = jobs.prepare_lookups(waterfall)
+    lookups = _iter_lookups(jobs.pending_lookups(), waterfall, runall=runall, workers=workers, batch_size=batch_size)
+  else:
+    total = jobs.prepare_lookups([stage.vendor for stage in stages])
+    lookups = iter_stage_lookups(jobs.pending_lookups, stages)
+  log.info("{} numbers queued for lookups".format(total))
+
+  for index, number, looked_up in lookups:
+    if not looked_up:
+      continue
+
+    count += 1
+    if number.get("vendor", None) is not None:
+      found += 1
+    if stages is None:
+      log.debug("Looked up number {} of {} ({} hits; {} misses)".format(count, total, found, count - found))
+
+    jobs.finish_lookup(index, number)
+    if SIGINT_caught:
+      break
 
   # Be sure to write before finishing
-  write_results(numbers, save_file)
+  jobs.commit()
+  metrics.log_summary("lookup")
+  exit_if_interrupted()
+
+def do_queued_geocoding(jobs, geocoder, runall=False):
+  """
+  Perform geocoding on the numbers in the job store with contacts that need it
+
+  Args:
+    jobs (JobStore): job store of the numbers
+    geocoder (Geocoder): geocoder to be used for lookups
+    runall (bool): run without prompting (default is to prompt for each number)
+
+  Returns:
+    None
+  """
+
+  count = 0
+  total = jobs.count_geocodes()
+  log.info("{} contacts queued for geocoding".format(total))
+
+  for index, number, geocoded in _iter_geocoding(jobs.pending_geocodes(), geocoder, runall=runall):
+    if geocoded:
+      count += 1
+      log.debug("Geocoded number {} ({} contacts queued)".format(count, total))
+      jobs.finish_geocode(index, number)
+    if SIGINT_caught:
+      break
+
+  # Be sure to write before finishing
+  jobs.commit()
+  metrics.log_summary("geocode")
+  exit_if_interrupted()
+
+def do_stream(path, waterfall=None, geocoder=None, runall=False, workers=1, batch_size=1, generations=0):
+  """
+  Perform lookups and/or geocoding on the numbers in the file one number at a time
+
+  The numbers are read, processed and written back without ever holding all
+  of them in memory. The file is replaced with the results, in the same
+  format, once every number has been written, in their original order. Once
+  SIGINT is caught, the remaining numbers are copied over as they are.
+
+  Args:
+    path (str): path of the numbers file (a JSON array or JSON Lines)
+    waterfall (list of Vendors): vendors to use for lookups (None to skip lookups)
+    geocoder (Geocoder): geocoder to be used for lookups (None to skip geocoding)
+    runall (bool): run without prompting (default is to prompt for each number)
+    workers (int): number of numbers to look up concurrently (requires runall)
+    batch_size (int): number of numbers to pass to each vendor at once (see iter_lookups)
+    generations (int): number of previous versions of the file to keep
+
+  Returns:
+    None
+  """
+
+  numbers = stream.iter_numbers(path)
+  if waterfall is not None:
+    # Concurrent lookups complete out of order
+    numbers = _in_order(iter_lookups(numbers, waterfall, runall=runall, workers=workers, batch_size=batch_size))
+  if geocoder is not None:
+    numbers = (number for _, number, _ in iter_geocoding(numbers, geocoder, runall=runall))
+
+  with stream.NumberWriter(path, fmt=stream.detect_format(path), generations=generations) as writer:
+    for number in numbers:
+      writer.write(number)
+      if writer.count % 1000 == 0:
+        log.debug("Streamed {} numbers".format(writer.count))
 
-def write_results(numbers, filepath):
+  metrics.log_summary()
+
+  # Check for SIGINT
+  exit_if_interrupted()
+
+def _in_order(results):
   """
-  Write the numbers result to the file
+  Yield the numbers of (index, number, ...) tuples in the order of index
+
+  Numbers that complete ahead of an earlier one are held until it completes,
+  so no more are held than the lookups in flight.
+
+  Args:
+    results (iterable): (index, number, ...) tuples, with every index from 0 exactly once
+
+  Returns:
+    generator of numbers
+  """
+
+  pending = {}
+  next_index = 0
+  for result in results:
+    pending[result[0]] = result[1]
+    while next_index in pending:
+      yield pending.pop(next_index)
+      next_index += 1
+
+def write_results(numbers, filepath, storage="json"):
+  """
+  Write the numbers result to the file, atomically
 
   Args:
     numbers (dict): dict of phone (str), vendor (str), restricted (bool), name (str), address (str)
-    file (File object): if None use sys.stdout
+    filepath (str): path of the file to write
+    storage (str): name of the Storage backend of the file
 
   Returns:
     None
   """
 
-  log.debug("Saving numbers.json")
+  log.debug("Saving {}".format(filepath))
 
   # Update the file
-  with open("numbers.json", "w") as f:
-    json.dump(numbers, f, indent=2)
+  backend = Storage.get(storage, config={"path": filepath})
+  try:
+    backend.save(numbers)
+  finally:
+    backend.close()
 
   # Check for SIGINT
+  exit_if_interrupted()
+
+def save_checkpoint(numbers, index, checkpointer):
+  """
+  Pass an updated number to the checkpointer, saving and exiting if SIGINT was caught
+
+  Args:
+    numbers (list): all of the numbers
+    index (int): position of the updated number in numbers
+    checkpointer (Checkpointer): checkpointer for the numbers
+
+  Returns:
+    None
+  """
+
+  checkpointer.update(numbers, index)
+
+  # Check for SIGINT
+  if SIGINT_caught:
+    checkpointer.save(numbers)
+    exit_if_interrupted()
+
+def exit_if_interrupted():
+  """
+  Exit if SIGINT was caught
+  """
   if SIGINT_caught:
     print("SIGINT caught")
     exit(1)
 
+def log_cache_stats(results_cache, kind):
+  """
+  Log the hits and misses of a cache and close it
+  """
+  stats = results_cache.stats()
+  log.info("{} cache: {} hits, {} misses".format(kind, stats["hits"], stats["misses"]))
+  results_cache.close()
+
 def check_keep_going(operation, number, vendor):
   """
   Prompt to continue or stop
@@ -0,0 +1,309 @@
+"""
+Metrics
+
+Request counters and latency histograms for the vendors and geocoders, and the
+hit ratios of the caches, kept in one process-wide registry:
+
+REQUESTS.inc("WhitePages", "lookup", "hit")
+with LATENCY.time("WhitePages", "lookup"):
+  ...
+
+Vendors and geocoders are instrumented by wrapping them (see vendor_metrics
+and geocode_metrics), and caches by registering them with register_cache. The
+registry is rendered in the Prometheus text format by render(), which the
+server exposes at /metrics, and logged as a summary by log_summary() at the
+end of a run.
+"""
+# Python
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Outcomes of a request
+HIT = "hit"
+MISS = "miss"
+ERROR = "error"
+
+class Counter(object):
+  """
+  Monotonic counter with a value per combination of labels
+  """
+
+  def __init__(self, name, help, labels=()):
+    """
+    Args:
+      name (str): metric name
+      help (str): description of the metric
+      labels (tuple of str): label names
+    """
+    self.name = name
+    self.help = help
+    self.labels = labels
+
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, *label_values, amount=1):
+    """
+    Add amount to the counter of the label values
+    """
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+  def value(self, *label_values):
+    """
+    Return the counter of the label values
+    """
+    with self._lock:
+      return self._values.get(label_values, 0)
+
+  def render(self):
+    """
+    Return the counter in the Prometheus text format
+
+    Returns:
+      list of str: lines
+    """
+    lines = _header(self.name, self.help, "counter")
+    with self._lock:
+      for label_values, value in sorted(self._values.items()):
+        lines.append("{}{} {}".format(self.name, _labels(self.labels, label_values), _number(value)))
+    return lines
+
+class Histogram(object):
+  """
+  Histogram of observations, such as latencies, per combination of labels
+  """
+
+  def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    """
+    Args:
+      name (str): metric name
+      help (str): description of the metric
+      labels (tuple of str): label names
+      buckets (tuple of float): upper bounds of the buckets, in increasing order
+    """
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.buckets = tuple(buckets)
+
+    # Label values: [bucket counts (the last is +Inf), sum]
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value, *label_values):
+    """
+    Record an observation for the label values
+    """
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      entry = self._values.get(label_values)
+      if entry is None:
+        entry = [[0] * (len(self.buckets) + 1), 0.0]
+        self._values[label_values] = entry
+      entry[0][index] += 1
+      entry[1] += value
+
+  @contextlib.contextmanager
+  def time(self, *label_values):
+    """
+    Observe the seconds taken by the body of the with statement, even if it raises
+    """
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      self.observe(time.monotonic() - start, *label_values)
+
+  def stats(self, *label_values):
+    """
+    Return the count, mean and approximate percentiles of the observations for the label values
+
+    Percentiles are reported as the upper bound of the bucket they fall in.
+
+    Returns:
+      dict: count, mean, p50 and p95 (None when there are no observations)
+    """
+    with self._lock:
+      entry = self._values.get(label_values)
+      if entry is None:
+        return {"count": 0, "mean": None, "p50": None, "p95": None}
+      counts, total = list(entry[0]), entry[1]
+
+    count = sum(counts)
+    return {
+      "count": count,
+      "mean": total / count,
+      "p50": self._percentile(counts, count, 0.50),
+      "p95": self._percentile(counts, count, 0.95),
+    }
+
+  def _percentile(self, counts, count, fraction):
+    """ Return the upper bound of the bucket holding the fraction of the observations """
+    seen = 0
+    for index, bucket_count in enumerate(counts):
+      seen += bucket_count
+      if seen >= fraction * count:
+        return self.buckets[index] if index < len(self.buckets) else float("inf")
+    return float("inf")
+
+  def label_values(self):
+    """
+    Return the label values with observations
+    """
+    with self._lock:
+      return sorted(self._values)
+
+  def render(self):
+    """
+    Return the histogram in the Prometheus text format
+
+    Returns:
+      list of str: lines
+    """
+    lines = _header(self.name, self.help, "histogram")
+    with self._lock:
+      values = sorted((label_values, list(entry[0]), entry[1]) for label_values, entry in self._values.items())
+
+    for label_values, counts, total in values:
+      cumulative = 0
+      for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+        cumulative += bucket_count
+        labels = _labels(self.labels + ("le",), label_values + (_number(bound),))
+        lines.append("{}_bucket{} {}".format(self.name, labels, cumulative))
+      labels = _labels(self.labels, label_values)
+      lines.append("{}_sum{} {}".format(self.name, labels, _number(total)))
+      lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+    return lines
+
+REQUESTS = Counter(
+  "phone_lookup_requests_total",
+  "Vendor and geocoder requests by outcome (hit, miss or error)",
+  ("provider", "operation", "outcome"))
+LATENCY = Histogram(
+  "phone_lookup_request_seconds",
+  "Vendor and geocoder request latency",
+  ("provider", "operation"))
+
+# Caches by name
+_caches = {}
+_caches_lock = threading.Lock()
+
+def register_cache(name, results_cache):
+  """
+  Report the hits and misses of the cache under the name
+
+  Args:
+    name (str): name of the cache (e.g. "lookup")
+    results_cache (cache): LRUCache, DiskCache or TieredCache
+
+  Returns:
+    None
+  """
+  with _caches_lock:
+    _caches[name] = results_cache
+
+def cache_stats():
+  """
+  Return the hits, misses and hit ratio of each registered cache
+
+  Returns:
+    dict: name to dict of hits, misses and ratio (None before the first get)
+  """
+  with _caches_lock:
+    caches = sorted(_caches.items())
+
+  stats = {}
+  for name, results_cache in caches:
+    hits, misses = results_cache.hits, results_cache.misses
+    stats[name] = {"hits": hits, "misses": misses, "ratio": hits / (hits + misses) if hits + misses else None}
+  return stats
+
+def render():
+  """
+  Return all of the metrics in the Prometheus text format
+
+  Returns:
+    str
+  """
+
+  lines = REQUESTS.render() + LATENCY.render()
+
+  stats = cache_stats()
+  for suffix, help, kind, key in (
+      ("hits_total", "Cache hits", "counter", "hits"),
+      ("misses_total", "Cache misses", "counter", "misses"),
+      ("hit_ratio", "Fraction of cache gets that hit", "gauge", "ratio")):
+    name = "phone_lookup_cache_{}".format(suffix)
+    lines += _header(name, help, kind)
+    for cache_name, values in stats.items():
+      if values[key] is not None:
+        lines.append("{}{} {}".format(name, _labels(("cache",), (cache_name,)), _number(values[key])))
+
+  return "\n".join(lines) + "\n"
+
+def summary(operation=None):
+  """
+  Return a summary of the requests of each provider and of the caches
+
+  Args:
+    operation (str): only include the operations and caches whose names start with this (e.g. "lookup")
+
+  Returns:
+    list of str: lines
+  """
+
+  lines = []
+  for provider, op in LATENCY.label_values():
+    if operation is not None and not op.startswith(operation):
+      continue
+    stats = LATENCY.stats(provider, op)
+    outcomes = {outcome: REQUESTS.value(provider, op, outcome) for outcome in (HIT, MISS, ERROR)}
+    lines.append("{} {}: {} requests ({} hits, {} misses, {} errors); mean {:.3f}s, p50 <= {}s, p95 <= {}s".format(
+      provider, op, stats["count"], outcomes[HIT], outcomes[MISS], outcomes[ERROR],
+      stats["mean"], _number(stats["p50"]), _number(stats["p95"])))
+
+  for name, stats in cache_stats().items():
+    if operation is not None and not name.startswith(operation):
+      continue
+    ratio = "n/a" if stats["ratio"] is None else "{:.0%}".format(stats["ratio"])
+    lines.append("{} cache: {} hits, {} misses ({} hit ratio)".format(name, stats["hits"], stats["misses"], ratio))
+
+  return lines
+
+def log_summary(operation=None):
+  """
+  Log the summary of the requests and caches (see summary)
+  """
+  for line in summary(operation):
+    log.info(line)
+
+def _header(name, help, kind):
+  """ Return the HELP and TYPE lines of a metric """
+  return ["# HELP {} {}".format(name, help), "# TYPE {} {}".format(name, kind)]
+
+def _labels(names, values):
+  """ Return the label set of a sample, e.g. {provider="WhitePages"} """
+  if not names:
+    return ""
+  return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)) + "}"
+
+def _escape(value):
+  """ Escape a label value """
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _number(value):
+  """ Format a sample value """
+  if value == float("inf"):
+    return "+Inf"
+  if isinstance(value, float) and value.is_integer():
+    return repr(value)
+  return str(value)
@@ -0,0 +1,145 @@
+"""
+Rate Limit
+
+Token-bucket rate limiting with AIMD (additive increase, multiplicative
+decrease) backoff, so that we run at a provider's real limit instead of a
+fixed delay:
+
+- each request takes a token; tokens are refilled at `rate` per second, up to
+  `burst` tokens
+- each successful request raises the rate by `increase`, up to `max_rate`
+- each quota error (HTTP 429, OVER_QUERY_LIMIT, ...) multiplies the rate by
+  `decrease`, down to `min_rate`, and pauses for Retry-After seconds if given
+
+Limiters are shared per provider name (see get_limiter), so every instance of
+a provider and every worker thread or coroutine using it draws from the same
+bucket.
+"""
+# Python
+import asyncio
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INCREASE = 0.1
+DEFAULT_DECREASE = 0.5
+
+# Limiters shared by provider name
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name, config):
+  """
+  Return the rate limiter shared by the providers with the name
+
+  The limiter is created with the config on first use; later configs for the
+  same name are ignored.
+
+  Args:
+    name (str): registered name of the provider (e.g. "pacificeast")
+    config (dict): rate (float) of requests per second and optional max_rate,
+                   min_rate, burst, increase and decrease (see RateLimiter);
+                   None or a rate of 0 for no limit
+
+  Returns:
+    RateLimiter, or None for no limit
+  """
+
+  if not config or not config.get("rate"):
+    return None
+
+  with _limiters_lock:
+    limiter = _limiters.get(name)
+    if limiter is None:
+      limiter = RateLimiter(**config)
+      _limiters[name] = limiter
+      log.debug("Rate limiting {} to {} requests per second".format(name, limiter.rate))
+
+  return limiter
+
+class RateLimiter(object):
+
+  def __init__(self, rate, max_rate=None, min_rate=None, burst=1, increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE):
+    """
+    Args:
+      rate (float): initial requests per second
+      max_rate (float): highest rate to increase to (default is rate)
+      min_rate (float): lowest rate to back off to (default is rate / 10)
+      burst (int): number of requests that may be made at once after being idle
+      increase (float): requests per second added after each success
+      decrease (float): factor the rate is multiplied by after each quota error
+    """
+    self.rate = float(rate)
+    self.max_rate = float(max_rate) if max_rate is not None else self.rate
+    self.min_rate = float(min_rate) if min_rate is not None else self.rate / 10
+    self.burst = burst
+    self.increase = increase
+    self.decrease = decrease
+
+    self.throttles = 0
+    self._tokens = float(burst)
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    """
+    Take a token, sleeping until one is available
+    """
+    wait = self._reserve()
+    if wait > 0:
+      time.sleep(wait)
+
+  async def aacquire(self):
+    """
+    Take a token without blocking the event loop
+    """
+    wait = self._reserve()
+    if wait > 0:
+      await asyncio.sleep(wait)
+
+  def success(self):
+    """
+    Note a successful request, increasing the rate
+    """
+    with self._lock:
+      self.rate = min(self.max_rate, self.rate + self.increase)
+
+  def throttled(self, retry_after=None):
+    """
+    Note a quota error, decreasing the rate
+
+    Args:
+      retry_after (float): seconds the provider asked us to wait, if any
+
+    Returns:
+      None
+    """
+
+    with self._lock:
+      self._refill()
+      self.rate = max(self.min_rate, self.rate * self.decrease)
+      self.throttles += 1
+
+      # Start from an empty bucket, or further behind to wait out Retry-After
+      self._tokens = min(self._tokens, 0.0)
+      if retry_after:
+        self._tokens = min(self._tokens, -retry_after * self.rate)
+
+    log.info("Throttled; backing off to {:.2f} requests per second".format(self.rate))
+
+  def _reserve(self):
+    """
+    Take a token, returning the number of seconds to wait until it is available
+    """
+    with self._lock:
+      self._refill()
+      self._tokens -= 1
+      return max(0.0, -self._tokens / self.rate)
+
+  def _refill(self):
+    """ Add the tokens earned since the last refill """
+    now = time.monotonic()
+    self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+    self._last = now
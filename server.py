@@ -70,9 +70,9 @@ Sample EveryoneAPI Output
 """
 
 # Python
-import functools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 import logging
-from wsgiref.simple_server import make_server
+import threading
 # Pyramid
 from pyramid.config import Configurator
 from pyramid.response import Response
@@ -81,7 +81,10 @@ from pyramid.httpexceptions import HTTPException, HTTPUnauthorized, HTTPBadReque
 import simplejson as json
 # * * *
 from vendor import Vendor
-from vendor_mock import MockVendor
+from geocode_cache import normalize_address
+import cache
+import metrics
+import wsgi_server
 
 log = logging.getLogger(__name__)
 
@@ -89,6 +92,26 @@ VENDORS = []
 SID = "123"
 TOKEN = "456"
 
+# Seconds to wait for a vendor before also asking the next one (None to ask them one at a time)
+HEDGE_DELAY = None
+
+# Thread pools for hedged lookdowns and for batches
+HEDGE_WORKERS = 32
+BATCH_WORKERS = 32
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Most addresses accepted by /api/batch at once
+MAX_BATCH = 1000
+
+ADDRESS_FIELDS = ("address", "city", "state", "postalCode", "country")
+
+# Lookdown results by normalized address (None for no cache), and the lookdowns in flight
+LOOKDOWN_CACHE = None
+NEGATIVE_TTL = 0
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+FLIGHTS = cache.SingleFlight()
+
 def api(request):
   try:
     # Parse the request
@@ -99,15 +122,19 @@ def api(request):
     del params["token"]
 
     # Perform the lookup
-    lookdown_result = _lookdown(VENDORS, **params)
-    if lookdown_result is None:
-      response = "[]"
+    lookdown_result = _cached_lookdown(VENDORS, **params)
+    if lookdown_result.error:
+      # Every vendor failed, which the client must not mistake for a miss
+      result = Response("Vendors unavailable", status=503)
     else:
-      response = {
-        "data": lookdown_result
-      }
+      if lookdown_result.contacts is None:
+        response = "[]"
+      else:
+        response = {
+          "data": lookdown_result.contacts
+        }
 
-    result = Response(json.dumps(response))
+      result = Response(json.dumps(response))
 
   except HTTPException as exc:
     result = exc
@@ -120,70 +147,344 @@ def api(request):
   result.content_type = "application/json"
   return result
 
+def api_batch(request):
+  """
+  Perform a lookdown for each address in the JSON array in the request body
+
+  The addresses have the same fields as the /api params, and sid and token
+  are passed as params. The results are streamed back as JSON Lines in the
+  order the lookdowns finish, each with the index of its address:
+
+  {"index": 1, "data": [...contacts...]}
+  {"index": 0, "data": []}
+  {"index": 2, "missing": "city"}
+
+  An address at which every vendor failed gets {"index": 3, "error": "vendors unavailable"}.
+  """
+
+  try:
+    _parse_auth(request)
+
+    try:
+      addresses = json.loads(request.body)
+    except ValueError:
+      addresses = None
+    if not isinstance(addresses, list):
+      raise HTTPBadRequest('{"error":"expected a JSON array of addresses"}')
+    if len(addresses) > MAX_BATCH:
+      raise HTTPBadRequest('{{"error":"at most {} addresses per batch"}}'.format(MAX_BATCH))
+
+    result = Response(app_iter=_iter_batch(VENDORS, addresses))
+    result.content_type = "application/x-ndjson"
+    return result
+
+  except HTTPException as exc:
+    result = exc
+    result.text = exc.detail
+
+  except:
+    log.error("Server Error", exc_info=True)
+    result = Response("Server error", status=500)
+
+  result.content_type = "application/json"
+  return result
+
+def metrics_view(request):
+  """
+  Return the request counters, latencies and cache hit ratios in the Prometheus text format
+  """
+  result = Response(metrics.render())
+  result.content_type = "text/plain"
+  result.charset = "utf-8"
+  return result
+
+def _iter_batch(vendors, addresses):
+  """
+  Perform the lookdowns of the addresses concurrently, yielding a JSON line for each as it finishes
+  """
+
+  futures = {}
+  try:
+    for index, params in enumerate(addresses):
+      try:
+        params = _parse_address(params)
+      except KeyError as exc:
+        yield _json_line({"index": index, "missing": exc.args[0]})
+        continue
+      except (AttributeError, TypeError):
+        yield _json_line({"index": index, "error": "expected an object"})
+        continue
+
+      futures[_get_executor("batch", BATCH_WORKERS).submit(_cached_lookdown, vendors, **params)] = index
+
+    for future in as_completed(futures):
+      index = futures[future]
+      try:
+        lookdown_result = future.result()
+      except Exception:
+        log.error("Server Error", exc_info=True)
+        yield _json_line({"index": index, "error": "server error"})
+        continue
+
+      if lookdown_result.error:
+        yield _json_line({"index": index, "error": "vendors unavailable"})
+      else:
+        contacts = lookdown_result.contacts
+        yield _json_line({"index": index, "data": contacts if contacts is not None else []})
+
+  finally:
+    # Don't start the lookdowns left if the client went away
+    for future in futures:
+      future.cancel()
+
+def _json_line(obj):
+  """ Return obj as a line of JSON Lines """
+  return json.dumps(obj).encode("utf-8") + b"\n"
+
 def _parse_request(request):
   """
   Parse the request
   """
 
-  global SID
-  global TOKEN
-  
+  result = _parse_auth(request)
   try:
-    sid        = request.params["sid"]
-    token      = request.params["token"]
-    address    = request.params["address"]
-    city       = request.params["city"]
-    state      = request.params["state"]
-    postalCode = request.params["postalCode"]
-    country    = request.params["country"]
-
-    result = {
-      "sid": sid,
-      "token": token,
-      "address": address,
-      "city": city,
-      "state": state,
-      "postalCode": postalCode,
-      "country": country,
-    }
+    result.update(_parse_address(request.params))
+  except KeyError as exc:
+    raise HTTPBadRequest('{{"missing":"{}"}}'.format(exc.args[0]))
+
+  return result
+
+def _parse_auth(request):
+  """
+  Parse and check the sid and token of the request
+  """
 
-    if not (sid==SID and token==TOKEN):
-      raise HTTPUnauthorized('{"status":"unauthorized"}')
+  global SID
+  global TOKEN
 
+  try:
+    sid   = request.params["sid"]
+    token = request.params["token"]
   except KeyError as exc:
     raise HTTPBadRequest('{{"missing":"{}"}}'.format(exc.args[0]))
 
-  return result
+  if not (sid==SID and token==TOKEN):
+    raise HTTPUnauthorized('{"status":"unauthorized"}')
+
+  return {"sid": sid, "token": token}
+
+def _parse_address(params):
+  """
+  Return the address fields of params, raising KeyError for a missing field
+  """
+  return {field: params[field] for field in ADDRESS_FIELDS}
+
+def _cached_lookdown(vendors, address, city, state, postalCode, country):
+  """
+  Perform the forward phone append, from LOOKDOWN_CACHE if possible
 
-def _lookdown(vendors, address, city, state, postalCode, country):
+  Concurrent requests for the same address share a single lookdown. Misses
+  are only cached if NEGATIVE_TTL is set, and lookdowns at which every vendor
+  failed with an error are not cached at all.
+
+  Returns:
+    LookdownResult
+  """
+
+  key = json.dumps(normalize_address(address, None, city, state, country, postalCode))
+  if LOOKDOWN_CACHE is not None:
+    value = LOOKDOWN_CACHE.get(key)
+    if value is not None:
+      return Vendor.LookdownResult(success=value["contacts"] is not None, contacts=value["contacts"])
+
+  def lookdown():
+    result = _lookdown(vendors, address, city, state, postalCode, country)
+    if LOOKDOWN_CACHE is not None and not result.error:
+      if result.success:
+        LOOKDOWN_CACHE.put(key, {"contacts": result.contacts})
+      elif NEGATIVE_TTL > 0:
+        LOOKDOWN_CACHE.put(key, {"contacts": None}, ttl=NEGATIVE_TTL)
+    return result
+
+  return FLIGHTS.do(key, lookdown)
+
+def _lookdown(vendors, address, city, state, postalCode, country, hedge_delay=None):
   """
   Perform the forward phone append
+
+  A vendor that fails with an error is treated as a miss, so the next vendor
+  is asked. With a hedge_delay, see _hedged_lookdown.
+
+  Returns:
+    LookdownResult: the first hit, LOOKDOWN_ERROR if every vendor failed with
+                    an error, or LOOKDOWN_FAILED
   """
 
-  result = None
+  if hedge_delay is None:
+    hedge_delay = HEDGE_DELAY
+  if hedge_delay is not None and len(vendors) > 1:
+    return _hedged_lookdown(vendors, hedge_delay, address, city, state, postalCode, country)
+
+  errors = 0
   for v in vendors:
-    lookdown_result = v.lookdown(address, city, state, postalCode, country)
+    lookdown_result = _vendor_lookdown(v, address, city, state, postalCode, country)
     if lookdown_result.success:
-      result = lookdown_result.contacts
-      break
+      return lookdown_result
+    errors += lookdown_result.error
 
-  return result
+  return _lookdown_missed(vendors, errors)
+
+def _hedged_lookdown(vendors, delay, address, city, state, postalCode, country):
+  """
+  Perform the forward phone append, asking the next vendor after delay seconds
+  without waiting for the previous ones to answer
+
+  The result is the same as _lookdown's: the first vendor in order that hits
+  wins, so a hit is only returned once every vendor before it has missed.
+  When a vendor misses and no other is still running, the next vendor is asked
+  at once. With a delay of 0, all of the vendors are asked at once.
+
+  Lookdowns that are no longer needed are cancelled if they have not started;
+  those already running are left to finish in the background.
+  """
+
+  args = (address, city, state, postalCode, country)
+  executor = _get_executor("hedge", HEDGE_WORKERS)
+  futures = []
+
+  def ask_next():
+    futures.append(executor.submit(_vendor_lookdown, vendors[len(futures)], *args))
+
+  # Position of the next answer to take, in order
+  answer = 0
+  errors = 0
+
+  ask_next()
+  try:
+    while True:
+      while answer < len(futures) and futures[answer].done():
+        lookdown_result = futures[answer].result()
+        if lookdown_result.success:
+          return lookdown_result
+        errors += lookdown_result.error
+        answer += 1
+
+      if answer == len(vendors):
+        return _lookdown_missed(vendors, errors)
+      if answer == len(futures):
+        # Every vendor asked so far missed
+        ask_next()
+        continue
+
+      running = [future for future in futures if not future.done()]
+      if len(futures) < len(vendors):
+        done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+        if not done:
+          ask_next()
+      else:
+        wait(running, return_when=FIRST_COMPLETED)
+
+  finally:
+    for future in futures:
+      future.cancel()
+
+def _lookdown_missed(vendors, errors):
+  """
+  Return the LookdownResult of a lookdown that no vendor hit, an error if all of them failed with one
+  """
+  if vendors and errors == len(vendors):
+    return Vendor.LOOKDOWN_ERROR
+  return Vendor.LOOKDOWN_FAILED
+
+def _vendor_lookdown(vendor, address, city, state, postalCode, country):
+  """
+  Return the vendor's LookdownResult, with LOOKDOWN_ERROR if the vendor raises
+  """
+
+  try:
+    return vendor.lookdown(address, city, state, postalCode, country)
+  except Exception:
+    log.error("Lookdown failed at {}".format(vendor.name), exc_info=True)
+    return Vendor.LOOKDOWN_ERROR
+
+def _get_executor(name, workers):
+  """
+  Return the named thread pool, creating it with the number of workers on first use
+
+  Hedged lookdowns and batches have separate pools, so that a batch's
+  lookdowns never wait for threads held by the batch itself.
+  """
+
+  with _executors_lock:
+    executor = _executors.get(name)
+    if executor is None:
+      executor = ThreadPoolExecutor(max_workers=workers)
+      _executors[name] = executor
+  return executor
+
+def make_app():
+  """
+  Create the Pyramid app
+
+  Returns:
+    WSGI application
+  """
+
+  config = Configurator()
+  config.add_route("api", "/api")
+  config.add_route("api_batch", "/api/batch")
+  config.add_route("metrics", "/metrics")
+  config.add_view(api, route_name="api")
+  config.add_view(api_batch, route_name="api_batch", request_method="POST")
+  config.add_view(metrics_view, route_name="metrics", request_method="GET")
+  return config.make_wsgi_app()
+
+def serve(vendors, sid=None, token=None, hedge_delay=None, host=wsgi_server.DEFAULT_HOST, port=wsgi_server.DEFAULT_PORT,
+          workers=wsgi_server.DEFAULT_WORKERS, timeout=wsgi_server.DEFAULT_TIMEOUT,
+          cache_size=cache.DEFAULT_MAX_SIZE, cache_ttl=DEFAULT_CACHE_TTL, negative_ttl=0):
+  """
+  Serve the API until SIGTERM or SIGINT
+
+  Args:
+    vendors (list of Vendors): vendors to use for lookdowns, in order
+    sid (str): sid that requests must pass
+    token (str): token that requests must pass
+    hedge_delay (float): seconds to wait for a vendor before also asking the next one (see _hedged_lookdown)
+    host (str): address to listen on
+    port (int): port to listen on
+    workers (int): number of requests handled at once
+    timeout (float): seconds to wait on an idle connection
+    cache_size (int): number of lookdowns to cache (0 for no cache)
+    cache_ttl (float): seconds to cache hits
+    negative_ttl (float): seconds to cache misses (0 to not cache them)
+
+  Returns:
+    None
+  """
 
-def serve(vendors, sid=None, token=None):
   global VENDORS
   global SID
   global TOKEN
+  global HEDGE_DELAY
+  global LOOKDOWN_CACHE
+  global NEGATIVE_TTL
   VENDORS = vendors
+  HEDGE_DELAY = hedge_delay
+  LOOKDOWN_CACHE = cache.LRUCache(max_size=cache_size, ttl=cache_ttl) if cache_size > 0 else None
+  NEGATIVE_TTL = negative_ttl
+  if LOOKDOWN_CACHE is not None:
+    metrics.register_cache("lookdown", LOOKDOWN_CACHE)
 
   if sid is None: sid = "1234"
   if token is None: token = "5678"
   SID = sid
   TOKEN = token
   
+  # Keep enough threads for every request and batch lookdown to hedge across all of the vendors
+  global HEDGE_WORKERS
+  global BATCH_WORKERS
+  BATCH_WORKERS = max(BATCH_WORKERS, workers)
+  HEDGE_WORKERS = max(HEDGE_WORKERS, (workers + BATCH_WORKERS) * len(vendors))
+
   # Configure and run the Pyramid app
-  config = Configurator()
-  config.add_route("api", "/api")
-  config.add_view(api, route_name="api")
-  app = config.make_wsgi_app()
-  server = make_server("0.0.0.0", 8080, app)
-  server.serve_forever()
+  wsgi_server.serve(make_app(), host=host, port=port, workers=workers, timeout=timeout)
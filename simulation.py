@@ -0,0 +1,163 @@
+"""
+Simulation
+
+Simulated provider behavior, so that concurrency, rate limiting and caching
+can be load tested offline. The mock vendor and geocoder take a simulation
+config, and so does the stub server (see stub_server.py), which serves it
+over HTTP:
+
+Vendor.get("mock", config={"latency": {"distribution": "longtail", "mean": 0.2}, "hit_rate": 0.6})
+
+latency:        distribution of the response time, one of
+                  {"distribution": "fixed", "mean": seconds}
+                  {"distribution": "normal", "mean": seconds, "stddev": seconds}
+                  {"distribution": "longtail", "mean": seconds, "sigma": spread}
+                where longtail is lognormal: most responses are a bit faster
+                than the mean, and a few are many times slower
+hit_rate:       fraction of the answers that find something (default 1)
+error_rate:     fraction of the requests that fail (a connection error, or
+                HTTP 500 from the stub server)
+timeout_rate:   fraction of the requests that get no answer for `timeout` seconds
+throttle_rate:  fraction of the requests rejected as over quota (HTTP 429),
+                asking to retry after `retry_after` seconds
+seed:           random seed, for repeatable runs
+
+A config with none of these keys is not simulated (see get), so the mocks
+keep answering instantly by default.
+"""
+# Python
+import logging
+import math
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Outcomes of a simulated request
+HIT = "hit"
+MISS = "miss"
+ERROR = "error"
+TIMEOUT = "timeout"
+THROTTLE = "throttle"
+
+DISTRIBUTIONS = ("fixed", "normal", "longtail")
+DEFAULT_SIGMA = 1.0
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRY_AFTER = 1.0
+DEFAULT_RETRIES = 3
+
+KEYS = ("latency", "hit_rate", "error_rate", "timeout_rate", "throttle_rate")
+
+def get(config):
+  """
+  Return the simulation of a provider config
+
+  Args:
+    config (dict): provider config, with the simulation keys (see Simulation)
+
+  Returns:
+    Simulation, or None if config has none of the simulation keys
+  """
+  if not any(key in config for key in KEYS):
+    return None
+  return Simulation(config)
+
+class Simulation(object):
+
+  def __init__(self, config):
+    """
+    Args:
+      config (dict): latency, hit_rate, error_rate, timeout_rate, throttle_rate,
+                     timeout, retry_after and seed (see the module docstring)
+    """
+    latency = config.get("latency") or {"distribution": "fixed", "mean": 0.0}
+    if latency.get("distribution", "fixed") not in DISTRIBUTIONS:
+      raise ValueError("Simulation: latency distribution must be one of {}".format(", ".join(DISTRIBUTIONS)))
+
+    self.distribution = latency.get("distribution", "fixed")
+    self.mean = latency.get("mean", 0.0)
+    self.stddev = latency.get("stddev", self.mean / 4)
+    self.sigma = latency.get("sigma", DEFAULT_SIGMA)
+    self.hit_rate = config.get("hit_rate", 1.0)
+    self.error_rate = config.get("error_rate", 0.0)
+    self.timeout_rate = config.get("timeout_rate", 0.0)
+    self.throttle_rate = config.get("throttle_rate", 0.0)
+    self.timeout = config.get("timeout", DEFAULT_TIMEOUT)
+    self.retry_after = config.get("retry_after", DEFAULT_RETRY_AFTER)
+
+    self._random = random.Random(config.get("seed"))
+    self._lock = threading.Lock()
+
+  def latency(self):
+    """
+    Return a response time drawn from the latency distribution
+
+    Returns:
+      float: seconds
+    """
+    with self._lock:
+      if self.distribution == "normal":
+        return max(0.0, self._random.gauss(self.mean, self.stddev))
+      if self.distribution == "longtail" and self.mean > 0:
+        # Lognormal with the given mean
+        return self._random.lognormvariate(math.log(self.mean) - self.sigma ** 2 / 2, self.sigma)
+      return self.mean
+
+  def sample(self):
+    """
+    Draw the outcome of a request and how long it takes
+
+    Returns:
+      tuple: (outcome, seconds) where outcome is HIT, MISS, ERROR, TIMEOUT or THROTTLE
+    """
+
+    with self._lock:
+      draw = self._random.random()
+      hit = self._random.random() < self.hit_rate
+
+    if draw < self.timeout_rate:
+      return TIMEOUT, self.timeout
+    draw -= self.timeout_rate
+    if draw < self.error_rate:
+      outcome = ERROR
+    elif draw - self.error_rate < self.throttle_rate:
+      outcome = THROTTLE
+    else:
+      outcome = HIT if hit else MISS
+    return outcome, self.latency()
+
+  def respond(self, limiter=None, retries=DEFAULT_RETRIES):
+    """
+    Simulate a request, waiting as long as it takes
+
+    Quota errors are handled like http_session.Session handles HTTP 429: the
+    limiter (if any) slows down and the request is retried. The mocks answer
+    ERROR, TIMEOUT and THROTTLE with error results, like the real vendors
+    answer a failed request.
+
+    Args:
+      limiter (RateLimiter): rate limiter of the provider, or None
+      retries (int): retries of quota errors (with a limiter)
+
+    Returns:
+      str: HIT, MISS, ERROR or TIMEOUT, or THROTTLE if the quota errors outlasted the retries
+    """
+
+    for attempt in range((retries if limiter is not None else 0) + 1):
+      if limiter is not None:
+        limiter.acquire()
+
+      outcome, seconds = self.sample()
+      time.sleep(seconds)
+      if outcome in (ERROR, TIMEOUT):
+        break
+
+      if limiter is not None:
+        if outcome == THROTTLE:
+          limiter.throttled(self.retry_after)
+          continue
+        limiter.success()
+      break
+
+    return outcome
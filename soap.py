@@ -0,0 +1,84 @@
+"""
+SOAP
+
+Request builder for SOAP envelopes. The envelope is split into pre-encoded
+byte fragments once, so that building a request only escapes and encodes the
+values and joins them with the fragments:
+
+LOOKUP = Template(b'<cus:phoneNumber>{number}</cus:phoneNumber>...')
+body = LOOKUP.bind(account_id="1234").render(number="3105550123")
+
+Values are XML-escaped, so an "&" or "<" in an address can't break the
+request; wrap XML that is already encoded (e.g. a rendered Template) in Raw to
+fill it in as is. Values that are the same for every request of a vendor (e.g.
+the account id) can be bound once with bind().
+"""
+# Python
+import logging
+import re
+from xml.sax.saxutils import escape
+
+log = logging.getLogger(__name__)
+
+FIELD = re.compile(rb"{(\w+)}")
+
+class Raw(bytes):
+  """ Encoded XML to fill in without escaping """
+
+class Template(object):
+
+  def __init__(self, template):
+    """
+    Args:
+      template (bytes): the envelope, with {field} placeholders for the values
+    """
+
+    # Alternating fragments and field names: [fragment, field, fragment, ..., fragment]
+    parts = FIELD.split(template)
+    self.fragments = parts[0::2]
+    self.fields = [field.decode("ascii") for field in parts[1::2]]
+
+  def bind(self, **values):
+    """
+    Return a template with the values filled in, and only the other fields left as placeholders
+
+    Args:
+      values: value of each field to fill in
+
+    Returns:
+      Template
+    """
+
+    bound = Template.__new__(Template)
+    bound.fragments = [self.fragments[0]]
+    bound.fields = []
+    for field, fragment in zip(self.fields, self.fragments[1:]):
+      if field in values:
+        bound.fragments[-1] += _encode(values[field]) + fragment
+      else:
+        bound.fields.append(field)
+        bound.fragments.append(fragment)
+    return bound
+
+  def render(self, **values):
+    """
+    Return the envelope with the values filled in
+
+    Args:
+      values: value of each remaining field
+
+    Returns:
+      bytes: the UTF-8 encoded envelope
+    """
+
+    parts = [self.fragments[0]]
+    for field, fragment in zip(self.fields, self.fragments[1:]):
+      parts.append(_encode(values[field]))
+      parts.append(fragment)
+    return b"".join(parts)
+
+def _encode(value):
+  """ Return the value as escaped UTF-8 XML text """
+  if isinstance(value, Raw):
+    return value
+  return escape(str(value)).encode("utf-8")
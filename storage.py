@@ -0,0 +1,77 @@
+"""
+Storage
+
+This is the plugin handler for the backends that hold the numbers dataset.
+
+Every backend stores the same data: the list of numbers described in main.py.
+Backends with random access (e.g. sqlite) write each updated number as soon
+as update() is called and make the updates durable on save(); the others
+rewrite the whole dataset on save().
+
+To add a new backend, create a new class and register it (see storage_json.py).
+"""
+# Python
+from abc import ABCMeta
+from abc import abstractmethod
+import logging
+# * * *
+from provider_base import ProviderBase
+
+log = logging.getLogger(__name__)
+
+class Storage(ProviderBase, metaclass=ABCMeta):
+  # Registered providers get added to this dict
+  providers = {}
+
+  @abstractmethod
+  def load(self):
+    """
+    Load all of the numbers
+
+    Returns:
+      [dict]: list of numbers
+    """
+    raise NotImplementedError("Implement this method in the child class")
+
+  @abstractmethod
+  def save(self, numbers):
+    """
+    Durably store the numbers
+
+    Backends with random access may only write the numbers passed to update()
+    since numbers was last loaded or saved.
+
+    Args:
+      numbers (list): all of the numbers
+
+    Returns:
+      None
+    """
+    raise NotImplementedError("Implement this method in the child class")
+
+  def update(self, numbers, index):
+    """
+    Note that numbers[index] was updated
+
+    The update is only guaranteed to be durable after the next save().
+
+    Args:
+      numbers (list): all of the numbers
+      index (int): position of the updated number in numbers
+
+    Returns:
+      None
+    """
+    pass
+
+  def close(self):
+    """
+    Release any resources held by the backend
+    """
+    pass
+
+  @property
+  def name(self):
+    """ Return the backend's registered name """
+    # Return the _name property added by ProviderBase upon registration
+    return self._name
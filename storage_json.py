@@ -0,0 +1,50 @@
+"""
+JSON Storage
+
+The numbers.json format: a JSON array of numbers, rewritten atomically on
+every save.
+"""
+# Python
+import json
+import logging
+# * * *
+from storage import Storage
+import checkpoint
+
+log = logging.getLogger(__name__)
+
+@Storage.register(name="json")
+class JSONStorage(Storage):
+
+  def __init__(self, config):
+    """
+    Args:
+      config (dict): path (str) of the file and, optionally, the number of
+                     previous versions of it to keep as generations (int)
+    """
+    self.path = config["path"]
+    self.generations = config.get("generations", 0)
+
+  def load(self):
+    """
+    Load all of the numbers
+
+    Returns:
+      [dict]: list of numbers
+    """
+
+    with open(self.path) as f:
+      return json.load(f)
+
+  def save(self, numbers):
+    """
+    Atomically rewrite the file with the numbers
+
+    Args:
+      numbers (list): all of the numbers
+
+    Returns:
+      None
+    """
+
+    checkpoint.write_atomic(self.path, numbers, generations=self.generations)
@@ -0,0 +1,332 @@
+"""
+SQLite Storage
+
+Stores the numbers in an SQLite database with a typed layout:
+
+vendors:  each vendor name once, referenced by id from the other tables
+numbers:  one row per number; id is the number's position in the list
+checks:   the vendors_checked of each number, in order
+contacts: one row per contact with a column for each of CONTACT_FIELDS
+
+Any key that is not part of the layout, or whose value is not of the expected
+type, is kept in the row's extra column as JSON, so that load() returns
+exactly what was saved. Updates are written to the database as they happen
+and committed on save().
+
+Single numbers can also be read and written by position with get() and put()
+(see jobs.py). The contacts_pending index covers the contacts that still need
+geocoding, and the database's user_version is bumped whenever the whole
+dataset is rewritten.
+"""
+# Python
+import json
+import logging
+import sqlite3
+# * * *
+from storage import Storage
+
+log = logging.getLogger(__name__)
+
+# Keys of a number, as flags for the keys present
+HAS_VENDOR   = 1
+HAS_CONTACTS = 2
+HAS_CHECKED  = 4
+NUMBER_KEYS = ("number", "vendor", "contacts", "vendors_checked")
+
+# Typed contact columns
+CONTACT_FIELDS = (
+  ("firstname",      str),
+  ("lastname",       str),
+  ("address",        str),
+  ("line2",          str),
+  ("city",           str),
+  ("state",          str),
+  ("zip",            str),
+  ("country",        str),
+  ("startdate",      str),
+  ("carrier",        str),
+  ("phone",          str),
+  ("linetype",       str),
+  ("restricted",     bool),
+  ("geocoded",       bool),
+  ("formatted_addr", str),
+  ("geo_accuracy",   str),
+  ("latitude",       float),
+  ("longitude",      float),
+)
+CONTACT_INDEX = {key: i for i, (key, _) in enumerate(CONTACT_FIELDS)}
+SQL_TYPES = {str: "TEXT", bool: "INTEGER", float: "REAL"}
+
+# Contacts with an address that has not been geocoded
+CONTACTS_PENDING = "state IS NOT NULL AND (geocoded IS NULL OR geocoded = 0)"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vendors (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS numbers (
+  id INTEGER PRIMARY KEY,
+  number TEXT NOT NULL,
+  vendor_id INTEGER REFERENCES vendors(id),
+  flags INTEGER NOT NULL,
+  extra TEXT
+);
+CREATE TABLE IF NOT EXISTS checks (
+  number_id INTEGER NOT NULL,
+  seq INTEGER NOT NULL,
+  vendor_id INTEGER NOT NULL REFERENCES vendors(id),
+  PRIMARY KEY (number_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS contacts (
+  number_id INTEGER NOT NULL,
+  seq INTEGER NOT NULL,
+  present INTEGER NOT NULL,
+  {fields},
+  extra TEXT,
+  PRIMARY KEY (number_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS contacts_pending ON contacts (number_id)
+  WHERE {pending};
+""".format(pending=CONTACTS_PENDING, fields=",\n  ".join("{} {}".format(key, SQL_TYPES[kind]) for key, kind in CONTACT_FIELDS))
+
+INSERT_CONTACT = "INSERT INTO contacts VALUES ({})".format(", ".join("?" * (len(CONTACT_FIELDS) + 4)))
+
+@Storage.register(name="sqlite")
+class SQLiteStorage(Storage):
+
+  def __init__(self, config):
+    """
+    Args:
+      config (dict): path (str) of the database file
+    """
+    self.path = config["path"]
+    self.db = sqlite3.connect(self.path)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+
+    # Interned vendor names
+    self.vendor_ids = {name: id for id, name in self.db.execute("SELECT id, name FROM vendors")}
+    self.vendor_names = {id: name for name, id in self.vendor_ids.items()}
+
+    # Number of numbers in the database, once known to match the caller's list
+    self.count = None
+
+  def load(self):
+    """
+    Load all of the numbers
+
+    Returns:
+      [dict]: list of numbers
+    """
+
+    numbers = []
+    for id, number, vendor_id, flags, extra in self.db.execute(
+        "SELECT id, number, vendor_id, flags, extra FROM numbers ORDER BY id"):
+      if id != len(numbers):
+        raise ValueError("{}: numbers are not contiguous at id {}".format(self.path, id))
+      numbers.append(self._decode_number(number, vendor_id, flags, extra))
+
+    for number_id, vendor_id in self.db.execute(
+        "SELECT number_id, vendor_id FROM checks ORDER BY number_id, seq"):
+      numbers[number_id]["vendors_checked"].append(self.vendor_names[vendor_id])
+
+    for row in self.db.execute("SELECT * FROM contacts ORDER BY number_id, seq"):
+      numbers[row[0]]["contacts"].append(self._decode_contact(row))
+
+    self.count = len(numbers)
+    return numbers
+
+  def save(self, numbers):
+    """
+    Commit the updated numbers, or rewrite all of them if the database does not
+    hold the same list
+
+    Args:
+      numbers (list): all of the numbers
+
+    Returns:
+      None
+    """
+
+    if self.count != len(numbers):
+      log.debug("Writing {} numbers to {}".format(len(numbers), self.path))
+      self.db.execute("DELETE FROM contacts")
+      self.db.execute("DELETE FROM checks")
+      self.db.execute("DELETE FROM numbers")
+      for index in range(len(numbers)):
+        self._write_number(index, numbers[index])
+      self.count = len(numbers)
+      self.db.execute("PRAGMA user_version={}".format(self.generation + 1))
+
+    self.db.commit()
+
+  def update(self, numbers, index):
+    """
+    Write numbers[index] to the database, to be committed by the next save()
+
+    Args:
+      numbers (list): all of the numbers
+      index (int): position of the updated number in numbers
+
+    Returns:
+      None
+    """
+
+    # Until the database holds the same list, save() rewrites everything
+    if self.count != len(numbers):
+      return
+
+    self.put(index, numbers[index])
+
+  def get(self, index):
+    """
+    Load a single number
+
+    Args:
+      index (int): position of the number
+
+    Returns:
+      dict: the number
+    """
+
+    row = self.db.execute("SELECT number, vendor_id, flags, extra FROM numbers WHERE id=?", (index,)).fetchone()
+    if row is None:
+      raise IndexError("{}: no number at {}".format(self.path, index))
+    number = self._decode_number(*row)
+
+    for vendor_id, in self.db.execute("SELECT vendor_id FROM checks WHERE number_id=? ORDER BY seq", (index,)):
+      number["vendors_checked"].append(self.vendor_names[vendor_id])
+
+    for row in self.db.execute("SELECT * FROM contacts WHERE number_id=? ORDER BY seq", (index,)):
+      number["contacts"].append(self._decode_contact(row))
+
+    return number
+
+  def put(self, index, number):
+    """
+    Write a single number in place of the one at index, to be committed by the next save()
+
+    Args:
+      index (int): position of the number
+      number (dict): the number
+
+    Returns:
+      None
+    """
+
+    self.db.execute("DELETE FROM contacts WHERE number_id=?", (index,))
+    self.db.execute("DELETE FROM checks WHERE number_id=?", (index,))
+    self._write_number(index, number)
+
+  @property
+  def generation(self):
+    """ Return the number of times the whole dataset has been rewritten """
+    return self.db.execute("PRAGMA user_version").fetchone()[0]
+
+  def close(self):
+    """
+    Close the database, discarding any uncommitted updates
+    """
+    self.db.close()
+
+  def _write_number(self, index, number):
+    """
+    Insert the rows of a number whose checks and contacts have been deleted
+    """
+
+    flags = 0
+    vendor_id = None
+    if "vendor" in number:
+      flags |= HAS_VENDOR
+      if number["vendor"] is not None:
+        vendor_id = self.vendor_id(number["vendor"])
+    if "contacts" in number:
+      flags |= HAS_CONTACTS
+    if "vendors_checked" in number:
+      flags |= HAS_CHECKED
+
+    extra = {key: value for key, value in number.items() if key not in NUMBER_KEYS}
+    if type(number["number"]) is not str:
+      # Keep e.g. a number stored as an int as is; the column holds its text
+      extra["number"] = number["number"]
+    self.db.execute(
+      "INSERT OR REPLACE INTO numbers VALUES (?, ?, ?, ?, ?)",
+      (index, str(number["number"]), vendor_id, flags, json.dumps(extra) if extra else None))
+
+    self.db.executemany(
+      "INSERT INTO checks VALUES (?, ?, ?)",
+      [(index, seq, self.vendor_id(name)) for seq, name in enumerate(number.get("vendors_checked", []))])
+
+    self.db.executemany(
+      INSERT_CONTACT,
+      [self._encode_contact(index, seq, contact) for seq, contact in enumerate(number.get("contacts") or [])])
+
+  def _decode_number(self, number, vendor_id, flags, extra):
+    """
+    Create a number from its row, with empty contacts and vendors_checked to be filled in
+    """
+
+    result = {"number": number}
+    if flags & HAS_VENDOR:
+      result["vendor"] = None if vendor_id is None else self.vendor_names[vendor_id]
+    if flags & HAS_CONTACTS:
+      result["contacts"] = []
+    if flags & HAS_CHECKED:
+      result["vendors_checked"] = []
+    if extra is not None:
+      result.update(json.loads(extra))
+
+    return result
+
+  def _encode_contact(self, number_id, seq, contact):
+    """
+    Return the contacts row of a contact
+    """
+
+    present = 0
+    values = [None] * len(CONTACT_FIELDS)
+    extra = {}
+    for key, value in contact.items():
+      i = CONTACT_INDEX.get(key)
+      if i is not None and (value is None or type(value) is CONTACT_FIELDS[i][1]):
+        values[i] = value
+        present |= 1 << i
+      else:
+        extra[key] = value
+
+    return (number_id, seq, present) + tuple(values) + (json.dumps(extra) if extra else None,)
+
+  def _decode_contact(self, row):
+    """
+    Create a contact from its contacts row
+    """
+
+    present = row[2]
+    contact = {}
+    for i, (key, kind) in enumerate(CONTACT_FIELDS):
+      if present & (1 << i):
+        value = row[3 + i]
+        if kind is bool and value is not None:
+          value = bool(value)
+        contact[key] = value
+
+    extra = row[-1]
+    if extra is not None:
+      contact.update(json.loads(extra))
+
+    return contact
+
+  def vendor_id(self, name):
+    """
+    Return the id of the vendor name, adding it if needed
+    """
+
+    vendor_id = self.vendor_ids.get(name)
+    if vendor_id is None:
+      vendor_id = self.db.execute("INSERT INTO vendors (name) VALUES (?)", (name,)).lastrowid
+      self.vendor_ids[name] = vendor_id
+      self.vendor_names[vendor_id] = name
+
+    return vendor_id
@@ -0,0 +1,197 @@
+"""
+Stream
+
+Read and write the numbers one at a time so that memory use stays bounded no
+matter how big the numbers file is. Two formats are supported:
+
+array: the numbers.json format, a JSON array of numbers
+lines: JSON Lines, one number per line
+
+iter_numbers detects the format of the input and NumberWriter writes either
+one. The output is written to a temporary file that replaces the destination
+only once it is complete, so the destination may also be the input.
+"""
+# Python
+import json
+import logging
+import os
+import tempfile
+# * * *
+import checkpoint
+
+log = logging.getLogger(__name__)
+
+ARRAY = "array"
+LINES = "lines"
+
+CHUNK_SIZE = 64 * 1024
+
+def detect_format(path):
+  """
+  Return the format of the numbers file
+
+  Args:
+    path (str): path of the numbers file
+
+  Returns:
+    str: ARRAY if the file is a JSON array, otherwise LINES
+  """
+
+  with open(path) as f:
+    while True:
+      c = f.read(1)
+      if c == "" or not c.isspace():
+        return ARRAY if c == "[" else LINES
+
+def iter_numbers(path, chunk_size=CHUNK_SIZE):
+  """
+  Parse the numbers in the file incrementally
+
+  Args:
+    path (str): path of the numbers file, in either format
+    chunk_size (int): number of characters to read at a time
+
+  Returns:
+    generator of dicts
+  """
+
+  fmt = detect_format(path)
+  with open(path) as f:
+    if fmt == ARRAY:
+      for number in _iter_array(f, chunk_size):
+        yield number
+    else:
+      for line in f:
+        line = line.strip()
+        if line:
+          yield json.loads(line)
+
+def _iter_array(f, chunk_size):
+  """
+  Yield the elements of the JSON array in f, reading chunk_size characters at a time
+  """
+
+  decoder = json.JSONDecoder()
+  buf = ""
+  pos = 0
+  eof = False
+  started = False
+
+  while True:
+    # Skip whitespace and separators
+    while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+      pos += 1
+
+    # Keep at least a chunk buffered
+    if not eof and len(buf) - pos < chunk_size:
+      more = f.read(chunk_size)
+      eof = more == ""
+      buf = buf[pos:] + more
+      pos = 0
+      continue
+
+    if pos == len(buf):
+      raise ValueError("Unexpected end of JSON array")
+
+    if not started:
+      if buf[pos] != "[":
+        raise ValueError("Expected a JSON array")
+      started = True
+      pos += 1
+      continue
+
+    if buf[pos] == "]":
+      return
+
+    # Parse the next element. If it runs to the end of the buffer, it may be
+    # cut off, so read more and try again.
+    try:
+      number, end = decoder.raw_decode(buf, pos)
+    except ValueError:
+      if eof:
+        raise
+      end = len(buf)
+    if end == len(buf) and not eof:
+      more = f.read(chunk_size)
+      eof = more == ""
+      buf = buf[pos:] + more
+      pos = 0
+      continue
+
+    yield number
+    pos = end
+
+class NumberWriter(object):
+  """
+  Write numbers one at a time, replacing the destination file when closed
+
+  Use as a context manager. If the block raises, the destination is left as it was.
+  """
+
+  def __init__(self, path, fmt=ARRAY, generations=0):
+    """
+    Args:
+      path (str): path of the file to write
+      fmt (str): ARRAY or LINES
+      generations (int): number of previous versions of path to keep
+    """
+    self.path = path
+    self.fmt = fmt
+    self.generations = generations
+    self.count = 0
+
+    fd, self._tmp_path = tempfile.mkstemp(
+      prefix=os.path.basename(path) + ".",
+      suffix=".tmp",
+      dir=os.path.dirname(os.path.abspath(path)))
+    self._file = os.fdopen(fd, "w")
+    if self.fmt == ARRAY:
+      self._file.write("[")
+
+  def write(self, number):
+    """
+    Write a number
+
+    Args:
+      number (dict): number to write
+
+    Returns:
+      None
+    """
+
+    if self.fmt == ARRAY:
+      self._file.write(",\n  " if self.count > 0 else "\n  ")
+      self._file.write(json.dumps(number, indent=2).replace("\n", "\n  "))
+    else:
+      self._file.write(json.dumps(number, separators=(",", ":")))
+      self._file.write("\n")
+    self.count += 1
+
+  def close(self):
+    """
+    Finish the file and atomically replace the destination with it
+    """
+
+    if self.fmt == ARRAY:
+      self._file.write("\n]" if self.count > 0 else "]")
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self._file.close()
+    checkpoint.replace(self._tmp_path, self.path, self.generations)
+
+  def abort(self):
+    """
+    Discard the file, leaving the destination as it was
+    """
+    self._file.close()
+    os.unlink(self._tmp_path)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.abort()
+    return False
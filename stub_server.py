@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Stub Server
+
+Local HTTP stand-in for the vendor APIs, so that the real vendor code,
+including its HTTP sessions, rate limiting and retries, can be load tested
+offline. Each response takes a simulated latency and hits, misses, fails
+(HTTP 500), times out (HTTP 504) or is throttled (HTTP 429 with Retry-After)
+at the rates of the simulation config (see simulation.py), which also takes:
+
+contacts:         number of contacts (or listings) in each hit (default 1)
+max_concurrency:  number of requests answered at once; further requests are
+                  throttled (HTTP 429) right away, like an API enforcing a
+                  concurrency limit (default 0 for no limit)
+
+python stub_server.py --port 8081 --config '{"latency": {"distribution": "longtail", "mean": 0.2}, "contacts": 3}'
+python main.py --lookup --runall --pce_id stub --pce_env dev --pce_endpoint http://localhost:8081 ...
+
+It speaks:
+
+PacificEast  POST /Services/Custom/{service}/1_0/PECustomXML.svc (SOAP ReversePhoneLookup)
+PacificEast  POST /FlexiQuery/1_4/Flexiquery.svc (SOAP FlexiQuery GetResponse)
+WhitePages   GET  /2.1/phone.json?phone_number=...&api_key=...
+"""
+# Python
+import argparse
+import hashlib
+import logging
+import threading
+import time
+# 3rd Party
+from defusedxml import ElementTree
+from pyramid.config import Configurator
+from pyramid.response import Response
+import simplejson as json
+# * * *
+import simulation
+import soap
+import wsgi_server
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8081
+DEFAULT_CONTACTS = 1
+
+FIRST_NAMES = ("Sally", "Bob", "Maria", "Wei", "Ahmed", "Priya", "John", "Aiko")
+LAST_NAMES = ("Smith", "Jones", "Garcia", "Chen", "Khan", "Patel", "Brown", "Sato")
+STREETS = ("Main St", "Oak Ave", "Elm St", "Park Blvd", "2nd St", "Maple Dr")
+CITIES = (("Anytown", "CA", "90210"), ("Springfield", "IL", "62701"), ("Seattle", "WA", "98115"))
+
+PE_LOOKUP_RESPONSE = soap.Template(b"""<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <ReversePhoneLookupResponse xmlns="http://pacificeast.com/custom">
+      <ReversePhoneLookupResult>
+        <QueryPhone>{number}</QueryPhone>
+        <PhoneServiceType>Landline</PhoneServiceType>
+        <ContactsFound>{count}</ContactsFound>
+        <Contacts>{contacts}</Contacts>
+      </ReversePhoneLookupResult>
+    </ReversePhoneLookupResponse>
+  </s:Body>
+</s:Envelope>""")
+PE_CONTACT = soap.Template(b"""
+          <Contact>
+            <FirstName>{firstname}</FirstName>
+            <LastName>{lastname}</LastName>
+            <Address>{address}</Address>
+            <City>{city}</City>
+            <State>{state}</State>
+            <Postal>{zip}</Postal>
+            <Country>US</Country>
+            <StartDate>20150601</StartDate>
+          </Contact>""")
+PE_NUMBER_TAG = "{http://pacificeast.com/custom}phoneNumber"
+
+PE_LOOKDOWN_RESPONSE = soap.Template(b"""<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <GetResponseResponse xmlns="http://pacificeast.com/">
+      <GetResponseResult xmlns:a="http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery" xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+        <a:ErrorInfo i:nil="true"/>
+        <a:LineInfo i:nil="true"/>
+        {listing_info}
+        <a:QueryType>RAD</a:QueryType>
+        <a:ReferenceID i:nil="true"/>
+        <a:ResultCode>{result_code}</a:ResultCode>
+      </GetResponseResult>
+    </GetResponseResponse>
+  </s:Body>
+</s:Envelope>""")
+PE_LISTING = soap.Template(b"""
+            <a:Listing>
+              <a:Address>{address}</a:Address>
+              <a:BusinessName/>
+              <a:Carrier>{carrier}</a:Carrier>
+              <a:City>{city}</a:City>
+              <a:Country>{country}</a:Country>
+              <a:CreationDate>20150601</a:CreationDate>
+              <a:FirstName>{firstname}</a:FirstName>
+              <a:LastName>{lastname}</a:LastName>
+              <a:ListingSource>DA</a:ListingSource>
+              <a:ListingType>RS</a:ListingType>
+              <a:NonPublished>false</a:NonPublished>
+              <a:Phone>{phone}</a:Phone>
+              <a:PhoneServiceType>{linetype}</a:PhoneServiceType>
+              <a:Ported>N</a:Ported>
+              <a:Postal>{zip}</a:Postal>
+              <a:RestrictedData>false</a:RestrictedData>
+              <a:State>{state}</a:State>
+            </a:Listing>""")
+PE_ADDRESS_TAGS = {"{http://pacificeast.com/}" + tag: key for tag, key in (
+  ("address", "address"), ("city", "city"), ("state", "state"), ("postal", "zip"), ("country", "country"))}
+
+CARRIERS = ("AT&T", "Verizon", "T-Mobile", "Sprint")
+LINE_TYPES = ("Landline", "Mobile", "VoIP")
+
+# Set by make_app
+SIMULATION = None
+CONTACTS = DEFAULT_CONTACTS
+IN_FLIGHT = None
+
+def pacificeast_lookup(request):
+  """
+  Answer a PacificEast ReversePhoneLookup
+  """
+
+  number = ""
+  node = ElementTree.fromstring(request.body).find(".//" + PE_NUMBER_TAG)
+  if node is not None and node.text:
+    number = node.text
+
+  def body(hit):
+    contacts = fake_contacts(number, CONTACTS) if hit else []
+    return PE_LOOKUP_RESPONSE.render(
+      number=number,
+      count=len(contacts),
+      contacts=soap.Raw(b"".join(PE_CONTACT.render(**contact) for contact in contacts)))
+
+  return _respond(body, "text/xml; charset=utf-8")
+
+def pacificeast_lookdown(request):
+  """
+  Answer a PacificEast FlexiQuery GetResponse (reverse address)
+  """
+
+  address = {}
+  for node in ElementTree.fromstring(request.body).iter():
+    key = PE_ADDRESS_TAGS.get(node.tag)
+    if key is not None and node.text:
+      address[key] = node.text
+
+  def body(hit):
+    if not hit:
+      return PE_LOOKDOWN_RESPONSE.render(listing_info=soap.Raw(b'<a:ListingInfo i:nil="true"/>'), result_code=0)
+
+    seed = "|".join(sorted(address.values()))
+    listings = []
+    for i, contact in enumerate(fake_contacts(seed, CONTACTS)):
+      digest = hashlib.md5("{}:{}".format(seed, i).encode("utf-8")).digest()
+      contact = dict(contact, country="US")
+      contact.update(address)
+      listings.append(PE_LISTING.render(
+        carrier=CARRIERS[digest[5] % len(CARRIERS)],
+        linetype=LINE_TYPES[digest[6] % len(LINE_TYPES)],
+        phone="{:010d}".format(2000000000 + int.from_bytes(digest[7:11], "big") % 8000000000),
+        **contact))
+    listing_info = b"<a:ListingInfo><a:Listings>" + b"".join(listings) + b"</a:Listings></a:ListingInfo>"
+    return PE_LOOKDOWN_RESPONSE.render(listing_info=soap.Raw(listing_info), result_code=len(listings))
+
+  return _respond(body, "text/xml; charset=utf-8")
+
+def whitepages_lookup(request):
+  """
+  Answer a WhitePages phone lookup
+  """
+
+  number = request.params.get("phone_number", "")
+
+  def body(hit):
+    results = []
+    for contact in (fake_contacts(number, CONTACTS) if hit else []):
+      location = {
+        "address": "{}, {}, {} {}".format(contact["address"], contact["city"], contact["state"], contact["zip"]),
+        "standard_address_line1": contact["address"],
+        "standard_address_line2": "",
+        "city": contact["city"],
+        "state_code": contact["state"],
+        "postal_code": contact["zip"],
+        "zip4": None,
+        "country_code": "US",
+        "lat_long": {"latitude": 47.6851, "longitude": -122.2926, "accuracy": "RoofTop"},
+      }
+      results.append({
+        "belongs_to": [{
+          "id": {"type": "Person"},
+          "names": [{"first_name": contact["firstname"], "last_name": contact["lastname"]}],
+          "best_location": location,
+        }],
+        "best_location": location,
+      })
+    return json.dumps({"results": results, "messages": []}).encode("utf-8")
+
+  return _respond(body, "application/json")
+
+def _respond(body, content_type):
+  """
+  Respond with body(hit) after the simulated latency, or with the simulated error
+
+  Args:
+    body (callable): returns the body (bytes) of a hit (True) or a miss (False)
+    content_type (str): content type of the body
+
+  Returns:
+    Response
+  """
+
+  if IN_FLIGHT is not None and not IN_FLIGHT.acquire(blocking=False):
+    return _throttled("Too many concurrent requests")
+
+  try:
+    outcome, seconds = SIMULATION.sample()
+    time.sleep(seconds)
+
+    if outcome == simulation.ERROR:
+      return Response("Simulated error", status=500)
+    if outcome == simulation.TIMEOUT:
+      return Response("Simulated timeout", status=504)
+    if outcome == simulation.THROTTLE:
+      return _throttled("Simulated quota error")
+
+    response = Response(body(outcome == simulation.HIT))
+    response.content_type = content_type
+    return response
+
+  finally:
+    if IN_FLIGHT is not None:
+      IN_FLIGHT.release()
+
+def _throttled(reason):
+  """ Return a quota error response """
+  response = Response(reason, status=429)
+  response.headers["Retry-After"] = str(SIMULATION.retry_after)
+  return response
+
+def fake_contacts(seed, count):
+  """
+  Return count made-up contacts that are always the same for the seed (see fake_contact)
+  """
+  return [fake_contact(seed if i == 0 else "{}:{}".format(seed, i)) for i in range(count)]
+
+def fake_contact(number):
+  """
+  Return a made-up contact that is always the same for the number
+
+  Args:
+    number (str): phone number
+
+  Returns:
+    dict: firstname, lastname, address, city, state and zip
+  """
+  digest = hashlib.md5(number.encode("utf-8")).digest()
+  city, state, postal = CITIES[digest[3] % len(CITIES)]
+  return {
+    "firstname": FIRST_NAMES[digest[0] % len(FIRST_NAMES)],
+    "lastname": LAST_NAMES[digest[1] % len(LAST_NAMES)],
+    "address": "{} {}".format(100 + digest[2], STREETS[digest[4] % len(STREETS)]),
+    "city": city,
+    "state": state,
+    "zip": postal,
+  }
+
+def make_app(config):
+  """
+  Create the stub app
+
+  Args:
+    config (dict): simulation config (see simulation.py), contacts and max_concurrency
+
+  Returns:
+    WSGI application
+  """
+
+  global SIMULATION
+  global CONTACTS
+  global IN_FLIGHT
+  SIMULATION = simulation.Simulation(config)
+  CONTACTS = config.get("contacts", DEFAULT_CONTACTS)
+  IN_FLIGHT = threading.BoundedSemaphore(config["max_concurrency"]) if config.get("max_concurrency") else None
+
+  app = Configurator()
+  app.add_route("pacificeast_lookup", "/Services/Custom/{service}/1_0/PECustomXML.svc")
+  app.add_route("pacificeast_lookdown", "/FlexiQuery/1_4/Flexiquery.svc")
+  app.add_route("whitepages_lookup", "/2.1/phone.json")
+  app.add_view(pacificeast_lookup, route_name="pacificeast_lookup", request_method="POST")
+  app.add_view(pacificeast_lookdown, route_name="pacificeast_lookdown", request_method="POST")
+  app.add_view(whitepages_lookup, route_name="whitepages_lookup", request_method="GET")
+  return app.make_wsgi_app()
+
+def main():
+  """
+  Serve the stub until SIGTERM or SIGINT
+  """
+
+  parser = argparse.ArgumentParser(description="Vendor API Stub")
+  parser.add_argument("--host",    type=str, default="127.0.0.1",                    help="Address to listen on")
+  parser.add_argument("--port",    type=int, default=DEFAULT_PORT,                   help="Port to listen on")
+  parser.add_argument("--workers", type=int, default=wsgi_server.DEFAULT_WORKERS,    help="Number of requests handled at once")
+  parser.add_argument("--config",  type=str, default="{}",                           help="Simulation config as JSON (see simulation.py)")
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  wsgi_server.serve(make_app(json.loads(args.config)), host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,30 @@
+"""
+Helpers shared by the tests
+"""
+
+# Python
+from contextlib import contextmanager
+import threading
+
+@contextmanager
+def serving(httpd):
+  """
+  Serve requests with httpd in a thread for the duration of the with block
+
+  The server is shut down, its workers finished and its socket closed on exit.
+
+  Args:
+    httpd (ThreadPoolWSGIServer): server bound to port 0 or another free port
+
+  Yields:
+    int: port the server is listening on
+  """
+
+  thread = threading.Thread(target=httpd.serve_forever)
+  thread.start()
+  try:
+    yield httpd.server_port
+  finally:
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
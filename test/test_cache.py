@@ -0,0 +1,200 @@
+"""
+Test the caches and the cached vendor and geocoder
+"""
+
+# Python
+import os
+import tempfile
+import time
+from unittest.mock import patch
+# * * *
+from cache import DiskCache, LRUCache, SingleFlight, TieredCache
+from geocode import Geocoder
+from geocode_cache import CachedGeocoder, normalize_address
+from geocode_mock import MockGeocoder
+from vendor import Vendor
+from vendor_cache import CachedVendor, normalize_number
+from vendor_mock import MockVendor
+
+class CountingVendor(MockVendor):
+  """ Mock vendor that counts its lookups, misses numbers ending in 9 and errs on numbers ending in 8 """
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.count = 0
+
+  def lookup(self, number):
+    self.count += 1
+    if number.endswith("9"):
+      return Vendor.LOOKUP_FAILED
+    if number.endswith("8"):
+      return Vendor.LOOKUP_ERROR
+    return super().lookup(number)
+
+def test_lru_eviction():
+  """ Ensure that the least recently used entry is evicted """
+  c = LRUCache(max_size=2)
+  c.put("a", 1)
+  c.put("b", 2)
+  assert c.get("a") == 1
+  c.put("c", 3)
+
+  assert c.get("b") is None
+  assert c.get("a") == 1
+  assert c.get("c") == 3
+  assert c.stats() == {"size": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+def test_lru_ttl():
+  """ Ensure that expired entries are not returned """
+  c = LRUCache(ttl=10)
+  with patch("cache.time.time", return_value=1000):
+    c.put("a", 1)
+    c.put("b", 2, ttl=100)
+  with patch("cache.time.time", return_value=1050):
+    assert c.get("a") is None
+    assert c.get("b") == 2
+
+def test_disk_cache():
+  """ Ensure that the disk cache is shared across instances and bounded """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "cache.sqlite")
+    c = DiskCache(path, max_size=2)
+    c.put("a", {"x": [1]})
+    c.put("b", 2)
+    c.put("c", 3)
+    c.close()
+
+    c = DiskCache(path, max_size=2)
+    assert len(c) == 2
+    assert c.get("a") is None
+    assert c.get("c") == 3
+    c.close()
+
+def test_tiered_cache():
+  """ Ensure that disk hits are promoted to memory """
+  with tempfile.TemporaryDirectory() as d:
+    disk = DiskCache(os.path.join(d, "cache.sqlite"))
+    disk.put("a", 1)
+    c = TieredCache(LRUCache(), disk)
+
+    assert c.get("a") == 1
+    assert c.get("a") == 1
+    assert c.get("b") is None
+    assert disk.hits == 1
+    assert c.stats()["hits"] == 2
+    assert c.stats()["misses"] == 1
+    c.close()
+
+def test_tiered_cache_ttl():
+  """ Ensure that disk hits are promoted with the time they have left """
+  with tempfile.TemporaryDirectory() as d:
+    disk = DiskCache(os.path.join(d, "cache.sqlite"))
+    disk.put("a", 1, ttl=60)
+    memory = LRUCache()
+    c = TieredCache(memory, disk)
+
+    assert c.get("a") == 1
+    assert memory._entries["a"][1] <= time.time() + 60
+    c.close()
+
+def test_disk_cache_used():
+  """ Ensure that reads don't write, and that their use still counts for eviction """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "cache.sqlite")
+    c = DiskCache(path, max_size=2)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1
+    assert not c._db.in_transaction
+    c.put("c", 3)
+    c.close()
+
+    c = DiskCache(path, max_size=2)
+    assert c.get("a") == 1
+    assert c.get("b") is None
+    c.close()
+
+def test_cached_vendor():
+  """ Ensure that repeated lookups, including misses, are answered from the cache """
+  inner = CountingVendor({"name": "counting"})
+  v = CachedVendor(inner, LRUCache())
+
+  first = v.lookup("3105550000")
+  first.contacts[0]["geocoded"] = True
+  second = v.lookup("+1 (310) 555-0000")
+  assert v.lookup("3105550009") == Vendor.LOOKUP_FAILED
+  assert v.lookup("3105550009") == Vendor.LOOKUP_FAILED
+  assert v.lookup("3105550008") == Vendor.LOOKUP_ERROR
+  assert v.lookup("3105550008") == Vendor.LOOKUP_ERROR
+
+  assert inner.count == 4
+  assert v.name == "counting"
+  assert "geocoded" not in second.contacts[0]
+
+def test_cached_vendor_no_negative():
+  """ Ensure that misses can be left uncached """
+  inner = CountingVendor({"name": "counting"})
+  v = CachedVendor(inner, LRUCache(), negative_ttl=0)
+  v.lookup("3105550009")
+  v.lookup("3105550009")
+  assert inner.count == 2
+
+def test_normalize_number():
+  assert normalize_number("+1 (310) 555-0123") == "3105550123"
+  assert normalize_number("310.555.0123") == "3105550123"
+
+def test_cached_geocoder():
+  """ Ensure that addresses that differ only in formatting are geocoded once """
+  inner = MockGeocoder({})
+  g = CachedGeocoder(inner, LRUCache())
+
+  with patch.object(inner, "geocode", wraps=inner.geocode) as geocode:
+    first = g.geocode(line1="123 Main St.", city="Anytown", region="CA", country="USA", postalCode=1234)
+    second = g.geocode(line1="123  main st", city="ANYTOWN", region="ca", country="usa", postalCode="01234")
+
+  assert geocode.call_count == 1
+  assert first == second
+  assert g.name == "mock"
+
+def test_normalize_postal_code():
+  """ Ensure that postal codes keep their letters and lose only their spacing """
+  assert normalize_address(None, None, None, None, "GBR", "sw1a 1aa")[5] == "SW1A1AA"
+  assert normalize_address(None, None, None, None, "GBR", "W1A 1AB")[5] == "W1A1AB"
+  assert normalize_address(None, None, None, None, "USA", "90210-1234")[5] == "902101234"
+
+def test_cached_geocoder_errors():
+  """ Ensure that misses are cached and errors are not """
+  inner = MockGeocoder({})
+  g = CachedGeocoder(inner, LRUCache())
+
+  with patch.object(inner, "geocode", return_value=Geocoder.GEOCODE_ERROR) as geocode:
+    g.geocode(line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210")
+    g.geocode(line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210")
+  assert geocode.call_count == 2
+
+  with patch.object(inner, "geocode", return_value=Geocoder.GEOCODE_FAILED) as geocode:
+    g.geocode(line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210")
+    assert g.geocode(line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210") == Geocoder.GEOCODE_FAILED
+  assert geocode.call_count == 1
+
+def test_cached_vendor_batch():
+  """ Ensure that only the cache misses of a batch are passed to the wrapped vendor """
+  inner = CountingVendor({"name": "counting"})
+  v = CachedVendor(inner, LRUCache())
+  v.lookup("3105550001")
+
+  results = v.lookup_batch(["3105550000", "3105550001", "3105550009"])
+
+  assert inner.count == 3
+  assert [result.success for result in results] == [True, True, False]
+
+def test_single_flight_error():
+  """ Ensure that a failed call is not remembered """
+  flights = SingleFlight()
+  try:
+    flights.do("key", lambda: 1 / 0)
+    assert False
+  except ZeroDivisionError:
+    pass
+  assert flights.do("key", lambda: 2) == 2
+  assert flights.calls == 2
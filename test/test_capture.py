@@ -0,0 +1,63 @@
+"""
+Test the payload capture
+"""
+
+# Python
+import os
+import tempfile
+from unittest.mock import patch
+# 3rd Party
+import simplejson as json
+# * * *
+from capture import Capture
+from vendor import Vendor
+from vendor_pacificeast import PacificEast
+
+def test_off():
+  """ Ensure that nothing is captured by default """
+  payloads = Capture()
+  assert not payloads.record("vendor", "lookup", 200, "<xml/>")
+  assert payloads.entries() == []
+
+def test_ring_buffer():
+  """ Ensure that only the latest payloads are kept in memory """
+  payloads = Capture(rate=1, size=2)
+  for i in range(3):
+    assert payloads.record("vendor", "lookup", 200, str(i), request=i)
+  assert [entry["payload"] for entry in payloads.entries()] == ["1", "2"]
+  assert payloads.captured == 3
+
+def test_sampling():
+  """ Ensure that payloads are captured at the rate """
+  payloads = Capture(rate=0.5, size=1000)
+  with patch("capture.random.random", side_effect=[0.1, 0.9, 0.4, 0.6]):
+    captured = [payloads.record("vendor", "lookup", 200, str(i)) for i in range(4)]
+  assert captured == [True, False, True, False]
+
+def test_file_sink():
+  """ Ensure that captured payloads are appended to the file as JSON Lines """
+  with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "payloads.jsonl")
+    payloads = Capture(rate=1, path=path)
+    payloads.record("vendor", "lookup", 200, "<xml/>", request="3105550123")
+    payloads.record("vendor", "lookup", 500, "")
+    payloads.close()
+
+    with open(path) as f:
+      entries = [json.loads(line) for line in f]
+    assert [entry["status"] for entry in entries] == [200, 500]
+    assert entries[0]["request"] == "3105550123"
+
+def test_vendor_capture():
+  """ Ensure that the vendors pass their responses to the capture in use """
+  s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
+  with patch("capture.CAPTURE", Capture(rate=1)) as payloads:
+    s._lookup_response(500, "Server Error")
+  assert payloads.entries()[0]["source"] == "PacificEast-public"
+  assert payloads.entries()[0]["payload"] == "Server Error"
+
+def test_bytes_payload():
+  """ Ensure that bytes payloads are captured as text """
+  payloads = Capture(rate=1)
+  payloads.record("vendor", "lookup", 200, b'{"results": []}')
+  assert payloads.entries()[0]["payload"] == '{"results": []}'
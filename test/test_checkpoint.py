@@ -0,0 +1,58 @@
+"""
+Test the Checkpointer
+"""
+
+# Python
+import json
+import os
+import tempfile
+from unittest.mock import patch
+# * * *
+from checkpoint import Checkpointer
+import checkpoint
+
+def _load(path):
+  with open(path) as f:
+    return json.load(f)
+
+def test_write_atomic_generations():
+  """ Ensure that previous versions are kept, newest first """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    for i in range(4):
+      checkpoint.write_atomic(path, [{"number": str(i)}], generations=2)
+
+    assert _load(path) == [{"number": "3"}]
+    assert _load(path + ".1") == [{"number": "2"}]
+    assert _load(path + ".2") == [{"number": "1"}]
+    assert not os.path.exists(path + ".3")
+    assert sorted(os.listdir(d)) == ["numbers.json", "numbers.json.1", "numbers.json.2"]
+
+def test_write_atomic_failure():
+  """ Ensure that a failed write leaves the previous file in place """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    checkpoint.write_atomic(path, [{"number": "1"}])
+
+    try:
+      checkpoint.write_atomic(path, [{"number": object()}])
+    except TypeError:
+      pass
+    else:
+      assert False, "Expected TypeError"
+
+    assert _load(path) == [{"number": "1"}]
+    assert os.listdir(d) == ["numbers.json"]
+
+def test_due():
+  """ Ensure that checkpoints are due by record count or by time """
+  with tempfile.TemporaryDirectory() as d:
+    numbers = [{"number": "1"}]
+    checkpointer = Checkpointer(os.path.join(d, "numbers.json"), every_records=3, every_seconds=10)
+
+    assert checkpointer.update(numbers, 0) == False
+    assert checkpointer.update(numbers, 0) == False
+    assert checkpointer.update(numbers, 0) == True
+
+    with patch("checkpoint.time.time", return_value=checkpointer.last_save + 11):
+      assert checkpointer.update(numbers, 0) == True
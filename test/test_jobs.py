@@ -0,0 +1,117 @@
+"""
+Test the SQLite job queue
+"""
+
+# Python
+import os
+import tempfile
+from unittest.mock import patch
+# * * *
+from geocode_mock import MockGeocoder
+from jobs import JobStore
+from storage import Storage
+from vendor import Vendor
+from vendor_mock import MockVendor
+import main
+
+class MissVendor(MockVendor):
+  """ Mock vendor that never finds anything """
+
+  def lookup(self, number):
+    return Vendor.LOOKUP_FAILED
+
+def _storage(d, count):
+  storage = Storage.get("sqlite", config={"path": os.path.join(d, "numbers.sqlite")})
+  storage.save([{"number": "310555{:04d}".format(i)} for i in range(count)])
+  return storage
+
+def test_queued_lookups():
+  """ Ensure that queued lookups only touch pending numbers and match in-memory lookups """
+  waterfall = [MissVendor({"name": "miss"}), MockVendor({"name": "hit"})]
+  with tempfile.TemporaryDirectory() as d:
+    storage = _storage(d, 10)
+    storage.put(3, {"number": "3105550003", "vendor": "done"})
+    storage.save(storage.load())
+    jobs = JobStore(storage, every_records=4)
+
+    assert jobs.prepare_lookups(waterfall) == 9
+    main.do_queued_lookups(jobs, waterfall, runall=True, workers=4)
+    assert jobs.prepare_lookups(waterfall) == 0
+
+    numbers = storage.load()
+    expected = [{"number": "310555{:04d}".format(i)} for i in range(10)]
+    expected[3]["vendor"] = "done"
+    main.do_lookups(expected, waterfall, "numbers.json", runall=True, checkpointer=_NoSave())
+    assert numbers == expected
+    storage.close()
+
+def test_queued_lookups_resume():
+  """ Ensure that a restarted run skips the numbers that were finished and committed """
+  waterfall = [MockVendor({"name": "hit"})]
+  with tempfile.TemporaryDirectory() as d:
+    storage = _storage(d, 5)
+    jobs = JobStore(storage, every_records=1)
+    jobs.prepare_lookups(waterfall)
+    for index, number in list(jobs.pending_lookups())[:2]:
+      number["vendor"] = "hit"
+      number["vendors_checked"] = ["hit"]
+      jobs.finish_lookup(index, number)
+    storage.close()
+
+    storage = Storage.get("sqlite", config={"path": os.path.join(d, "numbers.sqlite")})
+    jobs = JobStore(storage)
+    assert jobs.prepare_lookups(waterfall) == 3
+    assert [index for index, _ in jobs.pending_lookups()] == [2, 3, 4]
+    storage.close()
+
+def test_queued_lookups_misses():
+  """ Ensure that numbers checked by every vendor are dequeued until the waterfall changes """
+  with tempfile.TemporaryDirectory() as d:
+    storage = _storage(d, 3)
+    jobs = JobStore(storage)
+    main.do_queued_lookups(jobs, [MissVendor({"name": "miss"})], runall=True)
+    assert jobs.prepare_lookups([MissVendor({"name": "miss"})]) == 0
+    assert jobs.prepare_lookups([MissVendor({"name": "miss"}), MockVendor({"name": "hit"})]) == 3
+    storage.close()
+
+def test_queued_geocoding():
+  """ Ensure that only contacts that need geocoding are read """
+  with tempfile.TemporaryDirectory() as d:
+    storage = _storage(d, 4)
+    main.do_queued_lookups(JobStore(storage), [MockVendor({"name": "hit"})], runall=True)
+    storage.put(1, dict(storage.get(1), contacts=[{"state": "CA", "geocoded": True}]))
+    jobs = JobStore(storage)
+    assert jobs.count_geocodes() == 3
+
+    main.do_queued_geocoding(jobs, MockGeocoder({}), runall=True)
+
+    assert jobs.count_geocodes() == 0
+    assert [index for index, _ in jobs.pending_geocodes()] == []
+    assert storage.get(0)["contacts"][0]["geocoded"] is True
+    storage.close()
+
+def test_pending_batches():
+  """ Ensure that pending numbers are read in batches and can be written while iterating """
+  with tempfile.TemporaryDirectory() as d:
+    storage = _storage(d, 7)
+    jobs = JobStore(storage)
+    waterfall = [MockVendor({"name": "hit"})]
+    jobs.prepare_lookups(waterfall)
+
+    with patch("jobs.BATCH_SIZE", 2):
+      seen = []
+      for index, number in jobs.pending_lookups():
+        seen.append(index)
+        jobs.finish_lookup(index, dict(number, vendor="hit", vendors_checked=["hit"]))
+
+    assert seen == list(range(7))
+    storage.close()
+
+class _NoSave(object):
+  """ Checkpointer that does nothing """
+
+  def update(self, numbers, index):
+    return False
+
+  def save(self, numbers):
+    pass
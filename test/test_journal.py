@@ -0,0 +1,54 @@
+"""
+Test the Journal
+"""
+
+# Python
+import os
+import tempfile
+# * * *
+from journal import Journal
+
+def test_replay():
+  """ Ensure that appended records are replayed onto the numbers """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json.journal")
+
+    journal = Journal(path)
+    journal.append(1, {"number": "3105550001", "vendor": "mock", "contacts": []})
+    journal.append(1, {"number": "3105550001", "vendor": "mock", "contacts": [{"lastname": "Smith"}]})
+    journal.close()
+    assert len(journal) == 2
+
+    numbers = [{"number": "3105550000"}, {"number": "3105550001"}]
+    assert Journal(path).replay(numbers) == 2
+    assert numbers[0] == {"number": "3105550000"}
+    assert numbers[1]["contacts"] == [{"lastname": "Smith"}]
+
+def test_replay_partial_record():
+  """ Ensure that a record cut off by a crash is ignored """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json.journal")
+
+    journal = Journal(path)
+    journal.append(0, {"number": "3105550000", "vendor": "mock"})
+    journal.close()
+    with open(path, "a") as f:
+      f.write('{"index": 1, "number": {"numb')
+
+    numbers = [{"number": "3105550000"}, {"number": "3105550001"}]
+    assert Journal(path).replay(numbers) == 1
+    assert numbers == [{"number": "3105550000", "vendor": "mock"}, {"number": "3105550001"}]
+
+def test_truncate():
+  """ Ensure that nothing is replayed after truncating """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json.journal")
+
+    journal = Journal(path)
+    journal.append(0, {"number": "3105550000", "vendor": "mock"})
+    journal.truncate()
+    assert len(journal) == 0
+
+    numbers = [{"number": "3105550000"}]
+    assert Journal(path).replay(numbers) == 0
+    assert numbers == [{"number": "3105550000"}]
@@ -0,0 +1,189 @@
+"""
+Test the lookup and geocoding runs
+"""
+
+# Python
+import json
+import os
+import tempfile
+from unittest.mock import patch
+# * * *
+from checkpoint import Checkpointer
+from geocode_mock import MockGeocoder
+from journal import Journal
+from vendor import Vendor
+from vendor_mock import MockVendor
+import checkpoint
+import main
+
+class MissVendor(MockVendor):
+  """ Mock vendor that never finds anything """
+
+  def lookup(self, number):
+    return Vendor.LOOKUP_FAILED
+
+def _numbers(count):
+  return [{"number": "310555{:04d}".format(i)} for i in range(count)]
+
+def test_lookup_waterfall():
+  """ Ensure that the waterfall stops at the first hit and records the vendors checked """
+  numbers = _numbers(3)
+  numbers[1]["vendor"] = "done"
+  waterfall = [MissVendor({"name": "miss"}), MockVendor({"name": "hit"}), MockVendor({"name": "unused"})]
+
+  with patch("main.Checkpointer"):
+    main.do_lookups(numbers, waterfall, "numbers.json", runall=True)
+
+  assert numbers[0]["vendor"] == "hit"
+  assert numbers[0]["vendors_checked"] == ["miss", "hit"]
+  assert numbers[1] == {"number": "3105550001", "vendor": "done"}
+  assert numbers[2]["contacts"][0]["lastname"] == "Smith"
+
+def test_lookup_errors():
+  """ Ensure that a run with simulated vendor errors completes, leaving the failed numbers to retry """
+  numbers = _numbers(200)
+  waterfall = [MockVendor({"name": "flaky", "error_rate": 0.05, "timeout_rate": 0.05, "timeout": 0, "seed": 1})]
+
+  with patch("main.Checkpointer"):
+    main.do_lookups(numbers, waterfall, "numbers.json", runall=True, workers=4)
+
+  assert all("vendors_checked" in number for number in numbers)
+  assert 150 < sum(number.get("vendor") == "flaky" for number in numbers) < 200
+
+def test_lookup_workers():
+  """ Ensure that concurrent lookups produce the same results as sequential lookups """
+  waterfall = [MissVendor({"name": "miss"}), MockVendor({"name": "hit"})]
+  sequential = _numbers(50)
+  concurrent = _numbers(50)
+
+  with patch("main.Checkpointer"):
+    main.do_lookups(sequential, waterfall, "numbers.json", runall=True)
+    main.do_lookups(concurrent, waterfall, "numbers.json", runall=True, workers=8)
+
+  assert concurrent == sequential
+
+class BatchVendor(MockVendor):
+  """ Mock vendor that records its batches and hits even numbers only (or every number with even=False) """
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.even = config.get("even", True)
+    self.batches = []
+
+  def lookup(self, number):
+    if self.even and int(number) % 2:
+      return Vendor.LOOKUP_FAILED
+    return super().lookup(number)
+
+  def lookup_batch(self, numbers):
+    self.batches.append(list(numbers))
+    return super().lookup_batch(numbers)
+
+def test_lookup_batches():
+  """ Ensure that batched lookups pass each stage's pending numbers at once and match single lookups """
+  first = BatchVendor({"name": "even"})
+  waterfall = [first, MockVendor({"name": "hit"})]
+  single = _numbers(7)
+  batched = _numbers(7)
+  batched[2]["vendor"] = single[2]["vendor"] = "done"
+
+  with patch("main.Checkpointer"):
+    main.do_lookups(single, [BatchVendor({"name": "even"}), MockVendor({"name": "hit"})], "numbers.json", runall=True)
+    main.do_lookups(batched, waterfall, "numbers.json", runall=True, workers=2, batch_size=3)
+
+  assert batched == single
+  assert sorted(sorted(batch) for batch in first.batches) == [
+    ["3105550000", "3105550001", "3105550003"],
+    ["3105550004", "3105550005", "3105550006"],
+  ]
+
+def test_lookup_stages():
+  """ Ensure that breadth-first lookups run each stage for the previous stage's misses only """
+  first = BatchVendor({"name": "even"})
+  second = BatchVendor({"name": "hit", "even": False})
+  stages = main.get_stages([first, second], workers=[2, 1], batch_size=[2, 10])
+  depth_first = _numbers(6)
+  breadth_first = _numbers(6)
+
+  with patch("main.Checkpointer"):
+    main.do_lookups(depth_first, [BatchVendor({"name": "even"}), MockVendor({"name": "hit"})], "numbers.json", runall=True)
+    main.do_lookups(breadth_first, None, "numbers.json", runall=True, stages=stages)
+
+  assert breadth_first == depth_first
+  assert all(len(batch) <= 2 for batch in first.batches)
+  assert second.batches == [["3105550001", "3105550003", "3105550005"]]
+
+def test_stage_settings():
+  """ Ensure that per-stage settings default to the global setting """
+  assert main._stage_settings("8,2", 3, 1, int) == [8, 2, 1]
+  assert main._stage_settings(None, 2, 4, int) == [4, 4]
+
+def test_lookup_workers_require_runall():
+  """ Ensure that concurrent lookups cannot prompt """
+  try:
+    main.do_lookups(_numbers(1), [], "numbers.json", workers=2)
+  except ValueError:
+    pass
+  else:
+    assert False, "Expected ValueError"
+
+def test_lookup_checkpoint():
+  """ Ensure that looked-up numbers are journaled and saved at checkpoints """
+  numbers = _numbers(5)
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    journal = Journal(path + ".journal")
+    checkpointer = Checkpointer(path, every_records=2, every_seconds=None, journal=journal)
+
+    with patch.object(journal, "truncate", wraps=journal.truncate) as mock_truncate:
+      main.do_lookups(numbers, [MockVendor({})], path, runall=True, checkpointer=checkpointer)
+    journal.close()
+
+    # After records 2 and 4 and at the end
+    assert mock_truncate.call_count == 3
+    with open(path) as f:
+      assert json.load(f) == numbers
+    assert os.path.exists(path + ".1")
+
+def test_journal_rewrites():
+  """ Ensure that with a journal, numbers.json isn't rewritten every DEFAULT_EVERY_RECORDS lookups """
+  assert main._checkpoint_records(5, journal=True) == 5
+  assert main._checkpoint_records(None, journal=False) == checkpoint.DEFAULT_EVERY_RECORDS
+
+  numbers = _numbers(1000)
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    journal = Journal(path + ".journal")
+    checkpointer = Checkpointer(path, every_records=main._checkpoint_records(None, journal=True), journal=journal)
+
+    with patch("checkpoint.write_atomic", wraps=checkpoint.write_atomic) as mock_write:
+      main.do_lookups(numbers, [MockVendor({})], path, runall=True, checkpointer=checkpointer)
+    journal.close()
+
+  # Only at the end, rather than after every 100 records
+  assert mock_write.call_count == 1
+
+def test_stream():
+  """ Ensure that streaming produces the same results, in the same order, as loading the numbers """
+  # Lookups that take varying times complete out of order
+  latency = {"distribution": "normal", "mean": 0.01, "stddev": 0.01}
+  waterfall = [MissVendor({"name": "miss"}), MockVendor({"name": "hit", "latency": latency, "seed": 1})]
+  geocoder = MockGeocoder({})
+  numbers = _numbers(20)
+  numbers[3]["vendor"] = "done"
+
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    with open(path, "w") as f:
+      json.dump(numbers, f)
+
+    main.do_stream(path, waterfall=waterfall, geocoder=geocoder, runall=True, workers=4)
+    with patch("main.Checkpointer"):
+      main.do_lookups(numbers, waterfall, path, runall=True)
+      main.do_geocoding(numbers, geocoder, path, runall=True)
+
+    with open(path) as f:
+      streamed = json.load(f)
+
+  assert streamed == numbers
+  assert streamed[0]["contacts"][0]["geocoded"] == True
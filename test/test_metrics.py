@@ -0,0 +1,97 @@
+"""
+Test the metrics and the metered vendor and geocoder
+"""
+
+# Python
+from unittest.mock import patch
+# * * *
+from cache import LRUCache
+from geocode_metrics import MeteredGeocoder
+from geocode_mock import MockGeocoder
+from helpers import serving
+from metrics import Counter, Histogram
+from simulation import Simulation
+from vendor import Vendor
+from vendor_metrics import MeteredVendor
+from vendor_mock import MockVendor
+from vendor_whitepages import WhitePages
+from wsgi_server import ThreadPoolWSGIServer
+import metrics
+import stub_server
+
+def test_render():
+  """ Ensure that counters and histograms are rendered in the Prometheus text format """
+  counter = Counter("requests_total", "Requests", ("provider",))
+  counter.inc("a")
+  counter.inc("a", amount=2)
+  counter.inc('b"c')
+  lines = counter.render()
+  assert lines[1] == "# TYPE requests_total counter"
+  assert 'requests_total{provider="a"} 3' in lines
+  assert 'requests_total{provider="b\\"c"} 1' in lines
+
+  histogram = Histogram("seconds", "Latency", ("provider",), buckets=(0.1, 1.0))
+  histogram.observe(0.05, "a")
+  histogram.observe(0.5, "a")
+  histogram.observe(5, "a")
+  lines = histogram.render()
+  assert 'seconds_bucket{provider="a",le="0.1"} 1' in lines
+  assert 'seconds_bucket{provider="a",le="1.0"} 2' in lines
+  assert 'seconds_bucket{provider="a",le="+Inf"} 3' in lines
+  assert 'seconds_count{provider="a"} 3' in lines
+
+  stats = histogram.stats("a")
+  assert stats["count"] == 3
+  assert stats["p50"] == 1.0
+  assert stats["p95"] == float("inf")
+
+def test_metered_vendor():
+  """ Ensure that lookups are counted by outcome and timed """
+  vendor = MeteredVendor(MockVendor({"name": "metered"}))
+  assert vendor.lookup("3105550123").success
+  with patch.object(vendor.vendor, "lookup", return_value=Vendor.LOOKUP_FAILED):
+    assert not vendor.lookup("3105550123").success
+  with patch.object(vendor.vendor, "lookup", side_effect=IOError("timed out")):
+    try:
+      vendor.lookup("3105550123")
+      assert False
+    except IOError:
+      pass
+
+  assert metrics.REQUESTS.value("metered", "lookup", metrics.HIT) == 1
+  assert metrics.REQUESTS.value("metered", "lookup", metrics.MISS) == 1
+  assert metrics.REQUESTS.value("metered", "lookup", metrics.ERROR) == 1
+  assert metrics.LATENCY.stats("metered", "lookup")["count"] == 3
+  assert any(line.startswith("metered lookup: 3 requests (1 hits, 1 misses, 1 errors)")
+             for line in metrics.summary("lookup"))
+
+def test_metered_http_error():
+  """ Ensure that HTTP errors from the vendor are counted as errors, not misses """
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), stub_server.make_app({}), workers=1)
+  with serving(httpd) as port:
+    endpoint = "http://127.0.0.1:{}".format(port)
+    vendor = MeteredVendor(Vendor.get("WhitePages", config={"api_key": "1234", "endpoint": endpoint, "retries": 0}))
+    with patch("stub_server.SIMULATION", Simulation({"error_rate": 1})):
+      result = vendor.lookup("3105550123")
+    assert not result.success
+    assert result.error
+    assert metrics.REQUESTS.value(vendor.name, "lookup", metrics.ERROR) == 1
+    assert metrics.REQUESTS.value(vendor.name, "lookup", metrics.MISS) == 0
+
+def test_metered_geocoder():
+  """ Ensure that geocodes are counted by outcome """
+  geocoder = MeteredGeocoder(MockGeocoder({}))
+  geocoder.geocode(line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210")
+  assert metrics.REQUESTS.value(geocoder.name, "geocode", metrics.HIT) == 1
+
+def test_cache_ratio():
+  """ Ensure that registered caches report their hit ratio """
+  results_cache = LRUCache()
+  results_cache.put("a", 1)
+  results_cache.get("a")
+  results_cache.get("b")
+  metrics.register_cache("test", results_cache)
+
+  assert metrics.cache_stats()["test"] == {"hits": 1, "misses": 1, "ratio": 0.5}
+  assert 'phone_lookup_cache_hit_ratio{cache="test"} 0.5' in metrics.render().splitlines()
+  assert "test cache: 1 hits, 1 misses (50% hit ratio)" in metrics.summary("test")
@@ -3,7 +3,10 @@ Test the PacificEast vendor
 """
 
 # Python
-from unittest.mock import patch
+import asyncio
+from unittest.mock import MagicMock, patch
+# 3rd Party
+from defusedxml import EntitiesForbidden
 # * * *
 from vendor import Vendor
 from vendor_pacificeast import PacificEast
@@ -14,16 +17,32 @@ def test_config():
   # Create an instance of the vendor
   s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
 
-  with patch("vendor_pacificeast.requests.post") as mock_post:
+  with patch.object(s.session, "post") as mock_post:
     # Configure the mock object
     mock_post.result.status_code = 200
     mock_post.result.text = XML_NO_RESULT
 
-    # Call lookup to ensure that the config passes properly to requests
+    # Call lookup to ensure that the config passes properly to the session
     s.lookup("3105550000")
     assert mock_post.called
     assert mock_post.call_count == 1
-    assert "<cus:accountID>1234</cus:accountID>" in mock_post.call_args[1]["data"]
+    assert b"<cus:accountID>1234</cus:accountID>" in mock_post.call_args[1]["data"]
+
+def test_lookdown_request():
+  """ Ensure that the address is escaped in the lookdown request """
+  s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
+  uri, xml, headers = s._lookdown_request("1 A&B <Plaza>", "Anytown", "CA", "01234", "US")
+  assert uri == s.flexi_uri
+  assert b"<pac:accountID>1234</pac:accountID>" in xml
+  assert b"<pac:address>1 A&amp;B &lt;Plaza&gt;</pac:address>" in xml
+  assert headers["SOAPAction"] == "http://pacificeast.com/IFlexiQuery/GetResponse"
+
+def test_session_config():
+  """ Ensure that the HTTP settings in the config are applied to the session """
+  s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev", "pool_size": 25, "timeout": 5})
+  assert s.session.timeout == 5
+  assert s.session.get_adapter(s.phone_uri)._pool_maxsize == 25
+  assert s.session.get_adapter(s.phone_uri).max_retries.total == 3
 
 def test_no_result():
   """ Handle response of no contacts found """
@@ -39,6 +58,18 @@ def test_multiple_contacts():
   assert lookup_result.contacts[0] == {"firstname": "Bob", "lastname": "Smith"}
   assert lookup_result.contacts[1] == {"firstname": "Sally", "lastname": "Jones"}
 
+def test_entities_forbidden():
+  """ Ensure that entity declarations are refused, however the DTD is written and whether the response is text or bytes """
+  s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
+  for doctype in ('<!DOCTYPE s:Envelope [<!ENTITY name "Bob">]>', '<!DOCTYPE  s:Envelope [<!ENTITY name SYSTEM "file:///etc/passwd">]>'):
+    xml = doctype + XML_MULTIPLE_CONTACTS.replace("Bob", "&name;")
+    for response in (xml, xml.encode("utf-8")):
+      try:
+        s._parse(response)
+        assert False
+      except EntitiesForbidden:
+        pass
+
 def test_rad_result():
   """ Ensure that RAD result is parsed correctly """
   s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
@@ -66,6 +97,34 @@ def test_rad_result():
   <a:TransactionDate>20150601</a:TransactionDate>
   """
 
+def test_async_lookup():
+  """ Ensure that the native async lookup posts the request and parses the response """
+  s = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev"})
+
+  # Fake aiohttp session whose post() returns XML_MULTIPLE_CONTACTS
+  class FakeResponse:
+    status = 200
+    async def text(self):
+      return XML_MULTIPLE_CONTACTS
+    async def __aenter__(self):
+      return self
+    async def __aexit__(self, *exc):
+      return False
+  session = MagicMock()
+  session.post.return_value = FakeResponse()
+
+  with patch("vendor_pacificeast.http_session.HAVE_AIOHTTP", True), \
+       patch("vendor_pacificeast.http_session.get_async_session", return_value=session):
+    loop = asyncio.new_event_loop()
+    try:
+      lookup_result = loop.run_until_complete(s.alookup("3105550000"))
+    finally:
+      loop.close()
+
+  assert session.post.call_count == 1
+  assert b"<cus:accountID>1234</cus:accountID>" in session.post.call_args[1]["data"]
+  assert len(lookup_result.contacts) == 2
+
 """
 XML Definitions
 """
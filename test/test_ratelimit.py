@@ -0,0 +1,107 @@
+"""
+Test the rate limiter
+"""
+
+# Python
+import asyncio
+from unittest.mock import MagicMock, patch
+# 3rd Party
+import aiohttp
+import requests
+# * * *
+from ratelimit import RateLimiter, get_limiter
+import http_session
+
+def test_token_bucket():
+  """ Ensure that tokens are handed out at the rate """
+  with patch("ratelimit.time.monotonic", return_value=100.0):
+    limiter = RateLimiter(rate=10, burst=2)
+    assert limiter._reserve() == 0
+    assert limiter._reserve() == 0
+    assert abs(limiter._reserve() - 0.1) < 1e-9
+    assert abs(limiter._reserve() - 0.2) < 1e-9
+
+  with patch("ratelimit.time.monotonic", return_value=100.5):
+    assert limiter._reserve() == 0
+
+def test_aimd():
+  """ Ensure that the rate increases additively and decreases multiplicatively within its bounds """
+  limiter = RateLimiter(rate=4, max_rate=4.25, min_rate=1.5, increase=0.1, decrease=0.5)
+  limiter.success()
+  limiter.success()
+  limiter.success()
+  assert limiter.rate == 4.25
+
+  limiter.throttled()
+  assert limiter.rate == 2.125
+  limiter.throttled()
+  assert limiter.rate == 1.5
+  assert limiter.throttles == 2
+
+def test_retry_after():
+  """ Ensure that Retry-After holds off the next request """
+  with patch("ratelimit.time.monotonic", return_value=100.0):
+    limiter = RateLimiter(rate=2, min_rate=2)
+    limiter.throttled(retry_after=3)
+    assert abs(limiter._reserve() - 3.5) < 1e-9
+
+def test_get_limiter():
+  """ Ensure that limiters are shared by name """
+  assert get_limiter("test_none", None) is None
+  assert get_limiter("test_none", {"rate": 0}) is None
+  first = get_limiter("test_shared", {"rate": 5})
+  assert get_limiter("test_shared", {"rate": 1}) is first
+  assert first.rate == 5
+
+def test_session_throttled():
+  """ Ensure that the session backs off and retries on 429 """
+  limiter = RateLimiter(rate=1000)
+  session = http_session.Session(http_session.DEFAULT_CONFIG, limiter=limiter)
+  throttled = MagicMock(status_code=429, headers={})
+  ok = MagicMock(status_code=200, headers={})
+
+  with patch.object(requests.Session, "request", side_effect=[throttled, ok]) as request:
+    response = session.get("http://example.com/")
+
+  assert response is ok
+  assert request.call_count == 2
+  assert limiter.throttles == 1
+  assert limiter.rate == 500.1
+
+class FakeResponse:
+  """ aiohttp response with the given status """
+
+  def __init__(self, status):
+    self.status = status
+    self.headers = {}
+  async def text(self):
+    return "body"
+  async def __aenter__(self):
+    return self
+  async def __aexit__(self, *exc):
+    return False
+
+def _fetch(responses, retries=3):
+  """ fetch() from a fake session answering with responses (FakeResponses or exceptions) """
+  owner = MagicMock(limiter=None, http_config=http_session.HTTPConfig(pool_size=1, timeout=1, retries=retries, backoff=0))
+  session = MagicMock()
+  session.get.side_effect = responses
+
+  with patch("http_session.get_async_session", return_value=session):
+    loop = asyncio.new_event_loop()
+    try:
+      return loop.run_until_complete(http_session.fetch(owner, "get", "http://example.com/")), session.get.call_count
+    finally:
+      loop.close()
+
+def test_fetch_retries():
+  """ Ensure that fetch retries connection errors and 5xx responses like Session does """
+  assert _fetch([FakeResponse(503), aiohttp.ClientConnectionError(), FakeResponse(200)]) == ((200, "body"), 3)
+  assert _fetch([FakeResponse(404)]) == ((404, "body"), 1)
+  # The last response is returned, or the last error raised, once the retries are used up
+  assert _fetch([FakeResponse(500)] * 2, retries=1) == ((500, "body"), 2)
+  try:
+    _fetch([FakeResponse(500), asyncio.TimeoutError()], retries=1)
+    assert False, "Expected TimeoutError"
+  except asyncio.TimeoutError:
+    pass
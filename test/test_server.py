@@ -3,10 +3,16 @@ Test the Server
 """
 
 # Python
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
 from unittest.mock import patch
 # Pyramid
 from pyramid.testing import DummyRequest
 # * * *
+from cache import LRUCache
+from vendor import Vendor
+from vendor_mock import MockVendor
 import server
 
 def test_parser():
@@ -26,3 +32,152 @@ def test_parser():
   assert req["sid"] == "123"
   assert req["token"] == "456"
   assert req["address"] == "123 Main St"
+
+class SlowVendor(MockVendor):
+  """ Mock vendor that answers after a delay, hitting or missing """
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.delay = config["delay"]
+    self.hit = config["hit"]
+    self.calls = 0
+
+  def lookdown(self, address, city, state, postalCode, country):
+    self.calls += 1
+    time.sleep(self.delay)
+    if not self.hit:
+      return Vendor.LOOKDOWN_FAILED
+    result = super().lookdown(address, city, state, postalCode, country)
+    return Vendor.LookdownResult(success=True, contacts=[dict(result.contacts[0], vendor=self.name)])
+
+ADDRESS = ("123 Main St", "Anytown", "CA", "01234", "US")
+
+def test_hedged_priority():
+  """ Ensure that a faster hit from a later vendor waits for the earlier vendors """
+  vendors = [
+    SlowVendor({"name": "first", "delay": 0.2, "hit": True}),
+    SlowVendor({"name": "second", "delay": 0.0, "hit": True}),
+  ]
+  contacts = server._lookdown(vendors, *ADDRESS, hedge_delay=0).contacts
+  assert contacts[0]["vendor"] == "first"
+
+def test_hedged_miss_latency():
+  """ Ensure that a miss takes about as long as the slowest vendor, not the sum """
+  vendors = [SlowVendor({"name": str(i), "delay": 0.1, "hit": False}) for i in range(4)]
+  start = time.time()
+  assert server._lookdown(vendors, *ADDRESS, hedge_delay=0) == Vendor.LOOKDOWN_FAILED
+  assert time.time() - start < 0.3
+  assert all(v.calls == 1 for v in vendors)
+
+def test_hedged_delay():
+  """ Ensure that the next vendor is not asked if the first answers within the delay """
+  vendors = [
+    SlowVendor({"name": "first", "delay": 0.0, "hit": True}),
+    SlowVendor({"name": "second", "delay": 0.0, "hit": True}),
+  ]
+  contacts = server._lookdown(vendors, *ADDRESS, hedge_delay=1).contacts
+  assert contacts[0]["vendor"] == "first"
+  assert vendors[1].calls == 0
+
+class FailingVendor(MockVendor):
+  """ Mock vendor whose lookdowns raise """
+
+  def lookdown(self, address, city, state, postalCode, country):
+    raise IOError("Connection reset")
+
+def test_lookdown_error():
+  """ Ensure that a vendor that raises is treated as a miss, with or without hedging """
+  vendors = [FailingVendor({"name": "failing"}), SlowVendor({"name": "second", "delay": 0.0, "hit": True})]
+  with patch("server.HEDGE_DELAY", None):
+    assert server._lookdown(vendors, *ADDRESS).contacts[0]["vendor"] == "second"
+    assert server._lookdown(vendors[:1], *ADDRESS) == Vendor.LOOKDOWN_ERROR
+  assert server._lookdown(vendors, *ADDRESS, hedge_delay=0).contacts[0]["vendor"] == "second"
+  assert server._lookdown(vendors[:1] * 2, *ADDRESS, hedge_delay=0) == Vendor.LOOKDOWN_ERROR
+
+def test_api_outage():
+  """ Ensure that an outage of every vendor is a 503, not an empty answer """
+  request = DummyRequest()
+  request.params = dict(zip(server.ADDRESS_FIELDS, ADDRESS), sid=server.SID, token=server.TOKEN)
+
+  with patch("server.VENDORS", [FailingVendor({"name": "failing"})]):
+    assert server.api(request).status_code == 503
+  with patch("server.VENDORS", [SlowVendor({"name": "miss", "delay": 0.0, "hit": False})]):
+    response = server.api(request)
+  assert response.status_code == 200
+  assert json.loads(response.text) == "[]"
+
+  request.body = json.dumps([dict(zip(server.ADDRESS_FIELDS, ADDRESS))]).encode("utf-8")
+  with patch("server.VENDORS", [FailingVendor({"name": "failing"})]):
+    lines = [json.loads(line) for line in b"".join(server.api_batch(request).app_iter).splitlines()]
+  assert lines == [{"index": 0, "error": "vendors unavailable"}]
+
+def test_batch():
+  """ Ensure that the batch endpoint streams a JSON line for each address """
+  request = DummyRequest()
+  request.params = {"sid": server.SID, "token": server.TOKEN}
+  address = dict(zip(server.ADDRESS_FIELDS, ADDRESS))
+  # Distinct addresses, so that the two lookdowns aren't coalesced
+  other = dict(address, address="1 Elm St")
+  request.body = json.dumps([address, {"address": "1 Elm St"}, other]).encode("utf-8")
+
+  vendors = [SlowVendor({"name": "first", "delay": 0.0, "hit": True})]
+  with patch("server.VENDORS", vendors):
+    response = server.api_batch(request)
+    lines = [json.loads(line) for line in b"".join(response.app_iter).splitlines()]
+
+  assert response.content_type == "application/x-ndjson"
+  assert sorted(line["index"] for line in lines) == [0, 1, 2]
+  by_index = {line["index"]: line for line in lines}
+  assert by_index[0]["data"][0]["vendor"] == "first"
+  assert by_index[1] == {"index": 1, "missing": "city"}
+  assert vendors[0].calls == 2
+
+def test_batch_unauthorized():
+  """ Ensure that the batch endpoint checks the sid and token """
+  request = DummyRequest()
+  request.params = {"sid": "nope", "token": "nope"}
+  request.body = b"[]"
+  assert server.api_batch(request).status_code == 401
+
+def test_coalesced_lookdown():
+  """ Ensure that simultaneous lookdowns of the same address make one vendor call """
+  vendors = [SlowVendor({"name": "first", "delay": 0.1, "hit": True})]
+  address = dict(zip(server.ADDRESS_FIELDS, ADDRESS))
+  spelled = dict(address, address="123  main st.")
+  with patch("server.LOOKDOWN_CACHE", None):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+      results = list(executor.map(lambda params: server._cached_lookdown(vendors, **params), [address, spelled] * 2))
+  assert all(result.contacts[0]["vendor"] == "first" for result in results)
+  assert vendors[0].calls == 1
+
+def test_cached_lookdown():
+  """ Ensure that hits are cached, and misses only with a negative TTL """
+  hit = [SlowVendor({"name": "first", "delay": 0.0, "hit": True})]
+  miss = [SlowVendor({"name": "first", "delay": 0.0, "hit": False})]
+  other = ("1 Elm St",) + ADDRESS[1:]
+  with patch("server.LOOKDOWN_CACHE", LRUCache()):
+    for _ in range(2):
+      assert server._cached_lookdown(hit, *ADDRESS).contacts[0]["vendor"] == "first"
+      assert server._cached_lookdown(miss, *other).contacts is None
+    assert hit[0].calls == 1
+    assert miss[0].calls == 2
+
+    with patch("server.NEGATIVE_TTL", 60):
+      server._cached_lookdown(miss, *other)
+      server._cached_lookdown(miss, *other)
+    assert miss[0].calls == 3
+
+def test_cached_lookdown_error():
+  """ Ensure that a lookdown at which every vendor failed is not cached, even with a negative TTL """
+  failing = [FailingVendor({"name": "failing"})]
+  with patch("server.LOOKDOWN_CACHE", LRUCache()), patch("server.NEGATIVE_TTL", 60):
+    with patch.object(failing[0], "lookdown", wraps=failing[0].lookdown) as lookdown:
+      assert server._cached_lookdown(failing, *ADDRESS).error
+      assert server._cached_lookdown(failing, *ADDRESS).error
+    assert lookdown.call_count == 2
+
+def test_metrics():
+  """ Ensure that the metrics endpoint renders the metrics """
+  response = server.metrics_view(DummyRequest())
+  assert response.content_type == "text/plain"
+  assert "# TYPE phone_lookup_requests_total counter" in response.text
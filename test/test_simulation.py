@@ -0,0 +1,119 @@
+"""
+Test the simulated providers and the stub server
+"""
+
+# Python
+import threading
+import time
+from unittest.mock import patch
+# 3rd Party
+import requests
+# * * *
+from geocode_mock import MockGeocoder
+from helpers import serving
+from ratelimit import RateLimiter
+from simulation import Simulation
+from vendor import Vendor
+from vendor_mock import MockVendor
+from vendor_pacificeast import PacificEast
+from vendor_whitepages import WhitePages
+from wsgi_server import ThreadPoolWSGIServer
+import simulation
+import stub_server
+
+def test_rates():
+  """ Ensure that outcomes are drawn at the configured rates """
+  sim = Simulation({"hit_rate": 0.5, "error_rate": 0.1, "throttle_rate": 0.2, "timeout_rate": 0.1, "seed": 1})
+  outcomes = [sim.sample()[0] for _ in range(10000)]
+  assert abs(outcomes.count(simulation.TIMEOUT) / 10000 - 0.1) < 0.02
+  assert abs(outcomes.count(simulation.ERROR) / 10000 - 0.1) < 0.02
+  assert abs(outcomes.count(simulation.THROTTLE) / 10000 - 0.2) < 0.02
+  assert abs(outcomes.count(simulation.HIT) / 10000 - 0.3) < 0.02
+
+def test_longtail():
+  """ Ensure that the long-tail latency has the configured mean and a long tail """
+  sim = Simulation({"latency": {"distribution": "longtail", "mean": 0.1, "sigma": 1.0}, "seed": 1})
+  latencies = sorted(sim.latency() for _ in range(10000))
+  assert abs(sum(latencies) / len(latencies) - 0.1) < 0.01
+  assert latencies[len(latencies) // 2] < 0.1 < latencies[int(len(latencies) * 0.99)] / 3
+
+ADDRESS = ("123 Main St", "Anytown", "CA", "90210", "US")
+
+def test_mock_vendor():
+  """ Ensure that the mock vendor misses and fails as configured, and answers instantly by default """
+  assert MockVendor({}).simulation is None
+  assert MockVendor({"hit_rate": 0}).lookup("3105550123") == Vendor.LOOKUP_FAILED
+  assert MockVendor({"error_rate": 1}).lookup("3105550123") == Vendor.LOOKUP_ERROR
+  assert MockVendor({"timeout_rate": 1, "timeout": 0}).lookdown(*ADDRESS) == Vendor.LOOKDOWN_ERROR
+  assert MockVendor({"throttle_rate": 1, "retry_after": 0}).lookup("3105550123") == Vendor.LOOKUP_ERROR
+  assert MockGeocoder({"error_rate": 1}).geocode(
+    line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210").error
+  assert not MockGeocoder({"hit_rate": 0}).geocode(
+    line1="123 Main St", city="Anytown", region="CA", country="USA", postalCode="90210").success
+
+def test_throttle_retry():
+  """ Ensure that quota errors slow the limiter down and are retried """
+  sim = Simulation({"throttle_rate": 1, "retry_after": 0})
+  limiter = RateLimiter(rate=1000, burst=10)
+  assert sim.respond(limiter=limiter, retries=2) == simulation.THROTTLE
+  assert limiter.throttles == 3
+  assert sim.respond() == simulation.THROTTLE
+
+def test_stub_server():
+  """ Ensure that the vendors get answers from the stub server """
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), stub_server.make_app({}), workers=2)
+  with serving(httpd) as port:
+    endpoint = "http://127.0.0.1:{}".format(port)
+    wp = Vendor.get("WhitePages", config={"api_key": "1234", "endpoint": endpoint})
+    result = wp.lookup("3105550123")
+    assert result.success
+    assert result.contacts[0]["firstname"] == stub_server.fake_contact("3105550123")["firstname"]
+
+    pe = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev", "endpoint": endpoint})
+    result = pe.lookup("3105550123")
+    assert result.contacts == [dict(stub_server.fake_contact("3105550123"), country="US", startdate="20150601")]
+
+    # Quota errors are retried through the vendor's rate limiter
+    with patch("stub_server.SIMULATION", Simulation({"throttle_rate": 1, "retry_after": 0})):
+      wp = Vendor.get("WhitePages", config={"api_key": "1234", "endpoint": endpoint, "retries": 1})
+      wp.session.limiter = limiter = RateLimiter(rate=1000, burst=10)
+      assert not wp.lookup("3105550123").success
+      assert limiter.throttles == 2
+
+def test_stub_server_pacificeast():
+  """ Ensure that PacificEast gets lookups and lookdowns of several contacts from the stub server """
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), stub_server.make_app({"contacts": 3}), workers=2)
+  with serving(httpd) as port:
+    endpoint = "http://127.0.0.1:{}".format(port)
+    pe = Vendor.get("pacificeast", config={"public": True, "account_id": "1234", "env": "dev", "endpoint": endpoint})
+    result = pe.lookup("3105550123")
+    assert result.success
+    assert [contact["firstname"] for contact in result.contacts] == [
+      contact["firstname"] for contact in stub_server.fake_contacts("3105550123", 3)]
+
+    result = pe.lookdown("123 Main St & Co", "Anytown", "CA", "90210", "US")
+    assert result.success
+    assert len(result.contacts) == 3
+    assert result.contacts[0]["address"] == "123 Main St & Co"
+    assert result.contacts[0]["city"] == "Anytown"
+    assert len(result.contacts[0]["phone"]) == 10
+    assert result.contacts[0]["restricted"] is False
+
+    with patch("stub_server.SIMULATION", Simulation({"hit_rate": 0})):
+      assert not pe.lookup("3105550123").success
+      assert pe.lookdown("123 Main St", "Anytown", "CA", "90210", "US").contacts == []
+
+def test_stub_server_concurrency():
+  """ Ensure that requests over the stub server's concurrency limit are throttled """
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), stub_server.make_app({"max_concurrency": 1, "latency": {"mean": 0.3}}), workers=2)
+  with serving(httpd) as port:
+    uri = "http://127.0.0.1:{}/2.1/phone.json".format(port)
+    statuses = []
+    slow = threading.Thread(target=lambda: statuses.append(requests.get(uri, params={"phone_number": "3105550123"}).status_code))
+    slow.start()
+    time.sleep(0.1)
+    response = requests.get(uri, params={"phone_number": "3105550124"})
+    slow.join()
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert statuses == [200]
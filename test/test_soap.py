@@ -0,0 +1,18 @@
+"""
+Test the SOAP request builder
+"""
+
+# * * *
+from soap import Template
+
+def test_render():
+  """ Ensure that the values are escaped and encoded into the envelope """
+  template = Template(b"<a>{one}</a><b>{two}</b>")
+  assert template.fields == ["one", "two"]
+  assert template.render(one="x & y", two="é") == "<a>x &amp; y</a><b>é</b>".encode("utf-8")
+
+def test_bind():
+  """ Ensure that bound values are filled in once and the other fields are left """
+  template = Template(b"<a>{one}</a><b>{two}</b><c>{three}</c>").bind(one="<1>", three=3)
+  assert template.fields == ["two"]
+  assert template.render(two=2) == b"<a>&lt;1&gt;</a><b>2</b><c>3</c>"
@@ -0,0 +1,75 @@
+"""
+Test the Storage backends
+"""
+
+# Python
+import os
+import tempfile
+# * * *
+from storage import Storage
+from storage_json import JSONStorage
+from storage_sqlite import SQLiteStorage
+
+NUMBERS = [
+  {"number": "3105550000"},
+  {"number": "3105550001", "vendors_checked": ["PacificEast-restricted", "PacificEast-public"]},
+  {
+    "number": "3105550002",
+    "vendor": "WhitePages",
+    "vendors_checked": ["PacificEast-restricted", "PacificEast-public", "WhitePages"],
+    "contacts": [
+      {
+        "firstname": None, "lastname": "Whitepages", "address": None,
+        "city": "Seattle", "state": "WA", "country": "US", "zip": "98115",
+        "geocoded": True, "formatted_addr": "Seattle WA 98115", "geo_accuracy": "PostalCode",
+        "latitude": 47.6851, "longitude": -122.2926,
+      },
+      {"firstname": "Bob", "zip": 12345, "restricted": False, "nickname": "Bobby"},
+    ],
+  },
+  {"number": "3105550003", "vendor": None, "contacts": [], "note": "extra keys are kept"},
+  {"number": 3105550004},
+]
+
+def test_sqlite_roundtrip():
+  """ Ensure that the sqlite backend returns exactly what was saved """
+  with tempfile.TemporaryDirectory() as d:
+    storage = Storage.get("sqlite", config={"path": os.path.join(d, "numbers.sqlite")})
+    storage.save(NUMBERS)
+    storage.close()
+
+    storage = Storage.get("sqlite", config={"path": os.path.join(d, "numbers.sqlite")})
+    assert storage.load() == NUMBERS
+    storage.close()
+
+def test_sqlite_update():
+  """ Ensure that updated numbers are written without rewriting the others """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.sqlite")
+    storage = Storage.get("sqlite", config={"path": path})
+    storage.save(NUMBERS)
+    numbers = storage.load()
+
+    numbers[0]["vendor"] = "mock"
+    numbers[0]["vendors_checked"] = ["mock"]
+    numbers[0]["contacts"] = [{"firstname": "Sally", "lastname": "Smith"}]
+    numbers[2]["contacts"].pop()
+    storage.update(numbers, 0)
+    storage.update(numbers, 2)
+    storage.save(numbers)
+    storage.close()
+
+    storage = Storage.get("sqlite", config={"path": path})
+    assert storage.load() == numbers
+    storage.close()
+
+def test_json_roundtrip():
+  """ Ensure that the json backend returns what was saved and keeps generations """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    storage = Storage.get("json", config={"path": path, "generations": 1})
+    storage.save(NUMBERS[:1])
+    storage.save(NUMBERS)
+
+    assert storage.load() == NUMBERS
+    assert Storage.get("json", config={"path": path + ".1"}).load() == NUMBERS[:1]
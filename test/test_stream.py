@@ -0,0 +1,58 @@
+"""
+Test streaming the numbers
+"""
+
+# Python
+import json
+import os
+import tempfile
+# * * *
+import stream
+
+NUMBERS = [{"number": "310555{:04d}".format(i), "contacts": [{"lastname": "Smith" * (i % 7)}]} for i in range(100)]
+
+def test_array():
+  """ Ensure that a JSON array is parsed incrementally and rewritten in the same layout """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    with open(path, "w") as f:
+      json.dump(NUMBERS, f, indent=2)
+
+    # Elements larger than a chunk must still parse
+    assert stream.detect_format(path) == stream.ARRAY
+    assert list(stream.iter_numbers(path, chunk_size=5)) == NUMBERS
+
+    with stream.NumberWriter(path) as writer:
+      for number in stream.iter_numbers(path, chunk_size=5):
+        writer.write(number)
+
+    with open(path) as f:
+      assert f.read() == json.dumps(NUMBERS, indent=2)
+
+def test_lines():
+  """ Ensure that JSON Lines are read and written """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    with stream.NumberWriter(path, fmt=stream.LINES) as writer:
+      for number in NUMBERS:
+        writer.write(number)
+
+    assert stream.detect_format(path) == stream.LINES
+    assert list(stream.iter_numbers(path)) == NUMBERS
+
+def test_abort():
+  """ Ensure that the destination is untouched if writing fails """
+  with tempfile.TemporaryDirectory() as d:
+    path = os.path.join(d, "numbers.json")
+    with open(path, "w") as f:
+      json.dump(NUMBERS, f)
+
+    try:
+      with stream.NumberWriter(path) as writer:
+        writer.write(NUMBERS[0])
+        raise RuntimeError()
+    except RuntimeError:
+      pass
+
+    assert os.listdir(d) == ["numbers.json"]
+    assert list(stream.iter_numbers(path)) == NUMBERS
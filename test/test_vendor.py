@@ -0,0 +1,106 @@
+"""
+Test the Vendor plugin interface
+"""
+
+# Python
+import asyncio
+# * * *
+from cache import LRUCache
+from ratelimit import RateLimiter
+from vendor import Vendor
+from vendor_cache import cached
+from vendor_metrics import metered
+from vendor_mock import MockVendor
+from vendor_ratelimit import limited
+import metrics
+
+def test_async_fallback():
+  """ Ensure that vendors with only synchronous methods work through the async interface """
+  s = Vendor.get("mock", config={})
+
+  loop = asyncio.new_event_loop()
+  try:
+    lookup_result = loop.run_until_complete(s.alookup("3105550000"))
+    lookdown_result = loop.run_until_complete(s.alookdown("123 Main St", "Anytown", "CA", "01234", "US"))
+  finally:
+    loop.close()
+
+  assert lookup_result == s.lookup("3105550000")
+  assert lookdown_result.success == True
+  assert lookdown_result.contacts[0]["number"] == "3105551234"
+
+def test_lookup_batch_fallback():
+  """ Ensure that vendors without a batch API look up each number of a batch """
+  s = Vendor.get("mock", config={})
+  numbers = ["3105550000", "3105550001"]
+
+  loop = asyncio.new_event_loop()
+  try:
+    async_results = loop.run_until_complete(s.alookup_batch(numbers))
+  finally:
+    loop.close()
+
+  assert s.lookup_batch(numbers) == [s.lookup(number) for number in numbers]
+  assert async_results == s.lookup_batch(numbers)
+
+class AsyncVendor(MockVendor):
+  """ Mock vendor with a native async interface, whose synchronous methods must not be used """
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.calls = []
+
+  def lookup(self, number):
+    raise AssertionError("lookup() called instead of alookup()")
+
+  def lookdown(self, address, city, state, postalCode, country):
+    raise AssertionError("lookdown() called instead of alookdown()")
+
+  async def alookup(self, number):
+    self.calls.append(("alookup", number))
+    return super().lookup(number)
+
+  async def alookup_batch(self, numbers):
+    self.calls.append(("alookup_batch", numbers))
+    return [super(AsyncVendor, self).lookup(number) for number in numbers]
+
+  async def alookdown(self, address, city, state, postalCode, country):
+    self.calls.append(("alookdown", address))
+    return super().lookdown(address, city, state, postalCode, country)
+
+class CountingLimiter(RateLimiter):
+  """ Rate limiter counting the tokens taken asynchronously """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.acquired = 0
+
+  async def aacquire(self):
+    self.acquired += 1
+    await super().aacquire()
+
+def test_async_wrappers():
+  """ Ensure that the cached, metered and rate limited wrappers pass the async calls to the vendor's native methods """
+  inner = AsyncVendor({"name": "async"})
+  limiter = CountingLimiter(rate=1000, burst=10)
+  v = cached(metered(limited(inner, limiter)), LRUCache())
+
+  loop = asyncio.new_event_loop()
+  try:
+    assert loop.run_until_complete(v.alookup("3105550000")).success
+    assert loop.run_until_complete(v.alookup("3105550000")).success
+    results = loop.run_until_complete(v.alookup_batch(["3105550000", "3105550001"]))
+    assert loop.run_until_complete(v.alookdown("123 Main St", "Anytown", "CA", "01234", "US")).success
+  finally:
+    loop.close()
+
+  assert [result.success for result in results] == [True, True]
+  assert inner.calls == [
+    ("alookup", "3105550000"),
+    ("alookup_batch", ["3105550001"]),
+    ("alookdown", "123 Main St"),
+  ]
+  assert metrics.REQUESTS.value("async", "lookup", metrics.HIT) == 1
+  assert metrics.REQUESTS.value("async", "lookup_batch", metrics.HIT) == 1
+  assert metrics.REQUESTS.value("async", "lookdown", metrics.HIT) == 1
+  assert limiter.acquired == 3
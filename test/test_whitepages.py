@@ -3,7 +3,7 @@ Test the PacificEast vendor
 """
 
 # Python
-from unittest.mock import patch
+from unittest.mock import PropertyMock, patch
 import logging
 # * * *
 from vendor import Vendor
@@ -72,6 +72,16 @@ def test_best_location():
     "longitude":-106.167145,
   }
 
+def test_lookup_bytes():
+  """ Ensure that the lookup parses the body without decoding it to text """
+  s = Vendor.get("WhitePages", config={"api_key": "1234"})
+  with patch.object(s.session, "get") as mock_get:
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.content = JSON_GOOD.encode("utf-8")
+    type(mock_get.return_value).text = PropertyMock(side_effect=AssertionError("decoded to text"))
+    lookup_result = s.lookup("2069735100")
+  assert lookup_result.contacts[0]["city"] == "Seattle"
+
 def xtest_multiple_contacts():
   """ Handle response of multiple contacts found """
   s = Vendor.get("WhitePages", config={"api_key": "1234"})
@@ -0,0 +1,57 @@
+"""
+Test the thread-pool WSGI server
+"""
+
+# Python
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import urllib.request
+# * * *
+from helpers import serving
+from wsgi_server import ThreadPoolWSGIServer
+
+def slow_app(environ, start_response):
+  """ WSGI app that takes a while to answer """
+  time.sleep(0.2)
+  start_response("200 OK", [("Content-Type", "text/plain")])
+  return [b"ok"]
+
+def test_concurrent_requests():
+  """ Ensure that slow requests are handled at the same time and finished on shutdown """
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), slow_app, workers=4)
+  with serving(httpd) as port:
+    url = "http://127.0.0.1:{}/".format(port)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+      bodies = list(executor.map(lambda _: urllib.request.urlopen(url).read(), range(4)))
+    elapsed = time.time() - start
+
+  assert bodies == [b"ok"] * 4
+  assert elapsed < 0.6
+
+def test_backpressure():
+  """ Ensure that connections beyond the workers are left in the listen backlog rather than queued """
+  release = threading.Event()
+
+  def blocking_app(environ, start_response):
+    release.wait()
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+  httpd = ThreadPoolWSGIServer(("127.0.0.1", 0), blocking_app, workers=1)
+  with serving(httpd) as port:
+    url = "http://127.0.0.1:{}/".format(port)
+    try:
+      with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(lambda: urllib.request.urlopen(url).read()) for _ in range(4)]
+        time.sleep(0.2)
+        # One request in progress, one accepted connection waiting for it, and the rest unaccepted
+        queued = httpd.executor._work_queue.qsize()
+        release.set()
+        bodies = [future.result() for future in futures]
+    finally:
+      release.set()
+
+  assert queued == 0
+  assert bodies == [b"ok"] * 4
@@ -9,8 +9,17 @@ To add a new vendor, simply:
 2. add an instance of the class to the output of get_waterfall in main.py
 3. add any required command line arguments (e.g. for API keys)
 4. Enjoy!
+
+Vendors only need to implement the synchronous lookup() and lookdown(). The
+async counterparts, alookup() and alookdown(), run those in a thread unless
+the vendor overrides them with a native non-blocking implementation.
+
+lookup_batch() looks up several numbers at once. By default it calls lookup()
+for each number; vendors whose API accepts many numbers per request should
+override it to send them together.
 """
 # Python
+import asyncio
 from abc import ABCMeta
 from abc import abstractmethod
 from collections import namedtuple
@@ -27,14 +36,18 @@ class Vendor(ProviderBase, metaclass=ABCMeta):
   LookupResult  = namedtuple("LookupResult", [
     "success",          # bool: True if the lookup was successful
     "contacts",         # array of contacts with name and address
-  ])
+    "error",            # bool: True if the lookup failed on an error (e.g. HTTP 500 or a bad response) rather than finding nothing
+  ], defaults=(False,))
   LOOKUP_FAILED = LookupResult(success=False, contacts=None)
+  LOOKUP_ERROR  = LookupResult(success=False, contacts=None, error=True)
 
   LookdownResult  = namedtuple("LookdownResult", [
     "success",          # bool: True if the lookup was successful
     "contacts",         # array of contacts with name and address
-  ])
+    "error",            # bool: True if the lookup failed on an error rather than finding nothing
+  ], defaults=(False,))
   LOOKDOWN_FAILED = LookdownResult(success=False, contacts=None)
+  LOOKDOWN_ERROR  = LookdownResult(success=False, contacts=None, error=True)
 
   @abstractmethod
   def lookup(self, number):
@@ -49,6 +62,21 @@ class Vendor(ProviderBase, metaclass=ABCMeta):
     """
     raise NotImplementedError("Implement this method in the child class")
 
+  def lookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers
+
+    By default, lookup() is called for each number. Override this in the child
+    class to look up many numbers per request.
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+    return [self.lookup(number) for number in numbers]
+
   @abstractmethod
   def lookdown(self, address, city, state, postalCode, country):
     """
@@ -66,6 +94,62 @@ class Vendor(ProviderBase, metaclass=ABCMeta):
     """
     raise NotImplementedError("Implement this method in the child class")
 
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop
+
+    By default, lookup() is run in the event loop's executor. Override this
+    in the child class to perform the lookup natively.
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, self.lookup, number)
+
+  async def alookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers without blocking the event loop
+
+    By default, alookup() is awaited for all of the numbers concurrently.
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+    return list(await asyncio.gather(*[self.alookup(number) for number in numbers]))
+
+  async def alookdown(self, address, city, state, postalCode, country):
+    """
+    Perform a lookup of name and address to phone without blocking the event loop
+
+    By default, lookdown() is run in the event loop's executor. Override this
+    in the child class to perform the lookdown natively.
+
+    Args:
+      address (str): line1 and line2 of the address to lookup
+      city (str): city of the address to lookup
+      state (str): state of the address to lookup
+      postalCode (str): five- or nine-digit postal code of the address to lookup
+      country (str): two-character ISO country code
+
+    Returns:
+      LookdownResult
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, self.lookdown, address, city, state, postalCode, country)
+
+  async def aclose(self):
+    """
+    Release any resources held for the async interface
+    """
+    pass
+
   @abstractmethod
   def name(self):
     """
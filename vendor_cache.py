@@ -0,0 +1,190 @@
+"""
+Cached Vendor
+
+Wraps any Vendor so that lookups of a number it has already looked up are
+answered from a cache instead of the vendor's API:
+
+waterfall = [cached(Vendor.get("WhitePages", config={...}), cache)]
+
+Entries are keyed by the vendor's name and the normalized number, so one
+cache can be shared by the whole waterfall. Misses are cached too, for
+negative_ttl seconds, since a vendor that missed a number will usually miss
+it again. Errors (see Vendor.LookupResult) are not cached. Lookdowns are not
+cached.
+"""
+# Python
+import logging
+import re
+# * * *
+from vendor import Vendor
+
+log = logging.getLogger(__name__)
+
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+NON_DIGITS = re.compile(r"\D")
+
+def normalize_number(number):
+  """
+  Return the number as 10 digits, without punctuation or the US country code
+
+  Args:
+    number (str): phone number (e.g. "+1 (310) 555-0123")
+
+  Returns:
+    str: the normalized number (e.g. "3105550123")
+  """
+
+  digits = NON_DIGITS.sub("", number)
+  if len(digits) == 11 and digits.startswith("1"):
+    digits = digits[1:]
+  return digits
+
+def cached(vendor, lookup_cache, negative_ttl=DEFAULT_NEGATIVE_TTL):
+  """
+  Wrap the vendor with the cache
+
+  Args:
+    vendor (Vendor): vendor to wrap
+    lookup_cache (cache): LRUCache, DiskCache or TieredCache for the lookups
+    negative_ttl (float): number of seconds to keep misses (0 to not cache them)
+
+  Returns:
+    CachedVendor
+  """
+  return CachedVendor(vendor, lookup_cache, negative_ttl=negative_ttl)
+
+class CachedVendor(Vendor):
+
+  def __init__(self, vendor, lookup_cache, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """
+    Args:
+      vendor (Vendor): vendor to wrap
+      lookup_cache (cache): LRUCache, DiskCache or TieredCache for the lookups
+      negative_ttl (float): number of seconds to keep misses (0 to not cache them)
+    """
+    self.vendor = vendor
+    self.cache = lookup_cache
+    self.negative_ttl = negative_ttl
+    self.name = vendor.name
+
+  def lookup(self, number):
+    """
+    Perform a lookup, from the cache if possible
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    result = self._get(number)
+    if result is None:
+      result = self.vendor.lookup(number)
+      self._put(number, result)
+
+    return result
+
+  def lookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers, passing only the cache misses to the wrapped vendor
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    results = [self._get(number) for number in numbers]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+      for i, result in zip(misses, self.vendor.lookup_batch([numbers[i] for i in misses])):
+        self._put(numbers[i], result)
+        results[i] = result
+
+    return results
+
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop, from the cache if possible
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    result = self._get(number)
+    if result is None:
+      result = await self.vendor.alookup(number)
+      self._put(number, result)
+
+    return result
+
+  async def alookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers without blocking the event loop, passing only the cache misses to the wrapped vendor
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    results = [self._get(number) for number in numbers]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+      for i, result in zip(misses, await self.vendor.alookup_batch([numbers[i] for i in misses])):
+        self._put(numbers[i], result)
+        results[i] = result
+
+    return results
+
+  def _get(self, number):
+    """ Return the cached LookupResult of the number, or None """
+    value = self.cache.get(self._key(number))
+    if value is None:
+      return None
+    log.debug("Cache hit for {} at {}".format(number, self.name))
+    return Vendor.LookupResult(*value)
+
+  def _put(self, number, result):
+    """ Cache the LookupResult of the number; errors aren't cached, so that they are retried """
+    if result.error:
+      return
+    if result.success:
+      self.cache.put(self._key(number), list(result))
+    elif self.negative_ttl > 0:
+      self.cache.put(self._key(number), list(result), ttl=self.negative_ttl)
+
+  def _key(self, number):
+    """ Return the cache key of the number """
+    return "{}:{}".format(self.name, normalize_number(number))
+
+  def lookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone with the wrapped vendor
+    """
+    return self.vendor.lookdown(*args, **kwargs)
+
+  async def alookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone with the wrapped vendor without blocking the event loop
+    """
+    return await self.vendor.alookdown(*args, **kwargs)
+
+  async def aclose(self):
+    """
+    Release any resources held by the wrapped vendor for the async interface
+    """
+    await self.vendor.aclose()
+
+  def name(self):
+    """
+    Return a unique representation for the vendor
+    """
+    return self.name
@@ -0,0 +1,158 @@
+"""
+Metered Vendor
+
+Wraps any Vendor so that each of its lookups and lookdowns is counted by
+outcome (hit, miss or error) and timed in the metrics registry, labelled with
+the vendor's name. Errors are the calls that raise and the results that the
+vendor marks as errors (e.g. an HTTP 500 or a response it can't parse):
+
+waterfall = [metered(Vendor.get("WhitePages", config={...}))]
+
+Wrap the vendor before caching it, so that only the requests that reach the
+vendor are measured. A batch is timed once and each of its numbers is counted.
+"""
+# Python
+import logging
+# * * *
+from vendor import Vendor
+import metrics
+
+log = logging.getLogger(__name__)
+
+def metered(vendor):
+  """
+  Wrap the vendor with the metrics
+
+  Args:
+    vendor (Vendor): vendor to wrap
+
+  Returns:
+    MeteredVendor
+  """
+  return MeteredVendor(vendor)
+
+class MeteredVendor(Vendor):
+
+  def __init__(self, vendor):
+    """
+    Args:
+      vendor (Vendor): vendor to wrap
+    """
+    self.vendor = vendor
+    self.name = vendor.name
+
+  def lookup(self, number):
+    """
+    Perform a lookup, counting and timing it
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    result = self._call("lookup", self.vendor.lookup, number)
+    metrics.REQUESTS.inc(self.name, "lookup", _outcome(result))
+    return result
+
+  def lookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers, counting each and timing the batch
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    results = self._call("lookup_batch", self.vendor.lookup_batch, numbers, count=len(numbers))
+    for result in results:
+      metrics.REQUESTS.inc(self.name, "lookup_batch", _outcome(result))
+    return results
+
+  def lookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone, counting and timing it
+    """
+
+    result = self._call("lookdown", self.vendor.lookdown, *args, **kwargs)
+    metrics.REQUESTS.inc(self.name, "lookdown", _outcome(result))
+    return result
+
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop, counting and timing it
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    result = await self._acall("lookup", self.vendor.alookup, number)
+    metrics.REQUESTS.inc(self.name, "lookup", _outcome(result))
+    return result
+
+  async def alookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers without blocking the event loop, counting each and timing the batch
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    results = await self._acall("lookup_batch", self.vendor.alookup_batch, numbers, count=len(numbers))
+    for result in results:
+      metrics.REQUESTS.inc(self.name, "lookup_batch", _outcome(result))
+    return results
+
+  async def alookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone without blocking the event loop, counting and timing it
+    """
+
+    result = await self._acall("lookdown", self.vendor.alookdown, *args, **kwargs)
+    metrics.REQUESTS.inc(self.name, "lookdown", _outcome(result))
+    return result
+
+  def _call(self, operation, func, *args, count=1, **kwargs):
+    """ Call func under the latency histogram, counting `count` errors if it raises """
+    try:
+      with metrics.LATENCY.time(self.name, operation):
+        return func(*args, **kwargs)
+    except Exception:
+      metrics.REQUESTS.inc(self.name, operation, metrics.ERROR, amount=count)
+      raise
+
+  async def _acall(self, operation, func, *args, count=1, **kwargs):
+    """ Await func under the latency histogram, counting `count` errors if it raises """
+    try:
+      with metrics.LATENCY.time(self.name, operation):
+        return await func(*args, **kwargs)
+    except Exception:
+      metrics.REQUESTS.inc(self.name, operation, metrics.ERROR, amount=count)
+      raise
+
+  async def aclose(self):
+    """
+    Release any resources held by the wrapped vendor for the async interface
+    """
+    await self.vendor.aclose()
+
+  def name(self):
+    """
+    Return a unique representation for the vendor
+    """
+    return self.name
+
+def _outcome(result):
+  """ Return the outcome of a LookupResult or LookdownResult """
+  if result.success:
+    return metrics.HIT
+  return metrics.ERROR if result.error else metrics.MISS
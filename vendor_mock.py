@@ -1,10 +1,17 @@
 """
 Mock Vendor
+
+Answers every lookup instantly with a fixed contact. With a simulation config
+(see simulation.py), it answers after a simulated latency instead, misses,
+fails, times out and is throttled at the configured rates, and is rate
+limited by its optional rate_limit config like the real vendors.
 """
 # Python
 import logging
 # * * *
 from vendor import Vendor
+import ratelimit
+import simulation
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +24,12 @@ class MockVendor(Vendor):
     else:
       self.name = "mock"
 
+    self.simulation = simulation.get(config)
+    # Only simulated requests are rate limited
+    self.limiter = None
+    if self.simulation is not None:
+      self.limiter = ratelimit.get_limiter(self.name, config.get("rate_limit"))
+
   def lookup(self, number):
     """
     Perform a lookup of a number
@@ -28,6 +41,12 @@ class MockVendor(Vendor):
       LookupResult
     """
 
+    outcome = self._simulate()
+    if outcome == simulation.MISS:
+      return Vendor.LOOKUP_FAILED
+    if outcome != simulation.HIT:
+      return Vendor.LOOKUP_ERROR
+
     return Vendor.LookupResult(
       success=True,
       contacts=[{
@@ -51,6 +70,12 @@ class MockVendor(Vendor):
       LookdownResult
     """
 
+    outcome = self._simulate()
+    if outcome == simulation.MISS:
+      return Vendor.LOOKDOWN_FAILED
+    if outcome != simulation.HIT:
+      return Vendor.LOOKDOWN_ERROR
+
     return Vendor.LookdownResult(
       success=True,
       contacts=[{
@@ -60,6 +85,14 @@ class MockVendor(Vendor):
       }
     ])
 
+  def _simulate(self):
+    """
+    Simulate the request, if configured to, returning its outcome (see Simulation.respond)
+    """
+    if self.simulation is None:
+      return simulation.HIT
+    return self.simulation.respond(limiter=self.limiter)
+
   def name(self):
     """
     Return a unique representation for the vendor
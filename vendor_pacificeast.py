@@ -4,13 +4,92 @@ PacificEast Vendor
 # Python
 import logging
 # 3rd Party
-import requests
 from defusedxml import ElementTree
 # * * *
 from vendor import Vendor
+import capture
+import http_session
+import ratelimit
+import soap
 
 log = logging.getLogger(__name__)
 
+SOAP_NS = "{http://schemas.xmlsoap.org/soap/envelope/}"
+CUSTOM_NS = "{http://pacificeast.com/custom}"
+PE_NS = "{http://pacificeast.com/}"
+FLEXI_NS = "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}"
+
+# Paths and tags of a lookup response, and the contact key of each tag of a Contact
+LOOKUP_RESULT_PATH = "{0}Body/{1}ReversePhoneLookupResponse/{1}ReversePhoneLookupResult".format(SOAP_NS, CUSTOM_NS)
+CONTACTS_FOUND_TAG = CUSTOM_NS + "ContactsFound"
+CONTACT_PATH = "{0}Contacts/{0}Contact".format(CUSTOM_NS)
+CONTACT_FIELDS = {CUSTOM_NS + tag: key for tag, key in (
+  ("FirstName", "firstname"),
+  ("LastName",  "lastname"),
+  ("Address",   "address"),
+  ("City",      "city"),
+  ("State",     "state"),
+  ("Postal",    "zip"),
+  ("Country",   "country"),
+  ("StartDate", "startdate"),
+)}
+
+# Path of the Listings of a lookdown response, and the contact key of each tag of a Listing
+LISTING_PATH = "{0}Body/{1}GetResponseResponse/{1}GetResponseResult/{2}ListingInfo/{2}Listings/{2}Listing".format(
+  SOAP_NS, PE_NS, FLEXI_NS)
+LISTING_FIELDS = {FLEXI_NS + tag: key for tag, key in (
+  ("FirstName",        "firstname"),
+  ("LastName",         "lastname"),
+  ("Address",          "address"),
+  ("City",             "city"),
+  ("State",            "state"),
+  ("Country",          "country"),
+  ("Carrier",          "carrier"),
+  ("Phone",            "phone"),
+  ("PhoneServiceType", "linetype"),
+  ("RestrictedData",   "restricted"),
+)}
+
+# Request envelopes and headers
+LOOKUP_TEMPLATE = soap.Template(b"""<?xml version="1.0" encoding="utf-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:cus="http://pacificeast.com/custom">
+  <soapenv:Header/>
+  <soapenv:Body>
+    <cus:ReversePhoneLookup>
+      <cus:accountID>{account_id}</cus:accountID>
+      <cus:phoneNumber>{number}</cus:phoneNumber>
+      <cus:queryType>{query_type}</cus:queryType>
+    </cus:ReversePhoneLookup>
+  </soapenv:Body>
+</soapenv:Envelope>
+""")
+LOOKUP_HEADERS = {
+  "Content-Type"  : "text/xml; charset=utf-8",
+  "SOAPAction"    : "http://pacificeast.com/custom/ReversePhoneLookup"
+}
+
+LOOKDOWN_TEMPLATE = soap.Template(b"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:pac="http://pacificeast.com/">
+  <soapenv:Header/>
+  <soapenv:Body>
+    <pac:GetResponse>
+      <pac:accountID>{account_id}</pac:accountID>
+      <pac:subscriber>CLI-DEMO</pac:subscriber>
+      <pac:purpose>AD</pac:purpose>
+      <pac:queryType>RAD</pac:queryType>
+      <pac:address>{address}</pac:address>
+      <pac:city>{city}</pac:city>
+      <pac:state>{state}</pac:state>
+      <pac:postal>{postalCode}</pac:postal>
+      <pac:country>{country}</pac:country>
+    </pac:GetResponse>
+  </soapenv:Body>
+</soapenv:Envelope>
+""")
+LOOKDOWN_HEADERS = {
+  "Content-Type"  : "text/xml; charset=utf-8",
+  "SOAPAction"    : "http://pacificeast.com/IFlexiQuery/GetResponse"
+}
+
 @Vendor.register(name="PacificEast")
 class PacificEast(Vendor):
 
@@ -20,11 +99,13 @@ class PacificEast(Vendor):
     
     self.name = "PacificEast-{}".format("public" if config["public"] else "restricted")
     self.account_id = config["account_id"]
+    # The endpoint can be overridden, e.g. with a stub_server
+    endpoint = config.get("endpoint")
     if config["env"] == "dev":
-      self.phone_uri = "https://clientdev.pacificeast.com/Services/Custom/2514/1_0/PECustomXML.svc"
-      self.flexi_uri  = "https://clientdev.pacificeast.com/FlexiQuery/1_4/Flexiquery.svc"
+      self.phone_uri = (endpoint or "https://clientdev.pacificeast.com") + "/Services/Custom/2514/1_0/PECustomXML.svc"
+      self.flexi_uri  = (endpoint or "https://clientdev.pacificeast.com") + "/FlexiQuery/1_4/Flexiquery.svc"
     elif config["env"] == "prod":
-      self.phone_uri = "https://secure.pacificeast.com/Services/Custom/2527/1_0/PECustomXML.svc"
+      self.phone_uri = (endpoint or "https://secure.pacificeast.com") + "/Services/Custom/2527/1_0/PECustomXML.svc"
       # self.flexi_uri  = None
     else:
       raise ValueError("PacificEast: env must be either 'dev' or 'prod'")
@@ -32,6 +113,17 @@ class PacificEast(Vendor):
 
     self.public = config["public"]
 
+    # Request envelopes with the account filled in
+    self._lookup_template = LOOKUP_TEMPLATE.bind(
+      account_id=self.account_id,
+      query_type=("PublicOnly" if self.public else "RestrictedOnly"))
+    self._lookdown_template = LOOKDOWN_TEMPLATE.bind(account_id=self.account_id)
+
+    # Keep-alive connection pool, rate limited across all PacificEast instances
+    self.http_config = http_session.get_config(config)
+    self.limiter = ratelimit.get_limiter(self._name, config.get("rate_limit"))
+    self.session = http_session.Session(self.http_config, limiter=self.limiter)
+
   def lookup(self, number):
     """
     Perform a lookup
@@ -43,38 +135,61 @@ class PacificEast(Vendor):
       LookupResult
     """
 
-    xml = """<?xml version="1.0" encoding="utf-8"?>
-    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:cus="http://pacificeast.com/custom">
-      <soapenv:Header/>
-      <soapenv:Body>
-        <cus:ReversePhoneLookup>
-          <cus:accountID>{account_id}</cus:accountID>
-          <cus:phoneNumber>{number}</cus:phoneNumber>
-          <cus:queryType>{query_type}</cus:queryType>
-        </cus:ReversePhoneLookup>
-      </soapenv:Body>
-    </soapenv:Envelope>
-    """.format(
-        account_id=self.account_id,
-        query_type=("PublicOnly" if self.public else "RestrictedOnly"),
-        number=number,
-      )
-
-    headers = {
-      "Content-Type"  : "text/xml; charset=utf-8",
-      "SOAPAction"    : "http://pacificeast.com/custom/ReversePhoneLookup"
-    }
-
-    response = requests.post(self.phone_uri, data=xml, headers=headers)
-
-    log.debug(response.status_code)
-    log.debug(response.text)
-    print(response.text)
-    
-    if( response.status_code!=200 ):
-      result = Vendor.LOOKUP_FAILED
+    uri, xml, headers = self._lookup_request(number)
+    response = self.session.post(uri, data=xml, headers=headers)
+    return self._lookup_response(response.status_code, response.text)
+
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    if not http_session.HAVE_AIOHTTP:
+      return await super().alookup(number)
+
+    uri, xml, headers = self._lookup_request(number)
+    status, text = await http_session.fetch(self, "post", uri, data=xml, headers=headers)
+    return self._lookup_response(status, text)
+
+  def _lookup_request(self, number):
+    """
+    Build the request for a lookup
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      tuple: (uri, xml (bytes), headers) to POST
+    """
+
+    xml = self._lookup_template.render(number=number)
+    return self.phone_uri, xml, LOOKUP_HEADERS
+
+  def _lookup_response(self, status_code, text):
+    """
+    Handle the response to a lookup
+
+    Args:
+      status_code (int): HTTP status of the response
+      text (str): body of the response
+
+    Returns:
+      LookupResult
+    """
+
+    capture.record(self.name, "lookup", status_code, text)
+
+    if( status_code!=200 ):
+      log.debug("{} lookup failed with HTTP {}".format(self.name, status_code))
+      result = Vendor.LOOKUP_ERROR
     else:
-      result = self._parse(response.text)
+      result = self._parse(text)
 
     return result
 
@@ -93,45 +208,76 @@ class PacificEast(Vendor):
       LookdownResult
     """
 
-    xml = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:pac="http://pacificeast.com/">
-        <soapenv:Header/>
-        <soapenv:Body>
-          <pac:GetResponse>
-            <pac:accountID>{account_id}</pac:accountID>
-            <pac:subscriber>CLI-DEMO</pac:subscriber>
-            <pac:purpose>AD</pac:purpose>
-            <pac:queryType>RAD</pac:queryType>
-            <pac:address>{address}</pac:address>
-            <pac:city>{city}</pac:city>
-            <pac:state>{state}</pac:state>
-            <pac:postal>{postalCode}</pac:postal>
-            <pac:country>{country}</pac:country>
-          </pac:GetResponse>
-       </soapenv:Body>
-    </soapenv:Envelope>
-    """.format(
-      account_id=self.account_id,
-      address=address,
-      city=city,
-      state=state,
-      postalCode=postalCode,
+    uri, xml, headers = self._lookdown_request(address, city, state, postalCode, country)
+    response = self.session.post(uri, data=xml, headers=headers)
+    return self._lookdown_response(response.status_code, response.text)
+
+  async def alookdown(self, address, city, state, postalCode, country):
+    """
+    Perform a lookup of a name and address without blocking the event loop
+
+    Args:
+      address (str): line1 and line2 of the address to lookup
+      city (str): city of the address to lookup
+      state (str): state of the address to lookup
+      postalCode (str): five- or nine-digit postal code of the address to lookup
+      country (str): two-character ISO country code
+
+    Returns:
+      LookdownResult
+    """
+
+    if not http_session.HAVE_AIOHTTP:
+      return await super().alookdown(address, city, state, postalCode, country)
+
+    uri, xml, headers = self._lookdown_request(address, city, state, postalCode, country)
+    status, text = await http_session.fetch(self, "post", uri, data=xml, headers=headers)
+    return self._lookdown_response(status, text)
+
+  async def aclose(self):
+    """
+    Close the aiohttp session, if any
+    """
+    await http_session.close_async_session(self)
+
+  def _lookdown_request(self, address, city, state, postalCode, country):
+    """
+    Build the request for a lookdown
+
+    Args:
+      address (str): line1 and line2 of the address to lookup
+      city (str): city of the address to lookup
+      state (str): state of the address to lookup
+      postalCode (str): five- or nine-digit postal code of the address to lookup
+      country (str): two-character ISO country code
+
+    Returns:
+      tuple: (uri, xml (bytes), headers) to POST
+    """
+
+    xml = self._lookdown_template.render(address=address, city=city, state=state, postalCode=postalCode,
       country=country)
+    return self.flexi_uri, xml, LOOKDOWN_HEADERS
 
-    headers = {
-      "Content-Type"  : "text/xml; charset=utf-8",
-      "SOAPAction"    : "http://pacificeast.com/IFlexiQuery/GetResponse"
-    }
+  def _lookdown_response(self, status_code, text):
+    """
+    Handle the response to a lookdown
 
-    response = requests.post(self.flexi_uri, data=xml, headers=headers)
+    Args:
+      status_code (int): HTTP status of the response
+      text (str): body of the response
 
-    log.debug(response.status_code)
-    log.debug(response.text)
-    print(response.text)
-    
-    if( response.status_code!=200 ):
-      result = Vendor.LOOKUP_FAILED
+    Returns:
+      LookdownResult
+    """
+
+    capture.record(self.name, "lookdown", status_code, text)
+
+    if( status_code!=200 ):
+      log.debug("{} lookdown failed with HTTP {}".format(self.name, status_code))
+      result = Vendor.LOOKDOWN_ERROR
     else:
-      result = self._parse_lookdown(response.text)
+      result = self._parse_lookdown(text)
 
     return result
 
@@ -150,34 +296,21 @@ class PacificEast(Vendor):
       xml = ElementTree.fromstring(response)
     except ElementTree.ParseError:
       log.error("Failed to parse xml", exc_info=True)
-      print("Failed to parse xml")
-      result = Vendor.LOOKUP_FAILED
+      return Vendor.LOOKUP_ERROR
 
-    else:
-      node = xml.find("{http://schemas.xmlsoap.org/soap/envelope/}Body/{http://pacificeast.com/custom}ReversePhoneLookupResponse/{http://pacificeast.com/custom}ReversePhoneLookupResult/{http://pacificeast.com/custom}ContactsFound")
-      if node.text == "0":
-        result = Vendor.LOOKUP_FAILED
-      else:
-        # Contacts
-        contacts = []
-        for e in xml.findall("{http://schemas.xmlsoap.org/soap/envelope/}Body/{http://pacificeast.com/custom}ReversePhoneLookupResponse/{http://pacificeast.com/custom}ReversePhoneLookupResult/{http://pacificeast.com/custom}Contacts/{http://pacificeast.com/custom}Contact"):
-          contact = {}
-          if e.find("{http://pacificeast.com/custom}FirstName") is not None: contact["firstname"] = e.find("{http://pacificeast.com/custom}FirstName").text
-          if e.find("{http://pacificeast.com/custom}LastName") is not None: contact["lastname"] = e.find("{http://pacificeast.com/custom}LastName").text
-          if e.find("{http://pacificeast.com/custom}Address") is not None: contact["address"] = e.find("{http://pacificeast.com/custom}Address").text
-          if e.find("{http://pacificeast.com/custom}City") is not None: contact["city"] = e.find("{http://pacificeast.com/custom}City").text
-          if e.find("{http://pacificeast.com/custom}State") is not None: contact["state"] = e.find("{http://pacificeast.com/custom}State").text
-          if e.find("{http://pacificeast.com/custom}Postal") is not None: contact["zip"] = e.find("{http://pacificeast.com/custom}Postal").text
-          if e.find("{http://pacificeast.com/custom}Country") is not None: contact["country"] = e.find("{http://pacificeast.com/custom}Country").text
-          if e.find("{http://pacificeast.com/custom}StartDate") is not None: contact["startdate"] = e.find("{http://pacificeast.com/custom}StartDate").text
-          contacts.append(contact)
-
-        # Done parsing. Create the LookupResult.
-        result = Vendor.LookupResult(
-          success=True,
-          contacts=contacts)
+    node = xml.find(LOOKUP_RESULT_PATH)
+    if node is None or node.findtext(CONTACTS_FOUND_TAG) in (None, "0"):
+      return Vendor.LOOKUP_FAILED
 
-    return result
+    # Contacts
+    contacts = []
+    for e in node.iterfind(CONTACT_PATH):
+      contacts.append(_read_fields(e, CONTACT_FIELDS))
+
+    # Done parsing. Create the LookupResult.
+    return Vendor.LookupResult(
+      success=True,
+      contacts=contacts)
 
   def _parse_lookdown(self, response):
     """
@@ -194,55 +327,41 @@ class PacificEast(Vendor):
       xml = ElementTree.fromstring(response)
     except ElementTree.ParseError:
       log.error("Failed to parse xml", exc_info=True)
-      print("Failed to parse xml")
-      result = Vendor.LOOKUP_FAILED
-
-    else:
-      # Contacts
-      contacts = []
-
-      # Parse listings into contacts
-      for e in xml.findall(
-        "{http://schemas.xmlsoap.org/soap/envelope/}Body" +
-        "/{http://pacificeast.com/}GetResponseResponse" +
-        "/{http://pacificeast.com/}GetResponseResult" +
-        "/{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}ListingInfo" +
-        "/{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Listings" +
-        "/{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Listing"):
-
-        # Create a contact for each listing
-        contact = {}
-        self._grab_xml_entry(contact, "firstname",  e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}FirstName")
-        self._grab_xml_entry(contact, "lastname",   e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}LastName")
-        self._grab_xml_entry(contact, "address",    e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Address")
-        self._grab_xml_entry(contact, "city",       e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}City")
-        self._grab_xml_entry(contact, "state",      e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}State")
-        self._grab_xml_entry(contact, "country",    e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Country")
-        self._grab_xml_entry(contact, "carrier",    e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Carrier")
-        self._grab_xml_entry(contact, "phone",      e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}Phone")
-        self._grab_xml_entry(contact, "linetype",   e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}PhoneServiceType")
-        self._grab_xml_entry(contact, "restricted", e, "{http://schemas.datacontract.org/2004/07/PE.RealTime.FlexiQuery}RestrictedData")
-        if "restricted" in contact: contact["restricted"] = True if contact["restricted"].lower()=="true" else False
-        if "linetype" in contact: contact["linetype"] = contact["linetype"].lower()
-        contacts.append(contact)
-
-      # Done parsing. Create the LookupResult.
-      result = Vendor.LookupResult(
-        success=True,
-        contacts=contacts)
+      return Vendor.LOOKDOWN_ERROR
 
-    return result
+    # Parse listings into contacts
+    contacts = []
+    for e in xml.iterfind(LISTING_PATH):
+      contact = _read_fields(e, LISTING_FIELDS)
+      if "restricted" in contact: contact["restricted"] = True if contact["restricted"].lower()=="true" else False
+      if "linetype" in contact: contact["linetype"] = contact["linetype"].lower()
+      contacts.append(contact)
 
-  def _grab_xml_entry(self, d, key, e, path):
-    """
-    Set the dictionary entry to e.find(path).text if e.find(path) is not None
-    """
-    node = e.find(path)
-    if node is not None:
-      d[key] = node.text
+    # Done parsing. Create the LookupResult.
+    return Vendor.LookupResult(
+      success=True,
+      contacts=contacts)
 
   def name(self):
     """
     Return a unique representation for the vendor
     """
     return self.name
+
+def _read_fields(e, fields):
+  """
+  Return a dict of the text of the children of e whose tags are in fields, in one pass over the children
+
+  Args:
+    e (Element): element to read (e.g. a Contact)
+    fields (dict): child tag to dict key
+
+  Returns:
+    dict: the first child of each tag found, as key to text
+  """
+  d = {}
+  for child in e:
+    key = fields.get(child.tag)
+    if key is not None and key not in d:
+      d[key] = child.text
+  return d
@@ -0,0 +1,131 @@
+"""
+Rate Limited Vendor
+
+Wraps any Vendor so that its lookups wait for tokens from a rate limiter of
+their own, on top of any limit the vendor applies to its requests:
+
+stage = limited(Vendor.get("WhitePages", config={...}), RateLimiter(rate=5))
+
+This lets one stage of the waterfall run slower than the vendor allows, e.g.
+to spread a vendor's quota over a long run. A batch takes one token per
+number.
+"""
+# Python
+import logging
+# * * *
+from vendor import Vendor
+
+log = logging.getLogger(__name__)
+
+def limited(vendor, limiter):
+  """
+  Wrap the vendor with the rate limiter
+
+  Args:
+    vendor (Vendor): vendor to wrap
+    limiter (RateLimiter): rate limiter for the lookups (None to return vendor as is)
+
+  Returns:
+    Vendor
+  """
+  if limiter is None:
+    return vendor
+  return RateLimitedVendor(vendor, limiter)
+
+class RateLimitedVendor(Vendor):
+
+  def __init__(self, vendor, limiter):
+    """
+    Args:
+      vendor (Vendor): vendor to wrap
+      limiter (RateLimiter): rate limiter for the lookups
+    """
+    self.vendor = vendor
+    self.limiter = limiter
+    self.name = vendor.name
+
+  def lookup(self, number):
+    """
+    Perform a lookup once a token is available
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    self.limiter.acquire()
+    return self.vendor.lookup(number)
+
+  def lookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers once a token is available for each
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    for _ in numbers:
+      self.limiter.acquire()
+    return self.vendor.lookup_batch(numbers)
+
+  def lookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone once a token is available
+    """
+
+    self.limiter.acquire()
+    return self.vendor.lookdown(*args, **kwargs)
+
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop once a token is available
+
+    Args:
+      number (str): phone number to lookup
+
+    Returns:
+      LookupResult
+    """
+
+    await self.limiter.aacquire()
+    return await self.vendor.alookup(number)
+
+  async def alookup_batch(self, numbers):
+    """
+    Perform a lookup of each of the numbers without blocking the event loop once a token is available for each
+
+    Args:
+      numbers (list of str): phone numbers to lookup
+
+    Returns:
+      list of LookupResults, in the order of numbers
+    """
+
+    for _ in numbers:
+      await self.limiter.aacquire()
+    return await self.vendor.alookup_batch(numbers)
+
+  async def alookdown(self, *args, **kwargs):
+    """
+    Perform a lookup of name and address to phone without blocking the event loop once a token is available
+    """
+
+    await self.limiter.aacquire()
+    return await self.vendor.alookdown(*args, **kwargs)
+
+  async def aclose(self):
+    """
+    Release any resources held by the wrapped vendor for the async interface
+    """
+    await self.vendor.aclose()
+
+  def name(self):
+    """
+    Return a unique representation for the vendor
+    """
+    return self.name
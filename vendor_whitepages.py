@@ -4,20 +4,30 @@ WhitePages Vendor
 # Python
 import logging
 # 3rd Party
-import requests
 import simplejson as json
 # * * *
 from vendor import Vendor
+import capture
+import http_session
+import ratelimit
 
 log = logging.getLogger(__name__)
 
+DEFAULT_ENDPOINT = "http://proapi.whitepages.com"
+
 @Vendor.register(name="WhitePages")
 class WhitePages(Vendor):
   
   def __init__(self, config):
-    self.uri_base = "http://proapi.whitepages.com/2.1/phone.json?phone_number={number}&api_key={api_key}"
+    # The endpoint can be overridden, e.g. with a stub_server
+    self.uri_base = config.get("endpoint", DEFAULT_ENDPOINT) + "/2.1/phone.json?phone_number={number}&api_key={api_key}"
     self.api_key = config["api_key"]
 
+    # Keep-alive connection pool, rate limited across all WhitePages instances
+    self.http_config = http_session.get_config(config)
+    self.limiter = ratelimit.get_limiter(self._name, config.get("rate_limit"))
+    self.session = http_session.Session(self.http_config, limiter=self.limiter)
+
   def lookup(self, number):
     """
     Perform a lookup
@@ -29,12 +39,56 @@ class WhitePages(Vendor):
       LookupResult
     """
 
-    response = requests.get(self.uri_base.format(number=number, api_key=self.api_key))
+    response = self.session.get(self._lookup_uri(number))
+    return self._lookup_response(response.status_code, response.content)
+
+  async def alookup(self, number):
+    """
+    Perform a lookup without blocking the event loop
+
+    Args:
+      number (str): phone number to lookup
 
-    if( response.status_code!=200 ):
-      result = Vendor.LOOKUP_FAILED
+    Returns:
+      LookupResult
+    """
+
+    if not http_session.HAVE_AIOHTTP:
+      return await super().alookup(number)
+
+    status, body = await http_session.fetch(self, "get", self._lookup_uri(number), binary=True)
+    return self._lookup_response(status, body)
+
+  async def aclose(self):
+    """
+    Close the aiohttp session, if any
+    """
+    await http_session.close_async_session(self)
+
+  def _lookup_uri(self, number):
+    """
+    Return the URI for a lookup of number
+    """
+    return self.uri_base.format(number=number, api_key=self.api_key)
+
+  def _lookup_response(self, status_code, body):
+    """
+    Handle the response to a lookup
+
+    Args:
+      status_code (int): HTTP status of the response
+      body (bytes): body of the response
+
+    Returns:
+      LookupResult
+    """
+
+    capture.record(self.name, "lookup", status_code, body)
+
+    if( status_code!=200 ):
+      result = Vendor.LOOKUP_ERROR
     else:
-      result = self._parse(response.text)
+      result = self._parse(body)
 
     return result
     
@@ -54,16 +108,18 @@ class WhitePages(Vendor):
 
   def _parse(self, response):
     """
-    Parse the response text
+    Parse the response body
+
+    The body can be passed as bytes, which the decoder decodes as UTF-8, so
+    that requests doesn't have to detect the charset of the response.
 
     Args:
-      response (str): the response json string
+      response (bytes or str): the response json
 
     Returns:
       LookupResult namedtuple
     """
 
-    log.debug("Parsing: {}".format(response))
     data = json.loads(response)
 
     contacts = []
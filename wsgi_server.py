@@ -0,0 +1,113 @@
+"""
+WSGI Server
+
+Thread-pool WSGI server for the reverse-address API. wsgiref's server handles
+one request at a time, so a single slow vendor lookdown holds up every other
+request. This server accepts connections in the main thread and handles them
+on a pool of worker threads:
+
+workers:  number of requests handled at once; a connection is only accepted
+          once a worker is free, so further connections wait in the kernel's
+          listen backlog (and are refused once it is full) instead of piling
+          up in memory
+timeout:  seconds a connection may sit idle while its request is read or its
+          response is written before it is dropped
+
+On SIGTERM or SIGINT, the server stops accepting connections and finishes the
+requests in progress before serve() returns.
+"""
+# Python
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import signal
+import threading
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 64
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_BACKLOG = 128
+
+class ThreadPoolWSGIServer(WSGIServer):
+  """
+  WSGIServer that handles each connection on a pool of worker threads
+  """
+
+  def __init__(self, address, app, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, handler_class=WSGIRequestHandler):
+    """
+    Args:
+      address (tuple): (host, port) to listen on; port 0 picks a free port
+      app (callable): WSGI application
+      workers (int): number of requests handled at once
+      timeout (float): seconds to wait on an idle connection
+      handler_class (class): request handler
+    """
+    self.workers = workers
+    self.request_timeout = timeout
+    self.request_queue_size = max(DEFAULT_BACKLOG, workers)
+    super().__init__(address, handler_class)
+    self.set_app(app)
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    # One slot per worker, taken from accept until the connection is closed
+    self.slots = threading.BoundedSemaphore(workers)
+
+  def process_request(self, request, client_address):
+    """ Hand the connection to a worker thread once one is free """
+    # Waiting here stops the accept loop, which leaves further connections in the listen backlog
+    self.slots.acquire()
+    try:
+      request.settimeout(self.request_timeout)
+      self.executor.submit(self._process_request, request, client_address)
+    except Exception:
+      self.slots.release()
+      raise
+
+  def _process_request(self, request, client_address):
+    """ Handle the connection in a worker thread """
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.shutdown_request(request)
+      self.slots.release()
+
+  def server_close(self):
+    """ Stop listening and wait for the requests in progress to finish """
+    super().server_close()
+    self.executor.shutdown(wait=True)
+
+def serve(app, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT):
+  """
+  Serve the WSGI app until SIGTERM or SIGINT
+
+  Args:
+    app (callable): WSGI application
+    host (str): address to listen on
+    port (int): port to listen on
+    workers (int): number of requests handled at once
+    timeout (float): seconds to wait on an idle connection
+
+  Returns:
+    None
+  """
+
+  httpd = ThreadPoolWSGIServer((host, port), app, workers=workers, timeout=timeout)
+
+  def stop(signum, frame):
+    log.info("Caught signal {}; finishing requests in progress".format(signum))
+    # shutdown() waits for serve_forever() to return, so it can't be called from its thread
+    threading.Thread(target=httpd.shutdown).start()
+
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGINT, stop)
+
+  log.info("Serving on {}:{} with {} workers".format(host, httpd.server_port, workers))
+  try:
+    httpd.serve_forever()
+  finally:
+    httpd.server_close()
+  log.info("Server stopped")